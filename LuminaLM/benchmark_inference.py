@@ -0,0 +1,288 @@
+"""
+CPU inference benchmark of LuminaLM with a regression gate.
+
+Sweeps batch size, prompt (encoder) length, generation length and precision.
+Every case runs greedy cached decoding with fixed seeds after warmup runs and
+reports encoder time, time-to-first-token, per-token p50/p90/p99 latency,
+throughput and peak RSS. Each case runs in a fresh process, so its peak RSS
+is not inflated by larger cases run before it. Results are written as JSON; with --compare, cases
+are checked against a stored baseline and the process exits non-zero when a
+metric regresses beyond the threshold.
+
+Usage:
+    python benchmark_inference.py --config_path config.yaml --output baseline.json
+    python benchmark_inference.py --config_path config.yaml --output current.json --compare baseline.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import resource
+import functools
+import itertools
+import dataclasses
+import multiprocessing
+import numpy as np
+import yaml
+import torch
+import torch.nn as nn
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+from model import LuminaLM, LuminaLMConfig
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("float32", "bfloat16", "int8")
+# Metrics where larger values are regressions; every other compared metric regresses when it shrinks
+LOWER_IS_BETTER = (
+    'encoder_ms', 'ttft_ms', 'per_token_p50_ms', 'per_token_p90_ms', 'per_token_p99_ms', 'peak_rss_mb'
+)
+HIGHER_IS_BETTER = ('tokens_per_sec',)
+
+
+@dataclass(frozen=True)
+class InferenceCase:
+    """One point of the sweep."""
+    batch_size: int
+    prompt_length: int
+    generation_length: int
+    precision: str = "float32"
+
+
+def prepare_model(model: LuminaLM, precision: str) -> nn.Module:
+    """Copy of the model in the requested CPU precision; int8 uses dynamic Linear quantization."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}'. Expected one of {PRECISIONS}.")
+    prepared = LuminaLM(model.config)
+    prepared.load_state_dict(model.state_dict())
+    prepared.eval()
+    if precision == "bfloat16":
+        return prepared.to(torch.bfloat16)
+    if precision == "int8":
+        return torch.ao.quantization.quantize_dynamic(prepared, {nn.Linear}, dtype=torch.qint8)
+    return prepared
+
+
+@torch.no_grad()
+def timed_generation(model: LuminaLM, input_ids: torch.Tensor, generation_length: int) -> Tuple[float, List[float]]:
+    """
+    Greedy cached decoding with per-step timing.
+
+    Returns:
+        Tuple[float, List[float]]: Encoder seconds and the seconds of each decode step
+        (model call plus token selection).
+    """
+    start = time.perf_counter()
+    encoder_outputs = model.encode(input_ids)
+    encoder_seconds = time.perf_counter() - start
+
+    tokens = torch.full((input_ids.size(0), 1), model.config.bos_token_id, dtype=torch.long)
+    past_key_values = None
+    step_seconds = []
+    for _ in range(generation_length):
+        start = time.perf_counter()
+        hidden_states, past_key_values = model.decode(
+            tokens[:, -1:], encoder_outputs, past_key_values=past_key_values, use_cache=True
+        )
+        next_token = model.lm_head(hidden_states[:, -1, :]).argmax(dim=-1, keepdim=True)
+        tokens = torch.cat([tokens, next_token], dim=1)
+        step_seconds.append(time.perf_counter() - start)
+    return encoder_seconds, step_seconds
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far."""
+    if os.path.exists("/proc/self/status"):
+        # Linux carries ru_maxrss across exec, so a spawned process would start from
+        # its parent's RSS; VmHWM is the high-water mark of this image alone
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _call_with_threads(num_threads: int, fn: Callable[..., Dict[str, Any]], args: Tuple) -> Dict[str, Any]:
+    torch.set_num_threads(num_threads)
+    return fn(*args)
+
+
+def run_isolated(fn: Callable[..., Dict[str, Any]], *args: Any) -> Dict[str, Any]:
+    """
+    fn(*args) run in a fresh spawned process with this process's thread count.
+
+    The peak RSS of a process never decreases, so cases measured one after another
+    would all report the largest peak so far; in its own process a case's peak_rss_mb
+    covers only that case (on top of the interpreter and torch, the same for every case).
+    """
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_call_with_threads, (torch.get_num_threads(), fn, args))
+
+
+def run_case(model: LuminaLM, case: InferenceCase, warmup: int = 2, repeats: int = 5, seed: int = 0) -> Dict[str, Any]:
+    """Benchmark one case; latencies in milliseconds."""
+    prepared = prepare_model(model, case.precision)
+    generator = torch.Generator().manual_seed(seed)
+    input_ids = torch.randint(
+        3, model.config.vocab_size, (case.batch_size, case.prompt_length), generator=generator
+    )
+    for _ in range(warmup):
+        timed_generation(prepared, input_ids, case.generation_length)
+
+    encoder_seconds, ttft_seconds, per_token_seconds, total_seconds = [], [], [], 0.0
+    for _ in range(repeats):
+        encoder, steps = timed_generation(prepared, input_ids, case.generation_length)
+        encoder_seconds.append(encoder)
+        ttft_seconds.append(encoder + steps[0])
+        per_token_seconds.extend(steps[1:])
+        total_seconds += encoder + sum(steps)
+    per_token_ms = np.array(per_token_seconds or [float('nan')]) * 1000
+
+    return {
+        **dataclasses.asdict(case),
+        'encoder_ms': float(np.median(encoder_seconds) * 1000),
+        'ttft_ms': float(np.median(ttft_seconds) * 1000),
+        'per_token_p50_ms': float(np.percentile(per_token_ms, 50)),
+        'per_token_p90_ms': float(np.percentile(per_token_ms, 90)),
+        'per_token_p99_ms': float(np.percentile(per_token_ms, 99)),
+        'tokens_per_sec': repeats * case.batch_size * case.generation_length / total_seconds,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_suite(
+    model: LuminaLM,
+    cases: Sequence[InferenceCase],
+    warmup: int = 2,
+    repeats: int = 5,
+    seed: int = 0,
+    isolate: bool = True
+) -> Dict[str, Any]:
+    """
+    Benchmark every case and attach the environment description.
+
+    With isolate, each case runs in its own process (see run_isolated); otherwise
+    peak_rss_mb is the peak of this process up to and including the case.
+    """
+    runner = functools.partial(run_isolated, run_case) if isolate else run_case
+    results = []
+    for case in cases:
+        torch.manual_seed(seed)
+        result = runner(model, case, warmup, repeats, seed)
+        logger.info(
+            f"bs={case.batch_size} prompt={case.prompt_length} gen={case.generation_length} {case.precision}: "
+            f"ttft {result['ttft_ms']:.1f} ms, p50 {result['per_token_p50_ms']:.2f} ms, "
+            f"{result['tokens_per_sec']:.1f} tok/s"
+        )
+        results.append(result)
+    return {
+        'environment': {
+            'torch': torch.__version__,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'num_threads': torch.get_num_threads(),
+            'config': dataclasses.asdict(model.config),
+        },
+        'warmup': warmup,
+        'repeats': repeats,
+        'seed': seed,
+        'isolated_cases': isolate,
+        'results': results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.1) -> List[Dict[str, Any]]:
+    """
+    Regressions of current against baseline.
+
+    Args:
+        current (Dict[str, Any]): run_suite output.
+        baseline (Dict[str, Any]): Stored run_suite output.
+        threshold (float): Allowed relative change, e.g. 0.1 for 10%.
+
+    Returns:
+        List[Dict[str, Any]]: One entry per regressed metric of a case present in both runs.
+    """
+    def case_key(result: Dict[str, Any]) -> Tuple:
+        return (result['batch_size'], result['prompt_length'], result['generation_length'], result['precision'])
+
+    baseline_results = {case_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        reference = baseline_results.get(case_key(result))
+        if reference is None:
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            old, new = reference.get(metric), result.get(metric)
+            if not old or new is None or np.isnan(old) or np.isnan(new):
+                continue
+            change = (new - old) / old
+            regressed = change > threshold if metric in LOWER_IS_BETTER else change < -threshold
+            if regressed:
+                regressions.append({
+                    'case': dict(zip(('batch_size', 'prompt_length', 'generation_length', 'precision'), case_key(result))),
+                    'metric': metric,
+                    'baseline': old,
+                    'current': new,
+                    'change': change,
+                })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU inference benchmark of LuminaLM with a regression gate.")
+    parser.add_argument("--config_path", type=str, required=True, help="Path to configuration YAML file.")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--prompt_lengths", type=int, nargs="+", default=[32, 128])
+    parser.add_argument("--generation_lengths", type=int, nargs="+", default=[32])
+    parser.add_argument("--precisions", type=str, nargs="+", default=["float32"], choices=PRECISIONS)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, help="torch intra-op threads; fix it for comparable runs.")
+    parser.add_argument("--output", type=str, default="inference_benchmark.json")
+    parser.add_argument("--compare", type=str, help="Baseline JSON to check for regressions.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Allowed relative regression.")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    with open(args.config_path, 'r') as config_file:
+        config = LuminaLMConfig(**yaml.safe_load(config_file)['model'])
+    torch.manual_seed(args.seed)
+    model = LuminaLM(config).eval()
+
+    cases = [
+        InferenceCase(batch_size, prompt_length, generation_length, precision)
+        for batch_size, prompt_length, generation_length, precision in itertools.product(
+            args.batch_sizes, args.prompt_lengths, args.generation_lengths, args.precisions
+        )
+    ]
+    report = run_suite(model, cases, args.warmup, args.repeats, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Wrote {len(cases)} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for regression in regressions:
+            logger.error(
+                f"Regression {regression['case']} {regression['metric']}: "
+                f"{regression['baseline']:.3f} -> {regression['current']:.3f} ({regression['change']:+.1%})"
+            )
+        if regressions:
+            sys.exit(1)
+        logger.info(f"No regressions beyond {args.threshold:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
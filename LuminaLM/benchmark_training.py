@@ -0,0 +1,234 @@
+"""
+Offline training throughput benchmark of LuminaLM on synthetic data.
+
+Builds random token batches shaped like the configured model and times the
+data, forward, backward and optimizer phases of each step separately. Sweeps
+batch size, precision (float32 or bfloat16 autocast) and activation
+checkpointing policy, and reports tokens/sec, samples/sec, an MFU estimate
+from the analytical cost model and peak memory. Each case runs in a fresh
+process, so the peak RSS of checkpointing policies can be compared. Runs on
+CPU without any dataset download; results are written as JSON for tracking
+across commits.
+
+Usage:
+    python benchmark_training.py --config_path config.yaml --batch_sizes 4 8 --checkpoint_policies none full
+"""
+import json
+import time
+import logging
+import argparse
+import platform
+import itertools
+import functools
+import dataclasses
+import numpy as np
+import yaml
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional, Sequence
+from model import LuminaLM, LuminaLMConfig
+from parameters import ModelCost
+from benchmark_inference import peak_rss_mb, run_isolated
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("float32", "bfloat16")
+
+
+@dataclass(frozen=True)
+class TrainingCase:
+    """One point of the sweep."""
+    batch_size: int
+    src_len: int
+    tgt_len: int
+    precision: str = "float32"
+    checkpoint_policy: str = "none"
+
+
+def synthetic_batches(
+    config: LuminaLMConfig,
+    batch_size: int,
+    src_len: int,
+    tgt_len: int,
+    seed: int = 0,
+    device: Optional[torch.device] = None
+) -> Iterator[Dict[str, torch.Tensor]]:
+    """Endless random batches with the same keys as the training data."""
+    generator = torch.Generator().manual_seed(seed)
+    while True:
+        input_ids = torch.randint(3, config.vocab_size, (batch_size, src_len), generator=generator)
+        targets = torch.randint(3, config.vocab_size, (batch_size, tgt_len + 1), generator=generator)
+        targets[:, 0] = config.bos_token_id
+        batch = {
+            'input_ids': input_ids,
+            'decoder_input_ids': targets[:, :-1],
+            'labels': targets[:, 1:],
+        }
+        yield {name: tensor.to(device) for name, tensor in batch.items()} if device is not None else batch
+
+
+def peak_flops_estimate(dtype: torch.dtype = torch.float32, size: int = 1024, repeats: int = 5) -> float:
+    """Achievable matmul FLOP/s of this host, used as the MFU denominator."""
+    a = torch.randn(size, size, dtype=dtype)
+    b = torch.randn(size, size, dtype=dtype)
+    torch.matmul(a, b)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        torch.matmul(a, b)
+    return 2 * size ** 3 * repeats / (time.perf_counter() - start)
+
+
+def train_step_flops(config: LuminaLMConfig, batch_size: int, src_len: int, tgt_len: int, checkpoint_policy: str) -> float:
+    """Analytical FLOPs of one training step: forward, backward (2x) and checkpoint recompute."""
+    cost = ModelCost(config)
+    # Teacher forcing: decoder position t attends to t + 1 target positions
+    decoder = sum(cost.decoder_step_flops(src_len, position + 1) for position in range(tgt_len))
+    forward = batch_size * (cost.encoder_flops_per_token(src_len) * src_len + decoder)
+    # Attention-only and FFN-only checkpointing recompute roughly half of each block
+    recompute = {'none': 0.0, 'full': 1.0, 'every_k': 1.0 / config.checkpoint_every_k}.get(checkpoint_policy, 0.5)
+    return forward * (3.0 + recompute)
+
+
+def run_case(
+    config: LuminaLMConfig,
+    case: TrainingCase,
+    steps: int = 10,
+    warmup: int = 2,
+    seed: int = 0,
+    peak_flops: Optional[float] = None
+) -> Dict[str, Any]:
+    """Benchmark one case; phase times are per-step medians in milliseconds."""
+    if case.precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{case.precision}'. Expected one of {PRECISIONS}.")
+    torch.manual_seed(seed)
+    model = LuminaLM(dataclasses.replace(config, use_checkpoint=case.checkpoint_policy != "none")).train()
+    model.set_checkpoint_policy(case.checkpoint_policy)
+    optimizer = optim.AdamW(model.parameters(), lr=1e-4)
+    criterion = nn.CrossEntropyLoss(ignore_index=config.pad_token_id)
+    batches = synthetic_batches(config, case.batch_size, case.src_len, case.tgt_len, seed)
+    use_bf16 = case.precision == "bfloat16"
+
+    timings = {'data': [], 'forward': [], 'backward': [], 'optimizer': []}
+    for step in range(warmup + steps):
+        start = time.perf_counter()
+        batch = next(batches)
+        data_done = time.perf_counter()
+
+        optimizer.zero_grad(set_to_none=True)
+        with torch.autocast(device_type="cpu", dtype=torch.bfloat16, enabled=use_bf16):
+            logits = model(input_ids=batch['input_ids'], decoder_input_ids=batch['decoder_input_ids'])
+            loss = criterion(logits.float().view(-1, logits.size(-1)), batch['labels'].reshape(-1))
+        forward_done = time.perf_counter()
+
+        loss.backward()
+        backward_done = time.perf_counter()
+
+        optimizer.step()
+        optimizer_done = time.perf_counter()
+
+        if step >= warmup:
+            timings['data'].append(data_done - start)
+            timings['forward'].append(forward_done - data_done)
+            timings['backward'].append(backward_done - forward_done)
+            timings['optimizer'].append(optimizer_done - backward_done)
+
+    step_seconds = float(np.median([sum(phases) for phases in zip(*timings.values())]))
+    tokens_per_step = case.batch_size * (case.src_len + case.tgt_len)
+    flops_per_step = train_step_flops(config, case.batch_size, case.src_len, case.tgt_len, case.checkpoint_policy)
+    result = {
+        **dataclasses.asdict(case),
+        **{f'{phase}_ms': float(np.median(values) * 1000) for phase, values in timings.items()},
+        'step_ms': step_seconds * 1000,
+        'tokens_per_sec': tokens_per_step / step_seconds,
+        'samples_per_sec': case.batch_size / step_seconds,
+        'achieved_flops_per_sec': flops_per_step / step_seconds,
+        'final_loss': loss.item(),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    if peak_flops:
+        # Recompute is not useful work, so MFU counts forward plus backward only
+        useful = train_step_flops(config, case.batch_size, case.src_len, case.tgt_len, "none")
+        result['mfu'] = useful / step_seconds / peak_flops
+    return result
+
+
+def run_suite(
+    config: LuminaLMConfig,
+    cases: Sequence[TrainingCase],
+    steps: int = 10,
+    warmup: int = 2,
+    seed: int = 0,
+    isolate: bool = True
+) -> Dict[str, Any]:
+    """
+    Benchmark every case and attach the environment description.
+
+    With isolate, each case runs in its own process (see benchmark_inference.run_isolated);
+    otherwise peak_rss_mb is the peak of this process up to and including the case.
+    """
+    peak_flops = {precision: peak_flops_estimate(getattr(torch, precision)) for precision in {c.precision for c in cases}}
+    runner = functools.partial(run_isolated, run_case) if isolate else run_case
+    results = []
+    for case in cases:
+        result = runner(config, case, steps, warmup, seed, peak_flops[case.precision])
+        logger.info(
+            f"bs={case.batch_size} {case.precision} ckpt={case.checkpoint_policy}: {result['step_ms']:.1f} ms/step, "
+            f"{result['tokens_per_sec']:.0f} tok/s, MFU {result['mfu']:.1%}"
+        )
+        results.append(result)
+    return {
+        'environment': {
+            'torch': torch.__version__,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'num_threads': torch.get_num_threads(),
+            'peak_flops': peak_flops,
+            'config': dataclasses.asdict(config),
+        },
+        'steps': steps,
+        'warmup': warmup,
+        'seed': seed,
+        'isolated_cases': isolate,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline training throughput benchmark of LuminaLM on synthetic data.")
+    parser.add_argument("--config_path", type=str, required=True, help="Path to configuration YAML file.")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[4, 8])
+    parser.add_argument("--src_len", type=int, help="Encoder length, defaults to block_size.")
+    parser.add_argument("--tgt_len", type=int, help="Decoder length, defaults to block_size.")
+    parser.add_argument("--precisions", type=str, nargs="+", default=["float32"], choices=PRECISIONS)
+    parser.add_argument("--checkpoint_policies", type=str, nargs="+", default=["none", "full"],
+                        choices=["none", "full", "attention", "ffn", "every_k"])
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, help="torch intra-op threads; fix it for comparable runs.")
+    parser.add_argument("--output", type=str, default="training_benchmark.json")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    with open(args.config_path, 'r') as config_file:
+        config = LuminaLMConfig(**yaml.safe_load(config_file)['model'])
+    src_len = args.src_len or config.block_size
+    tgt_len = args.tgt_len or config.block_size
+
+    cases = [
+        TrainingCase(batch_size, src_len, tgt_len, precision, policy)
+        for batch_size, precision, policy in itertools.product(args.batch_sizes, args.precisions, args.checkpoint_policies)
+    ]
+    report = run_suite(config, cases, args.steps, args.warmup, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Wrote {len(cases)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
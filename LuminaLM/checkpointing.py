@@ -0,0 +1,168 @@
+"""
+Activation checkpointing policies for LuminaLM encoder and decoder blocks.
+
+A policy assigns every block one checkpoint mode:
+
+* ``none``: keep all activations for backward;
+* ``full``: recompute the whole block in backward;
+* ``attention``: recompute only the attention sublayers;
+* ``ffn``: recompute only the feed-forward sublayer.
+
+``every_k`` checkpoints every k-th block of each stack fully and leaves the
+others alone. ``budget`` profiles candidate policies on a sample batch and
+keeps the fastest one whose saved activations fit a memory budget.
+"""
+import time
+import logging
+import torch
+import torch.nn as nn
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+from torch.utils.checkpoint import checkpoint
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_MODES = ("none", "full", "attention", "ffn")
+CHECKPOINT_POLICIES = CHECKPOINT_MODES + ("every_k", "budget")
+# Candidates tried by the budget policy
+DEFAULT_CANDIDATES = ("none", "ffn", "attention", "every_k", "full")
+
+
+def layer_checkpoint_modes(policy: str, n_layers: int, every_k: int = 2) -> List[str]:
+    """
+    Checkpoint mode of each block of a stack under a policy.
+
+    Args:
+        policy (str): One of CHECKPOINT_POLICIES except "budget".
+        n_layers (int): Number of blocks in the stack.
+        every_k (int): Period of the "every_k" policy; blocks 0, k, 2k, ... are checkpointed.
+
+    Returns:
+        List[str]: One of CHECKPOINT_MODES per block.
+    """
+    if policy in CHECKPOINT_MODES:
+        return [policy] * n_layers
+    if policy == "every_k":
+        if every_k < 1:
+            raise ValueError("every_k must be a positive integer.")
+        return ["full" if idx % every_k == 0 else "none" for idx in range(n_layers)]
+    if policy == "budget":
+        raise ValueError("The budget policy is resolved by select_checkpoint_policy().")
+    raise ValueError(f"Unknown checkpoint policy '{policy}'. Expected one of {CHECKPOINT_POLICIES}.")
+
+
+def checkpoint_sublayer(enabled: bool, function: Callable[..., torch.Tensor], *args) -> torch.Tensor:
+    """Run function(*args), recomputing it in backward when enabled."""
+    if enabled:
+        # Non-reentrant: gradients also flow to inputs that do not require grad themselves
+        # and to tensors reached through the function's closure
+        return checkpoint(function, *args, use_reentrant=False)
+    return function(*args)
+
+
+@dataclass
+class CheckpointProfile:
+    """Measured cost of one policy on the profiling batch."""
+    policy: str
+    activation_bytes: int
+    step_seconds: float
+
+
+def saved_activation_bytes(
+    model: nn.Module,
+    input_ids: torch.Tensor,
+    decoder_input_ids: torch.Tensor,
+    attention_mask: Optional[torch.Tensor] = None
+) -> int:
+    """Bytes of the distinct non-parameter tensors autograd keeps for backward after one forward pass."""
+    parameter_storages = {p.untyped_storage().data_ptr() for p in model.parameters()}
+    seen = set()
+    total = 0
+
+    def pack(tensor: torch.Tensor) -> torch.Tensor:
+        nonlocal total
+        storage = tensor.untyped_storage()
+        pointer = storage.data_ptr()
+        if pointer not in parameter_storages and pointer not in seen:
+            seen.add(pointer)
+            total += storage.nbytes()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        logits = model(input_ids=input_ids, decoder_input_ids=decoder_input_ids, attention_mask=attention_mask)
+    del logits
+    return total
+
+
+def profile_checkpoint_policies(
+    model: nn.Module,
+    input_ids: torch.Tensor,
+    decoder_input_ids: torch.Tensor,
+    attention_mask: Optional[torch.Tensor] = None,
+    candidates: Sequence[str] = DEFAULT_CANDIDATES,
+    every_k: Optional[int] = None,
+    repeats: int = 2
+) -> List[CheckpointProfile]:
+    """
+    Measure saved activation memory and forward+backward time of each candidate policy.
+
+    Gradients are computed with torch.autograd.grad, so the parameters' .grad are untouched.
+    The model is left in training mode with its previous policy.
+
+    Returns:
+        List[CheckpointProfile]: One profile per candidate, in order.
+    """
+    previous_policy = model.checkpoint_policy
+    parameters = [p for p in model.parameters() if p.requires_grad]
+    model.train()
+    profiles = []
+    try:
+        for policy in candidates:
+            model.set_checkpoint_policy(policy, every_k)
+            activation_bytes = saved_activation_bytes(model, input_ids, decoder_input_ids, attention_mask)
+            # The first step warms up allocators and kernels
+            step_seconds = float('inf')
+            for _ in range(repeats + 1):
+                start = time.perf_counter()
+                logits = model(input_ids=input_ids, decoder_input_ids=decoder_input_ids, attention_mask=attention_mask)
+                torch.autograd.grad(logits.float().sum(), parameters, allow_unused=True)
+                if logits.is_cuda:
+                    torch.cuda.synchronize(logits.device)
+                step_seconds = min(step_seconds, time.perf_counter() - start)
+            profiles.append(CheckpointProfile(policy, activation_bytes, step_seconds))
+            logger.info(f"Checkpoint policy '{policy}': {activation_bytes / 2**20:.1f} MiB activations, {step_seconds * 1000:.1f} ms/step")
+    finally:
+        model.set_checkpoint_policy(previous_policy, every_k)
+    return profiles
+
+
+def select_checkpoint_policy(
+    model: nn.Module,
+    budget_bytes: int,
+    input_ids: torch.Tensor,
+    decoder_input_ids: torch.Tensor,
+    attention_mask: Optional[torch.Tensor] = None,
+    candidates: Sequence[str] = DEFAULT_CANDIDATES,
+    every_k: Optional[int] = None
+) -> Tuple[str, List[CheckpointProfile]]:
+    """
+    Apply the fastest candidate policy whose saved activations fit budget_bytes.
+
+    Falls back to the policy with the smallest activation footprint when none fits.
+
+    Returns:
+        Tuple[str, List[CheckpointProfile]]: The applied policy and all profiles.
+    """
+    profiles = profile_checkpoint_policies(model, input_ids, decoder_input_ids, attention_mask, candidates, every_k)
+    fitting = [profile for profile in profiles if profile.activation_bytes <= budget_bytes]
+    if fitting:
+        chosen = min(fitting, key=lambda profile: profile.step_seconds)
+    else:
+        chosen = min(profiles, key=lambda profile: profile.activation_bytes)
+        logger.warning(
+            f"No checkpoint policy fits {budget_bytes / 2**20:.1f} MiB of activations; "
+            f"using '{chosen.policy}' ({chosen.activation_bytes / 2**20:.1f} MiB)."
+        )
+    model.set_checkpoint_policy(chosen.policy, every_k)
+    logger.info(f"Selected checkpoint policy '{chosen.policy}' for a {budget_bytes / 2**20:.1f} MiB budget")
+    return chosen.policy, profiles
@@ -0,0 +1,215 @@
+"""
+Native batching for LuminaLM training: a padding collator and a token-budget
+batch sampler.
+
+`LuminaLMCollator` turns token-cache examples (numpy arrays of input and
+target ids) into a seq2seq batch:
+
+* input_ids, right-padded to the longest input of the batch rounded up to a
+  multiple of pad_to_multiple_of (8 by default, which keeps matmul shapes
+  tensor-core friendly);
+* attention_mask, a boolean key-padding mask of shape (batch_size, 1, 1,
+  seq_len) that broadcasts over heads and queries, the form LuminaLM and the
+  flash / memory-efficient kernels of scaled_dot_product_attention take;
+* decoder_input_ids (BOS + target) and labels (target + EOS), padded the same
+  way with pad_token_id, which the criterion ignores. The decoder is causal, so
+  right padding needs no decoder mask.
+
+Rows are copied straight from the token arrays into one preallocated int64
+array, without going through Python lists.
+
+`TokenBudgetBatchSampler` forms batches whose padded size (examples x padded
+length) stays under max_tokens, so memory per step no longer swings with the
+longest example. `LuminaLMCollator.budget_lengths` gives it the padded encoder
+and decoder lengths of every example, after the collator's truncation, so the
+budget counts exactly the tokens of the collated batch. Examples are grouped into buckets of equal padded length,
+shuffled within each bucket every epoch, and the resulting batches are
+shuffled and split across data-parallel ranks.
+
+Usage:
+    loader = DataLoader(dataset, batch_sampler=TokenBudgetBatchSampler(lengths, max_tokens=8192),
+                        collate_fn=LuminaLMCollator(pad_token_id=0, bos_token_id=1, eos_token_id=2))
+"""
+import math
+import logging
+import numpy as np
+import torch
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence
+from torch.utils.data import Sampler
+from distributed import get_rank, get_world_size
+
+logger = logging.getLogger(__name__)
+
+
+def round_up(length: int, multiple: int) -> int:
+    return max(math.ceil(length / multiple), 1) * multiple
+
+
+@dataclass
+class LuminaLMCollator:
+    """
+    Pad token-cache examples into LuminaLM training batches.
+
+    Args:
+        pad_token_id (int): Padding id of inputs, decoder inputs and labels.
+        bos_token_id (int): First decoder input of every example.
+        eos_token_id (int): Last label of every example.
+        pad_to_multiple_of (int): Padded lengths are rounded up to a multiple of this.
+        max_length (Optional[int]): Inputs and targets are truncated to this many tokens.
+    """
+    pad_token_id: int = 0
+    bos_token_id: int = 1
+    eos_token_id: int = 2
+    pad_to_multiple_of: int = 8
+    max_length: Optional[int] = None
+
+    def _pad(self, sequences: List[np.ndarray], prefix: Optional[int] = None, suffix: Optional[int] = None) -> np.ndarray:
+        extra = int(prefix is not None) + int(suffix is not None)
+        lengths = [len(ids) + extra for ids in sequences]
+        padded = np.full((len(sequences), round_up(max(lengths), self.pad_to_multiple_of)), self.pad_token_id, dtype=np.int64)
+        start = int(prefix is not None)
+        if prefix is not None:
+            padded[:, 0] = prefix
+        for row, (ids, length) in enumerate(zip(sequences, lengths)):
+            padded[row, start:start + len(ids)] = ids
+            if suffix is not None:
+                padded[row, length - 1] = suffix
+        return padded
+
+    def budget_lengths(
+        self,
+        input_lengths: Sequence[int],
+        target_lengths: Sequence[int],
+        num_targets: Optional[Sequence[int]] = None
+    ) -> np.ndarray:
+        """
+        Padded encoder and decoder lengths of every example as this collator batches it, for TokenBudgetBatchSampler.
+
+        Args:
+            input_lengths (Sequence[int]): Input tokens of every example.
+            target_lengths (Sequence[int]): Target tokens of every example, over all its targets.
+            num_targets (Optional[Sequence[int]]): Targets of every example, each getting a BOS; one when None.
+
+        Returns:
+            np.ndarray: Array of shape (num_examples, 2).
+        """
+        inputs = np.asarray(input_lengths, dtype=np.int64)
+        targets = np.asarray(target_lengths, dtype=np.int64)
+        counts = np.ones_like(targets) if num_targets is None else np.asarray(num_targets, dtype=np.int64)
+        if self.max_length is not None:
+            inputs = np.minimum(inputs, self.max_length)
+            targets = np.minimum(targets, counts * (self.max_length - 1))
+        return np.stack([inputs, targets + counts], axis=1)
+
+    def __call__(self, examples: List[Dict[str, np.ndarray]]) -> Dict[str, torch.Tensor]:
+        if not examples:
+            raise ValueError("Cannot collate an empty batch.")
+        # Keep room for BOS / EOS within max_length
+        target_length = None if self.max_length is None else self.max_length - 1
+        inputs = [example['input_ids'][:self.max_length] for example in examples]
+        targets = [example['decoder_input_ids'][:target_length] for example in examples]
+
+        input_ids = torch.from_numpy(self._pad(inputs))
+        lengths = torch.tensor([len(ids) for ids in inputs])
+        attention_mask = torch.arange(input_ids.size(1)).unsqueeze(0) < lengths.unsqueeze(1)
+        return {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask[:, None, None, :],
+            'decoder_input_ids': torch.from_numpy(self._pad(targets, prefix=self.bos_token_id)),
+            'labels': torch.from_numpy(self._pad(targets, suffix=self.eos_token_id)),
+        }
+
+
+class TokenBudgetBatchSampler(Sampler):
+    """
+    Batches of similar-length examples under a padded token budget, sharded across ranks.
+
+    Args:
+        lengths (Sequence[int]): Token count of every example, or an array of shape (num_examples,
+            num_sequences) when examples have several separately padded sequences, e.g. from
+            LuminaLMCollator.budget_lengths.
+        max_tokens (int): Budget of examples x padded length (summed over sequences) per batch; an
+            example longer than the budget gets a batch of its own.
+        pad_to_multiple_of (int): Padding multiple of the collator; also the bucket width.
+        max_batch_size (Optional[int]): Optional cap on examples per batch.
+        shuffle (bool): Shuffle within buckets and the batch order, differently every epoch.
+        seed (int): Shuffling seed, identical on every rank.
+        num_replicas (Optional[int]): Data-parallel ranks; defaults to the world size.
+        rank (Optional[int]): This rank; defaults to the process rank.
+        drop_last (bool): Drop the batches that do not divide evenly across ranks instead of
+            repeating batches so every rank runs the same number of steps.
+    """
+    def __init__(
+        self,
+        lengths: Sequence[int],
+        max_tokens: int,
+        pad_to_multiple_of: int = 8,
+        max_batch_size: Optional[int] = None,
+        shuffle: bool = True,
+        seed: int = 0,
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+        drop_last: bool = False
+    ):
+        if max_tokens <= 0:
+            raise ValueError("max_tokens must be a positive integer.")
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.max_tokens = max_tokens
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_replicas = get_world_size() if num_replicas is None else num_replicas
+        self.rank = get_rank() if rank is None else rank
+        if not 0 <= self.rank < self.num_replicas:
+            raise ValueError(f"Invalid rank {self.rank} for {self.num_replicas} replicas.")
+        self.drop_last = drop_last
+        self.epoch = 0
+        self._batches: Optional[List[List[int]]] = None
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+        self._batches = None
+
+    def _all_batches(self) -> List[List[int]]:
+        """Batches of every rank for the current epoch, identical on all ranks."""
+        rng = np.random.default_rng(self.seed + self.epoch)
+        order = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        lengths = self.lengths.reshape(len(self.lengths), -1)
+        buckets = np.maximum(-(-lengths // self.pad_to_multiple_of), 1)
+        # Stable sort by bucket keeps the shuffled order within each bucket
+        order = order[np.argsort(buckets.sum(axis=1)[order], kind="stable")]
+
+        # Every sequence is padded to its own longest one in the batch
+        padded = [tuple(row) for row in (buckets * self.pad_to_multiple_of).tolist()]
+        batches, batch, batch_padded = [], [], ()
+        for idx in order.tolist():
+            row_padded = tuple(map(max, batch_padded, padded[idx])) if batch else padded[idx]
+            full = self.max_batch_size is not None and len(batch) >= self.max_batch_size
+            if batch and (full or (len(batch) + 1) * sum(row_padded) > self.max_tokens):
+                batches.append(batch)
+                batch, row_padded = [], padded[idx]
+            batch.append(idx)
+            batch_padded = row_padded
+        if batch:
+            batches.append(batch)
+
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        if self.drop_last:
+            batches = batches[:len(batches) - len(batches) % self.num_replicas]
+        elif batches and len(batches) % self.num_replicas:
+            batches += (batches * self.num_replicas)[:self.num_replicas - len(batches) % self.num_replicas]
+        return batches
+
+    def _rank_batches(self) -> List[List[int]]:
+        if self._batches is None:
+            self._batches = self._all_batches()[self.rank::self.num_replicas]
+        return self._batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        return iter(self._rank_batches())
+
+    def __len__(self) -> int:
+        return len(self._rank_batches())
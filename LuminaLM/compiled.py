@@ -0,0 +1,285 @@
+"""
+Opt-in torch.compile mode for LuminaLM with shape bucketing.
+
+Inputs are padded to a small set of length buckets so that compiled graphs are
+reused instead of recompiled for every padded length. The encoder, the
+decoder step and the training loss are compiled separately:
+
+* the encoder runs on bucket-padded input ids with a padding mask and also
+  produces the decoder cross-attention keys and values;
+* the decoder step writes into a static key/value cache sized to the bucket
+  of prompt + max_length, and takes its position as a tensor, so a whole
+  generation runs on one graph;
+* the training loss runs on bucket-padded encoder and decoder batches.
+"""
+import math
+import time
+import json
+import logging
+import argparse
+import yaml
+import torch
+import torch.nn as nn
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from model import LuminaLM, LuminaLMConfig, KeyValue
+from sampling import SamplingParams, sample_next_token
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LENGTH_BUCKETS = (16, 32, 64, 128)
+
+
+def bucket_length(length: int, buckets: Sequence[int]) -> int:
+    """Smallest bucket holding length; beyond the largest bucket, the next multiple of it."""
+    for bucket in sorted(buckets):
+        if length <= bucket:
+            return bucket
+    largest = max(buckets)
+    return math.ceil(length / largest) * largest
+
+
+def pad_to_bucket(
+    input_ids: torch.Tensor,
+    pad_token_id: int,
+    buckets: Sequence[int],
+    attention_mask: Optional[torch.Tensor] = None
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Right-pad a batch to its length bucket.
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: Padded ids and a (batch_size, 1, 1, bucket)
+        padding mask.
+    """
+    batch_size, length = input_ids.shape
+    target = bucket_length(length, buckets)
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+    attention_mask = attention_mask.reshape(batch_size, -1)
+    if target > length:
+        padding = target - length
+        input_ids = nn.functional.pad(input_ids, (0, padding), value=pad_token_id)
+        attention_mask = nn.functional.pad(attention_mask, (0, padding), value=0)
+    return input_ids, attention_mask[:, None, None, :]
+
+
+class CompiledLuminaLM:
+    """Bucketed, separately compiled encoder, decoder step and training loss of a LuminaLM."""
+
+    def __init__(
+        self,
+        model: LuminaLM,
+        length_buckets: Sequence[int] = DEFAULT_LENGTH_BUCKETS,
+        criterion: Optional[nn.Module] = None,
+        backend: str = "inductor",
+        mode: Optional[str] = None,
+        train_module: Optional[nn.Module] = None
+    ):
+        """
+        Args:
+            model (LuminaLM): Model to compile.
+            length_buckets (Sequence[int]): Padded lengths of encoder and decoder inputs.
+            criterion (Optional[nn.Module]): Training loss, cross-entropy ignoring padding by default.
+            backend (str): torch.compile backend.
+            mode (Optional[str]): torch.compile mode.
+            train_module (Optional[nn.Module]): Module computing the training logits, e.g. a
+                DistributedDataParallel wrapper of model; defaults to model.
+        """
+        self.model = model
+        self.train_module = train_module or model
+        self.config = model.config
+        self.length_buckets = tuple(sorted(length_buckets))
+        self.criterion = criterion or nn.CrossEntropyLoss(ignore_index=model.config.pad_token_id)
+        compile_kwargs = dict(backend=backend, mode=mode, dynamic=False)
+        self._encode = torch.compile(self._encode_with_cross, **compile_kwargs)
+        self._decode_step = torch.compile(self._static_decode_step, **compile_kwargs)
+        self._loss = torch.compile(self._loss_fn, **compile_kwargs)
+
+    def _encode_with_cross(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> List[KeyValue]:
+        model = self.model
+        encoder_outputs = model.encode(input_ids, attention_mask)
+        batch_size = input_ids.size(0)
+        cross_cache = []
+        for layer in model.decoder:
+            attn = layer.cross_attn
+            k = attn.k_proj(encoder_outputs).view(batch_size, -1, attn.n_head, attn.head_dim).transpose(1, 2)
+            v = attn.v_proj(encoder_outputs).view(batch_size, -1, attn.n_head, attn.head_dim).transpose(1, 2)
+            cross_cache.append((k, v))
+        return cross_cache
+
+    def _static_decode_step(
+        self,
+        token_ids: torch.Tensor,
+        position: torch.Tensor,
+        self_cache: List[KeyValue],
+        cross_cache: List[KeyValue],
+        cross_mask: torch.Tensor
+    ) -> torch.Tensor:
+        """Decode one token at position, writing its keys and values into the static cache in place."""
+        model = self.model
+        batch_size = token_ids.size(0)
+        cache_len = self_cache[0][0].size(2)
+        x = model._embed(token_ids, position_ids=position.view(1, 1))
+        valid = (torch.arange(cache_len, device=token_ids.device) <= position).view(1, 1, 1, cache_len)
+        valid = valid.expand(batch_size, 1, 1, cache_len)
+
+        for layer, self_kv, cross_kv in zip(model.decoder, self_cache, cross_cache):
+            x, _ = layer(
+                x, None, self_mask=valid, cross_mask=cross_mask,
+                past_key_value=(self_kv, cross_kv), use_cache=True, cache_position=position.view(1)
+            )
+
+        return model.decoder_ln(x)[:, -1, :]
+
+    def _loss_fn(
+        self,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        decoder_input_ids: torch.Tensor,
+        labels: torch.Tensor
+    ) -> torch.Tensor:
+        logits = self.train_module(input_ids=input_ids, decoder_input_ids=decoder_input_ids, attention_mask=attention_mask)
+        return self.criterion(logits.view(-1, logits.size(-1)), labels.reshape(-1))
+
+    def encode(self, input_ids: torch.Tensor, attention_mask: Optional[torch.Tensor] = None) -> Tuple[List[KeyValue], torch.Tensor]:
+        """Bucket-pad and encode; returns the cross-attention cache and its padding mask."""
+        input_ids, mask = pad_to_bucket(input_ids, self.config.pad_token_id, self.length_buckets, attention_mask)
+        return self._encode(input_ids, mask), mask
+
+    def loss(
+        self,
+        input_ids: torch.Tensor,
+        decoder_input_ids: torch.Tensor,
+        labels: torch.Tensor,
+        attention_mask: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        """Compiled training loss on bucket-padded inputs; call backward() on the result."""
+        pad_token_id = self.config.pad_token_id
+        input_ids, mask = pad_to_bucket(input_ids, pad_token_id, self.length_buckets, attention_mask)
+        # Causal decoder: right padding never reaches earlier positions, and padded labels are ignored
+        decoder_input_ids, _ = pad_to_bucket(decoder_input_ids, pad_token_id, self.length_buckets)
+        labels, _ = pad_to_bucket(labels, pad_token_id, self.length_buckets)
+        return self._loss(input_ids, mask, decoder_input_ids, labels)
+
+    @torch.no_grad()
+    def generate(
+        self,
+        input_ids: torch.Tensor,
+        max_length: int,
+        temperature: Union[float, torch.Tensor] = 1.0,
+        top_k: Optional[Union[int, torch.Tensor]] = None,
+        top_p: Optional[Union[float, torch.Tensor]] = None,
+        early_stopping: bool = True,
+        attention_mask: Optional[torch.Tensor] = None,
+        decoder_input_ids: Optional[torch.Tensor] = None,
+        generator: Optional[torch.Generator] = None,
+    ) -> torch.Tensor:
+        """Generate like LuminaLM.generate with the compiled encoder and decoder step."""
+        if max_length <= 0:
+            raise ValueError("max_length must be a positive integer.")
+        config = self.config
+        batch_size = input_ids.size(0)
+        device = input_ids.device
+        cross_cache, cross_mask = self.encode(input_ids, attention_mask)
+        if decoder_input_ids is None:
+            decoder_input_ids = torch.full((batch_size, 1), config.bos_token_id, dtype=torch.long, device=device)
+        prompt_length = decoder_input_ids.size(1)
+        total_length = prompt_length + max_length
+        cache_len = bucket_length(total_length, self.length_buckets)
+        head_dim = config.n_embd // config.n_head
+        dtype = self.model.wte.weight.dtype
+        self_cache = [
+            (torch.zeros(batch_size, config.n_head, cache_len, head_dim, dtype=dtype, device=device),
+             torch.zeros(batch_size, config.n_head, cache_len, head_dim, dtype=dtype, device=device))
+            for _ in range(config.n_decoder_layers)
+        ]
+        params = SamplingParams.from_values(batch_size, device, temperature=temperature, top_k=top_k, top_p=top_p)
+
+        generated_tokens = decoder_input_ids
+        for position in range(total_length - 1):
+            hidden_states = self._decode_step(
+                generated_tokens[:, position:position + 1],
+                torch.tensor(position, device=device),
+                self_cache,
+                cross_cache,
+                cross_mask
+            )
+            # Prompt tokens only fill the cache
+            if position < prompt_length - 1:
+                continue
+            next_token = sample_next_token(
+                self.model.lm_head(hidden_states), params, input_ids=generated_tokens, generator=generator
+            ).unsqueeze(1)
+            generated_tokens = torch.cat([generated_tokens, next_token], dim=1)
+            if early_stopping and (next_token == config.eos_token_id).all():
+                break
+
+        return generated_tokens
+
+
+def _unique_graphs() -> int:
+    from torch._dynamo.utils import counters
+    return counters["stats"]["unique_graphs"]
+
+
+def benchmark_compiled(
+    config: LuminaLMConfig,
+    batch_size: int = 4,
+    src_lengths: Sequence[int] = (12, 20, 30, 50),
+    max_length: int = 16,
+    length_buckets: Sequence[int] = DEFAULT_LENGTH_BUCKETS,
+    repeats: int = 3,
+    seed: int = 0
+) -> Dict[str, float]:
+    """Compile time, steady-state CPU speedup and graph counts of compiled versus eager generation."""
+    torch.manual_seed(seed)
+    model = LuminaLM(config).eval()
+    compiled = CompiledLuminaLM(model, length_buckets)
+    batches = [torch.randint(3, config.vocab_size, (batch_size, length)) for length in src_lengths]
+    graphs_before = _unique_graphs()
+
+    start = time.perf_counter()
+    for input_ids in batches:
+        compiled.generate(input_ids, max_length=max_length, temperature=0.0, early_stopping=False)
+    compile_seconds = time.perf_counter() - start
+    graphs_after_warmup = _unique_graphs()
+
+    timings = {}
+    for name, backend in (("eager", model), ("compiled", compiled)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for input_ids in batches:
+                backend.generate(input_ids, max_length=max_length, temperature=0.0, early_stopping=False)
+        timings[name] = time.perf_counter() - start
+    generated = repeats * len(batches) * batch_size * max_length
+
+    return {
+        'compile_seconds': compile_seconds,
+        'eager_tokens_per_sec': generated / timings['eager'],
+        'compiled_tokens_per_sec': generated / timings['compiled'],
+        'speedup': timings['eager'] / timings['compiled'],
+        'graphs_compiled': graphs_after_warmup - graphs_before,
+        'recompiles_after_warmup': _unique_graphs() - graphs_after_warmup,
+        'distinct_src_lengths': len(set(src_lengths)),
+        'src_buckets_used': len({bucket_length(length, length_buckets) for length in src_lengths}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bucketed torch.compile against eager LuminaLM on CPU.")
+    parser.add_argument("--config_path", type=str, required=True, help="Path to configuration YAML file.")
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--src_lengths", type=int, nargs="+", default=[12, 20, 30, 50])
+    parser.add_argument("--max_length", type=int, default=16)
+    parser.add_argument("--buckets", type=int, nargs="+", default=list(DEFAULT_LENGTH_BUCKETS))
+    args = parser.parse_args()
+
+    with open(args.config_path, 'r') as config_file:
+        config = LuminaLMConfig(**yaml.safe_load(config_file)['model'])
+    report = benchmark_compiled(config, args.batch_size, args.src_lengths, args.max_length, args.buckets)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
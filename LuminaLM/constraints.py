@@ -0,0 +1,187 @@
+"""
+Trie-constrained decoding for LuminaLM.
+
+Allowed strings (e.g. ICD/SNOMED codes or drug names) are tokenized once into a
+token-level trie. The admissible next tokens of every node are stored as a
+slice of one flat CSR array, so a decode step only touches the allowed set of
+the current node instead of the full vocabulary.
+"""
+import os
+import hashlib
+import logging
+import torch
+from typing import List, Optional, Sequence, Tuple, Dict, Iterable
+from tokenizers import Tokenizer
+
+logger = logging.getLogger(__name__)
+
+
+class TokenTrie:
+    """Token-level trie with precomputed sparse next-token masks per node."""
+
+    ROOT = 0
+
+    def __init__(self, offsets: torch.Tensor, tokens: torch.Tensor, targets: torch.Tensor, eos_token_id: int):
+        """
+        Args:
+            offsets (torch.Tensor): CSR row pointers of shape (num_nodes + 1,).
+            tokens (torch.Tensor): Allowed next-token ids of every node, concatenated.
+            targets (torch.Tensor): Child node reached by each entry of tokens.
+            eos_token_id (int): Token closing a complete sequence.
+        """
+        self.offsets = offsets
+        self.tokens = tokens
+        self.targets = targets
+        self.eos_token_id = eos_token_id
+        # Absorbing node reached after EOS; it only allows EOS again
+        self.done_node = offsets.numel() - 2
+
+    @property
+    def num_nodes(self) -> int:
+        return self.offsets.numel() - 1
+
+    @classmethod
+    def from_token_sequences(cls, sequences: Iterable[Sequence[int]], eos_token_id: int) -> 'TokenTrie':
+        """Build the trie from already tokenized allowed sequences."""
+        children: List[Dict[int, int]] = [{}]
+        terminal = [False]
+        for sequence in sequences:
+            node = cls.ROOT
+            for token in sequence:
+                child = children[node].get(token)
+                if child is None:
+                    child = len(children)
+                    children[node][token] = child
+                    children.append({})
+                    terminal.append(False)
+                node = child
+            terminal[node] = True
+        if not any(terminal):
+            raise ValueError("At least one allowed sequence is required.")
+
+        done_node = len(children)
+        offsets, tokens, targets = [0], [], []
+        for node, edges in enumerate(children):
+            for token in sorted(edges):
+                tokens.append(token)
+                targets.append(edges[token])
+            if terminal[node]:
+                tokens.append(eos_token_id)
+                targets.append(done_node)
+            offsets.append(len(tokens))
+        tokens.append(eos_token_id)
+        targets.append(done_node)
+        offsets.append(len(tokens))
+
+        return cls(
+            torch.tensor(offsets, dtype=torch.long),
+            torch.tensor(tokens, dtype=torch.long),
+            torch.tensor(targets, dtype=torch.long),
+            eos_token_id
+        )
+
+    @classmethod
+    def from_strings(
+        cls,
+        strings: Iterable[str],
+        tokenizer: Tokenizer,
+        eos_token_id: int,
+        cache_dir: Optional[str] = None
+    ) -> 'TokenTrie':
+        """
+        Build the trie over the tokenizations of allowed strings.
+
+        When cache_dir is given, the trie is stored there keyed by the tokenizer,
+        the string set and eos_token_id, and later calls load it instead of
+        re-tokenizing.
+        """
+        strings = sorted(set(strings))
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = os.path.join(cache_dir, f"trie_{cls.cache_key(strings, tokenizer, eos_token_id)}.pt")
+            if os.path.exists(cache_path):
+                logger.info(f"Loading cached token trie from {cache_path}")
+                return cls.load(cache_path)
+
+        encodings = tokenizer.encode_batch(strings, add_special_tokens=False)
+        trie = cls.from_token_sequences([encoding.ids for encoding in encodings], eos_token_id)
+        logger.info(f"Built token trie with {trie.num_nodes} nodes over {len(strings)} allowed strings.")
+
+        if cache_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            trie.save(cache_path)
+        return trie
+
+    @staticmethod
+    def cache_key(strings: Sequence[str], tokenizer: Tokenizer, eos_token_id: int) -> str:
+        """Hash of everything the trie depends on."""
+        digest = hashlib.sha256()
+        digest.update(tokenizer.to_str().encode('utf-8'))
+        digest.update(str(eos_token_id).encode('utf-8'))
+        for string in strings:
+            digest.update(string.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()[:16]
+
+    def save(self, path: str) -> None:
+        """Save the trie atomically."""
+        tmp_path = f"{path}.tmp"
+        torch.save({
+            'offsets': self.offsets.cpu(),
+            'tokens': self.tokens.cpu(),
+            'targets': self.targets.cpu(),
+            'eos_token_id': self.eos_token_id,
+        }, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'TokenTrie':
+        """Load a trie saved with save()."""
+        return cls(**torch.load(path, map_location="cpu", weights_only=True))
+
+    def to(self, device: Optional[torch.device]) -> 'TokenTrie':
+        """Return a copy of the trie on the given device."""
+        return TokenTrie(self.offsets.to(device), self.tokens.to(device), self.targets.to(device), self.eos_token_id)
+
+
+class TrieConstraint:
+    """Per-row decoding state over a TokenTrie."""
+
+    def __init__(self, trie: TokenTrie, batch_size: int, device: Optional[torch.device] = None):
+        self.trie = trie.to(device)
+        self.nodes = torch.full((batch_size,), TokenTrie.ROOT, dtype=torch.long, device=device)
+        self._positions: Optional[torch.Tensor] = None
+        self._valid: Optional[torch.Tensor] = None
+
+    @property
+    def finished(self) -> torch.Tensor:
+        """Rows that have emitted EOS after a complete allowed sequence."""
+        return self.nodes == self.trie.done_node
+
+    def allowed_tokens(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Gather the admissible next tokens of every row.
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: Candidate token ids and validity mask,
+            both of shape (batch_size, width) where width is the largest allowed set
+            in the batch. Padding columns repeat the row's last valid token.
+        """
+        start = self.trie.offsets[self.nodes]
+        count = self.trie.offsets[self.nodes + 1] - start
+        columns = torch.arange(int(count.max()), device=self.nodes.device).unsqueeze(0)
+        self._valid = columns < count.unsqueeze(1)
+        self._positions = start.unsqueeze(1) + torch.minimum(columns, (count - 1).unsqueeze(1))
+        return self.trie.tokens[self._positions], self._valid
+
+    def advance(self, next_tokens: torch.Tensor) -> None:
+        """Move every row to the child reached by its chosen token."""
+        if self._positions is None:
+            self.allowed_tokens()
+        match = (self.trie.tokens[self._positions] == next_tokens.unsqueeze(1)) & self._valid
+        if not bool(match.any(-1).all()):
+            raise ValueError("Chosen token is outside the allowed set.")
+        column = match.int().argmax(-1, keepdim=True)
+        self.nodes = self.trie.targets[self._positions.gather(1, column).squeeze(1)]
+        self._positions = None
+        self._valid = None
@@ -0,0 +1,190 @@
+"""
+torch.distributed helpers for multi-process LuminaLM training.
+
+The process group is set up from the environment variables torchrun exports
+(RANK, LOCAL_RANK, WORLD_SIZE, MASTER_ADDR, MASTER_PORT). Without them every
+helper degrades to single-process behaviour, so the same training script runs
+under plain `python` and under `torchrun --nproc_per_node N`. The backend is
+NCCL when CUDA is available and gloo otherwise, so multi-process runs also
+work on a single CPU host.
+
+Besides plain DDP, `sharding` selects ZeRO-style memory savings: "zero1"
+keeps DDP and partitions the optimizer state (see sharding.build_optimizer),
+"fsdp_grad_op" also shards gradients and "fsdp" shards parameters too, with
+one FSDP unit per EncoderBlock/DecoderBlock.
+"""
+import os
+import socket
+import logging
+import functools
+import contextlib
+import torch
+import torch.nn as nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, List, Optional
+from torch.nn.parallel import DistributedDataParallel
+from torch.distributed.fsdp import FullyShardedDataParallel, ShardingStrategy
+from torch.distributed.fsdp.wrap import transformer_auto_wrap_policy
+from model import EncoderBlock, DecoderBlock
+
+logger = logging.getLogger(__name__)
+
+SHARDING_MODES = ("none", "zero1", "fsdp_grad_op", "fsdp")
+_FSDP_STRATEGIES = {
+    "fsdp_grad_op": ShardingStrategy.SHARD_GRAD_OP,
+    "fsdp": ShardingStrategy.FULL_SHARD,
+}
+
+
+@dataclass
+class DistributedConfig:
+    """DDP and sharding settings, read from the optional `distributed` section of the YAML config."""
+    backend: Optional[str] = None  # nccl or gloo; None picks nccl on CUDA, gloo on CPU
+    bucket_cap_mb: float = 25.0  # Gradient bucket size for overlapping all-reduce with backward
+    gradient_as_bucket_view: bool = True  # Gradients alias the buckets, saving one copy
+    find_unused_parameters: bool = False
+    static_graph: bool = False
+    seed: int = 42  # Shared by the dataset split and the DistributedSampler shuffle
+    sharding: str = "none"  # none, zero1, fsdp_grad_op or fsdp
+    comm_hook: str = "none"  # Gradient compression under DDP: none, fp16, bf16, powersgd or topk (see comm_hooks)
+    powersgd_rank: int = 4
+    powersgd_start_iter: int = 10  # Uncompressed warm-up steps before PowerSGD kicks in
+    topk_ratio: float = 0.01  # Fraction of token embedding gradient entries sent per step
+    pipeline_parallel: bool = False  # One pipeline stage per rank instead of replicas (see pipeline)
+    num_microbatches: int = 4
+    pipeline_layers: Optional[List[int]] = None  # Blocks per stage, encoder blocks first
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process() -> bool:
+    return get_rank() == 0
+
+
+def init_distributed(backend: Optional[str] = None) -> torch.device:
+    """
+    Join the process group described by the torchrun environment, if any.
+
+    Args:
+        backend (Optional[str]): Process group backend; defaults to nccl on CUDA, gloo otherwise.
+
+    Returns:
+        torch.device: Device of this process (cuda:LOCAL_RANK or cpu).
+    """
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    local_rank = int(os.environ.get("LOCAL_RANK", "0"))
+    use_cuda = torch.cuda.is_available()
+    device = torch.device(f"cuda:{local_rank}" if use_cuda else "cpu")
+    if use_cuda:
+        torch.cuda.set_device(device)
+    if world_size > 1 and not is_distributed():
+        backend = backend or ("nccl" if use_cuda else "gloo")
+        dist.init_process_group(backend=backend)
+        logger.info(f"Initialized {backend} process group: rank {get_rank()} of {world_size} on {device}")
+    return device
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _local_rank(rank: int, world_size: int, port: int, fn: Callable[..., None], args: tuple) -> None:
+    os.environ.update(RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(world_size),
+                      MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port))
+    fn(rank, world_size, *args)
+
+
+def spawn_local(fn: Callable[..., None], world_size: int, *args: Any) -> None:
+    """
+    Run fn(rank, world_size, *args) in world_size spawned processes on this host.
+
+    Each process gets the environment torchrun would export for its rank, with a free
+    local port, so fn joins the process group with init_distributed as usual.
+    """
+    mp.spawn(_local_rank, args=(world_size, _free_port(), fn, args), nprocs=world_size, join=True)
+
+
+def cleanup_distributed() -> None:
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def barrier() -> None:
+    if is_distributed():
+        dist.barrier()
+
+
+@contextlib.contextmanager
+def main_process_first() -> Iterator[None]:
+    """Let rank 0 run the block first (downloads, cache writes), then the other ranks."""
+    if not is_main_process():
+        barrier()
+    yield
+    if is_main_process():
+        barrier()
+
+
+def wrap_model(model: nn.Module, device: torch.device, config: Optional[DistributedConfig] = None) -> nn.Module:
+    """Wrap the model in DDP or FSDP when running multi-process; otherwise return it as is."""
+    config = config or DistributedConfig()
+    if config.sharding not in SHARDING_MODES:
+        raise ValueError(f"Unknown sharding mode '{config.sharding}'. Expected one of {SHARDING_MODES}.")
+    if not is_distributed():
+        return model
+    if config.sharding in _FSDP_STRATEGIES:
+        return FullyShardedDataParallel(
+            model,
+            sharding_strategy=_FSDP_STRATEGIES[config.sharding],
+            auto_wrap_policy=functools.partial(
+                transformer_auto_wrap_policy, transformer_layer_cls={EncoderBlock, DecoderBlock}
+            ),
+            # FSDP only runs on CPU when the CPU device is given explicitly
+            device_id=device,
+            # Keep per-parameter views so optimizers, weight tying and clipping see the original tensors
+            use_orig_params=True,
+        )
+    return DistributedDataParallel(
+        model,
+        device_ids=[device.index] if device.type == "cuda" else None,
+        bucket_cap_mb=config.bucket_cap_mb,
+        gradient_as_bucket_view=config.gradient_as_bucket_view,
+        find_unused_parameters=config.find_unused_parameters,
+        static_graph=config.static_graph,
+    )
+
+
+def unwrap_model(model: nn.Module) -> nn.Module:
+    """The underlying model of a DDP, FSDP (or DataParallel) wrapper."""
+    return model.module if hasattr(model, "module") else model
+
+
+def reduce_mean(value: float, device: torch.device) -> float:
+    """Average a scalar across ranks."""
+    if not is_distributed():
+        return value
+    tensor = torch.tensor([value], dtype=torch.float64, device=device)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.item() / get_world_size()
+
+
+def broadcast_object(obj: Any, src: int = 0) -> Any:
+    """Rank src's value of a picklable object, on every rank."""
+    if not is_distributed():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
@@ -0,0 +1,249 @@
+"""
+Frozen-encoder fine-tuning from precomputed encoder features.
+
+When the encoder is frozen, its outputs for a training example never change,
+so recomputing them every batch and epoch is wasted work. `freeze_encoder`
+freezes everything the encoder output depends on (token and position
+embeddings, encoder blocks, encoder_ln); with shared embeddings this also
+freezes the tied lm_head. `build_feature_store` then runs the encoder once over
+a dataset and writes the encoder_ln outputs as float16 to a memory-mapped file:
+
+    <feature_dir>/<dataset key>-<max_length>/features.npy, offsets.npy, meta.json
+
+Row ranges in offsets.npy are keyed by example id, the index of the example
+in the dataset. meta.json records a fingerprint of the frozen weights; when
+the encoder weights change (new checkpoint, different embeddings) the store no
+longer matches and `load_or_build_feature_store` rebuilds it.
+
+`EncoderFeatureDataset` adds each example's features to the example, and
+`FeatureCollator` pads them into encoder_outputs for LuminaLM.forward, which
+then skips the encoder: every epoch costs only the decoder.
+
+Usage:
+    freeze_encoder(model)
+    store = load_or_build_feature_store(model, dataset, "encoder_features")
+    loader = DataLoader(EncoderFeatureDataset(dataset, store), collate_fn=FeatureCollator())
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import numpy as np
+import torch
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+from torch.utils.data import ConcatDataset, Dataset, Subset
+from tqdm import tqdm
+from model import LuminaLM
+from collator import LuminaLMCollator
+from packing import example_lengths
+from token_cache import TokenCacheDataset
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 1
+
+
+def encoder_parameters(model: LuminaLM) -> Iterator[torch.nn.Parameter]:
+    """Parameters the encoder output depends on."""
+    for module in (model.wte, model.position_embeddings, model.encoder, model.encoder_ln):
+        yield from module.parameters()
+
+
+def freeze_encoder(model: LuminaLM) -> int:
+    """
+    Stop training the encoder and the embeddings that feed it.
+
+    Returns:
+        int: Number of frozen parameter elements.
+    """
+    frozen = 0
+    for param in encoder_parameters(model):
+        param.requires_grad_(False)
+        frozen += param.numel()
+    logger.info(f"Froze {frozen} encoder parameters; training {sum(p.numel() for p in model.parameters() if p.requires_grad)}")
+    return frozen
+
+
+def encoder_fingerprint(model: LuminaLM) -> str:
+    """Hash of the encoder weights and the configuration fields that affect encoder outputs."""
+    digest = hashlib.sha256()
+    config = model.config
+    digest.update(f"{config.n_embd}:{config.n_head}:{config.n_encoder_layers}:{config.layer_norm_epsilon}".encode("utf-8"))
+    for name, tensor in model.state_dict().items():
+        if name.split(".")[0] in ("wte", "position_embeddings", "encoder", "encoder_ln"):
+            digest.update(name.encode("utf-8"))
+            digest.update(tensor.detach().cpu().contiguous().view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()[:24]
+
+
+def dataset_key(dataset: Dataset) -> str:
+    """Identity of the examples of a (concatenated, subset) token cache and of their order."""
+    digest = hashlib.sha256()
+
+    def visit(part: Dataset) -> None:
+        if isinstance(part, TokenCacheDataset):
+            digest.update(os.path.basename(os.path.normpath(part.path)).encode("utf-8"))
+        elif isinstance(part, ConcatDataset):
+            for child in part.datasets:
+                visit(child)
+        elif isinstance(part, Subset):
+            digest.update(np.asarray(part.indices, dtype=np.int64).tobytes())
+            visit(part.dataset)
+        else:
+            digest.update(str(len(part)).encode("utf-8"))
+        digest.update(b"\0")
+
+    visit(dataset)
+    return digest.hexdigest()[:24]
+
+
+@torch.no_grad()
+def build_feature_store(
+    model: LuminaLM,
+    dataset: Dataset,
+    path: str,
+    batch_size: int = 64,
+    device: Optional[torch.device] = None,
+    max_length: Optional[int] = None
+) -> str:
+    """
+    Run the encoder over dataset and write its encoder_ln outputs to a feature store at path.
+
+    Examples are encoded in order of length to keep padding low; each example's
+    unpadded features are stored at its own row range.
+
+    Args:
+        model (LuminaLM): Model whose (frozen) encoder is run in eval mode.
+        dataset (Dataset): Tokenized examples with input_ids.
+        path (str): Store directory to create.
+        batch_size (int): Examples per encoder batch.
+        device (Optional[torch.device]): Device to encode on; defaults to the model's.
+        max_length (Optional[int]): Inputs are truncated to this many tokens, as in training.
+
+    Returns:
+        str: path.
+    """
+    device = device or next(model.parameters()).device
+    lengths = example_lengths(dataset, "input_ids")
+    if max_length is not None:
+        lengths = np.minimum(lengths, max_length)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    n_embd = model.config.n_embd
+    features = np.lib.format.open_memmap(
+        os.path.join(tmp_path, "features.npy"), mode='w+', dtype=np.float16, shape=(int(offsets[-1]), n_embd)
+    )
+    collator = LuminaLMCollator(model.config.pad_token_id, max_length=max_length)
+    was_training = model.training
+    model.eval()
+    try:
+        order = np.argsort(lengths, kind="stable")
+        for start in tqdm(range(0, len(order), batch_size), desc="Encoding features", disable=len(order) <= batch_size):
+            ids = order[start:start + batch_size]
+            batch = collator([dataset[int(idx)] for idx in ids])
+            hidden = model.encode(batch['input_ids'].to(device), batch['attention_mask'].to(device))
+            hidden = hidden.to(torch.float16).cpu().numpy()
+            for row, idx in enumerate(ids):
+                features[offsets[idx]:offsets[idx + 1]] = hidden[row, :lengths[idx]]
+        features.flush()
+    finally:
+        model.train(was_training)
+    del features
+
+    np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+    with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+        json.dump({
+            'version': STORE_VERSION,
+            'encoder_fingerprint': encoder_fingerprint(model),
+            'num_examples': len(lengths),
+            'n_embd': n_embd,
+            'max_length': max_length,
+        }, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote encoder features of {len(lengths)} examples ({offsets[-1]} tokens) to {path}")
+    return path
+
+
+class EncoderFeatureStore:
+    """Memory-mapped float16 encoder features; store[idx] is an array of shape (input_len, n_embd)."""
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.features = np.load(os.path.join(path, "features.npy"), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode='r')
+
+    def __len__(self) -> int:
+        return self.meta['num_examples']
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        return self.features[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def matches(self, model: LuminaLM, fingerprint: Optional[str] = None) -> bool:
+        """Whether the store was built with this model's current encoder weights."""
+        return self.meta.get('version') == STORE_VERSION and \
+            self.meta['encoder_fingerprint'] == (fingerprint or encoder_fingerprint(model))
+
+
+def load_or_build_feature_store(
+    model: LuminaLM,
+    dataset: Dataset,
+    feature_dir: str,
+    batch_size: int = 64,
+    device: Optional[torch.device] = None,
+    max_length: Optional[int] = None
+) -> EncoderFeatureStore:
+    """Open the feature store of dataset, (re)building it when missing or built with other encoder weights."""
+    path = os.path.join(feature_dir, f"{dataset_key(dataset)}-{max_length}")
+    if os.path.exists(os.path.join(path, "meta.json")):
+        store = EncoderFeatureStore(path)
+        if store.matches(model):
+            return store
+        logger.info(f"Encoder weights changed since {path} was built; rebuilding it")
+    build_feature_store(model, dataset, path, batch_size, device, max_length)
+    return EncoderFeatureStore(path)
+
+
+class EncoderFeatureDataset(Dataset):
+    """
+    Examples of dataset with their precomputed encoder features under encoder_features.
+
+    store may be attached after construction, once the final encoder weights are known;
+    until then examples come without features and the model runs its frozen encoder.
+    """
+    def __init__(self, dataset: Dataset, store: Optional[EncoderFeatureStore] = None):
+        self.dataset = dataset
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def lengths(self, field: str = "input_ids") -> np.ndarray:
+        return example_lengths(self.dataset, field)
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        if self.store is None:
+            return self.dataset[idx]
+        return {**self.dataset[idx], 'encoder_features': self.store[idx]}
+
+
+@dataclass
+class FeatureCollator(LuminaLMCollator):
+    """LuminaLMCollator that also pads the examples' encoder features, when they have them, into encoder_outputs."""
+    def __call__(self, examples: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        batch = super().__call__(examples)
+        if 'encoder_features' not in examples[0]:
+            return batch
+        encoder_outputs = np.zeros((*batch['input_ids'].shape, examples[0]['encoder_features'].shape[-1]), dtype=np.float16)
+        for row, example in enumerate(examples):
+            features = example['encoder_features'][:self.max_length]
+            encoder_outputs[row, :len(features)] = features
+        batch['encoder_outputs'] = torch.from_numpy(encoder_outputs)
+        return batch
@@ -0,0 +1,347 @@
+"""
+Low-rank adapters (LoRA) for LuminaLM fine-tuning and multi-adapter serving.
+
+`add_lora` replaces the attention projections (q_proj, k_proj, v_proj,
+out_proj) and the FeedForward linears (fc1, fc2) with `LoRALinear` layers and
+freezes every base weight. Each adapter adds `scaling * B @ A` to a layer's
+weight, with A of shape (rank, in_features) and B of shape (out_features,
+rank). B starts at zero, so a new adapter leaves the model unchanged. Only the
+adapter parameters get gradients and optimizer state, and `save_adapter`
+writes only them (a few MB per customer instead of a full checkpoint).
+
+Several adapters can live on one base model:
+
+* `set_adapter(model, name)` selects one adapter for training or inference;
+* `merge_adapter(model, name)` folds it into the base weights for
+  single-tenant inference with no extra cost per token, `unmerge_adapter`
+  restores the base weights;
+* `adapter_batch(model, names)` gives every row of a batch its own adapter
+  (or None for the base model) without merging, so one generate() call can
+  serve requests of different customers. Decoder prefix caches are shared
+  across adapters and should not be used in this mode.
+
+Usage:
+    add_lora(model, LoRAConfig(rank=8), "hospital_a")
+    save_adapter(model, "adapters/hospital_a", "hospital_a")
+    python lora.py --config_path config.yaml --batch_size 8 --steps 10
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import contextlib
+import dataclasses
+import yaml
+import torch
+import torch.nn as nn
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from model import LuminaLM, LuminaLMConfig
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TARGET_MODULES = ("q_proj", "k_proj", "v_proj", "out_proj", "fc1", "fc2")
+
+
+@dataclass
+class LoRAConfig:
+    """Adapter hyperparameters, stored next to every saved adapter."""
+    rank: int = 8
+    alpha: float = 16.0
+    dropout: float = 0.0
+    target_modules: Tuple[str, ...] = DEFAULT_TARGET_MODULES
+
+    def __post_init__(self):
+        if self.rank <= 0:
+            raise ValueError("rank must be a positive integer.")
+        self.target_modules = tuple(self.target_modules)
+
+    @property
+    def scaling(self) -> float:
+        return self.alpha / self.rank
+
+
+class LoRALinear(nn.Module):
+    """
+    nn.Linear with a frozen base weight and any number of named low-rank adapters.
+
+    Args:
+        base (nn.Linear): Layer to adapt; its parameters are frozen.
+    """
+    def __init__(self, base: nn.Linear):
+        super().__init__()
+        self.base = base
+        for param in base.parameters():
+            param.requires_grad_(False)
+        self.lora_A = nn.ParameterDict()
+        self.lora_B = nn.ParameterDict()
+        self.scaling: Dict[str, float] = {}
+        self.dropout = nn.ModuleDict()
+        self.active_adapter: Optional[str] = None
+        self.merged_adapter: Optional[str] = None
+        # Set by adapter_batch: stacked adapters and each row's index into them (-1 for none)
+        self.batch_adapters: Optional[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]] = None
+
+    @property
+    def in_features(self) -> int:
+        return self.base.in_features
+
+    @property
+    def out_features(self) -> int:
+        return self.base.out_features
+
+    @property
+    def weight(self) -> torch.Tensor:
+        return self.base.weight
+
+    @property
+    def bias(self) -> Optional[torch.Tensor]:
+        return self.base.bias
+
+    def add_adapter(self, name: str, config: LoRAConfig) -> None:
+        weight = self.base.weight
+        self.lora_A[name] = nn.Parameter(torch.empty(config.rank, self.in_features, device=weight.device, dtype=weight.dtype))
+        self.lora_B[name] = nn.Parameter(torch.zeros(self.out_features, config.rank, device=weight.device, dtype=weight.dtype))
+        nn.init.kaiming_uniform_(self.lora_A[name], a=5 ** 0.5)
+        self.scaling[name] = config.scaling
+        self.dropout[name] = nn.Dropout(config.dropout) if config.dropout > 0 else nn.Identity()
+
+    def delta_weight(self, name: str) -> torch.Tensor:
+        return (self.lora_B[name] @ self.lora_A[name]) * self.scaling[name]
+
+    @torch.no_grad()
+    def merge(self, name: str) -> None:
+        if self.merged_adapter is not None:
+            raise ValueError(f"Adapter '{self.merged_adapter}' is already merged; unmerge it first.")
+        self.base.weight += self.delta_weight(name).to(self.base.weight.dtype)
+        self.merged_adapter = name
+
+    @torch.no_grad()
+    def unmerge(self) -> None:
+        if self.merged_adapter is not None:
+            self.base.weight -= self.delta_weight(self.merged_adapter).to(self.base.weight.dtype)
+            self.merged_adapter = None
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        output = self.base(x)
+        if self.batch_adapters is not None:
+            # Per-row adapters: gather each row's A and B and apply them with batched matmuls
+            stacked_A, stacked_B, rows = self.batch_adapters
+            valid = (rows >= 0).to(x.dtype).view(-1, *([1] * (x.dim() - 1)))
+            A, B = stacked_A[rows.clamp(min=0)], stacked_B[rows.clamp(min=0)]
+            flat = x.reshape(x.size(0), -1, self.in_features)
+            delta = torch.bmm(torch.bmm(flat, A.transpose(1, 2).to(x.dtype)), B.transpose(1, 2).to(x.dtype))
+            return output + delta.view(*x.shape[:-1], self.out_features) * valid
+        name = self.active_adapter
+        if name is None or name == self.merged_adapter:
+            return output
+        lora_input = self.dropout[name](x)
+        return output + (lora_input @ self.lora_A[name].t().to(x.dtype)) @ self.lora_B[name].t().to(x.dtype) * self.scaling[name]
+
+
+def lora_layers(model: nn.Module) -> Iterator[Tuple[str, LoRALinear]]:
+    for name, module in model.named_modules():
+        if isinstance(module, LoRALinear):
+            yield name, module
+
+
+def add_lora(model: LuminaLM, config: LoRAConfig, adapter_name: str = "default") -> LuminaLM:
+    """
+    Add an adapter to every target linear of model, freeze all non-adapter weights and activate it.
+
+    Calling it again with another name adds a further adapter to the same layers.
+    """
+    targets = [
+        (name, module) for name, module in model.named_modules()
+        if isinstance(module, nn.Linear) and name.split(".")[-1] in config.target_modules
+    ]
+    for name, module in targets:
+        parent_name, _, child_name = name.rpartition(".")
+        setattr(model.get_submodule(parent_name), child_name, LoRALinear(module))
+    layers = list(lora_layers(model))
+    if not layers:
+        raise ValueError(f"No linear layers named {config.target_modules} to adapt.")
+    for param in model.parameters():
+        param.requires_grad_(False)
+    for _, layer in layers:
+        if adapter_name in layer.lora_A:
+            raise ValueError(f"Adapter '{adapter_name}' already exists.")
+        layer.add_adapter(adapter_name, config)
+    model.lora_configs = {**getattr(model, 'lora_configs', {}), adapter_name: config}
+    set_adapter(model, adapter_name)
+    trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+    total = sum(p.numel() for p in model.parameters())
+    logger.info(f"Added adapter '{adapter_name}' to {len(layers)} layers: {trainable} of {total} parameters trainable")
+    return model
+
+
+def set_adapter(model: nn.Module, adapter_name: Optional[str]) -> None:
+    """Use adapter_name (None for the base model) and train only its parameters."""
+    for _, layer in lora_layers(model):
+        if adapter_name is not None and adapter_name not in layer.lora_A:
+            raise ValueError(f"Unknown adapter '{adapter_name}'.")
+        layer.active_adapter = adapter_name
+        for name in layer.lora_A:
+            layer.lora_A[name].requires_grad_(name == adapter_name)
+            layer.lora_B[name].requires_grad_(name == adapter_name)
+
+
+def merge_adapter(model: nn.Module, adapter_name: str) -> None:
+    """Fold adapter_name into the base weights for inference without adapter overhead."""
+    set_adapter(model, adapter_name)
+    for _, layer in lora_layers(model):
+        layer.merge(adapter_name)
+
+
+def unmerge_adapter(model: nn.Module) -> None:
+    for _, layer in lora_layers(model):
+        layer.unmerge()
+
+
+@contextlib.contextmanager
+def adapter_batch(model: nn.Module, adapter_names: Sequence[Optional[str]]) -> Iterator[None]:
+    """
+    Within the block, row i of every batch runs with adapter_names[i] (None: no adapter).
+
+    Adapters of different ranks are zero-padded to the largest rank. No adapter may be merged.
+    """
+    layers = [layer for _, layer in lora_layers(model)]
+    if any(layer.merged_adapter is not None for layer in layers):
+        raise ValueError("Unmerge adapters before serving a mixed-adapter batch.")
+    names = sorted({name for name in adapter_names if name is not None})
+    try:
+        for layer in layers:
+            unknown = [name for name in names if name not in layer.lora_A]
+            if unknown:
+                raise ValueError(f"Unknown adapters {unknown}.")
+            device = layer.base.weight.device
+            rows = torch.tensor([-1 if name is None else names.index(name) for name in adapter_names], device=device)
+            rank = max((layer.lora_A[name].size(0) for name in names), default=1)
+            stacked_A = layer.base.weight.new_zeros(max(len(names), 1), rank, layer.in_features)
+            stacked_B = layer.base.weight.new_zeros(max(len(names), 1), layer.out_features, rank)
+            with torch.no_grad():
+                for idx, name in enumerate(names):
+                    adapter_rank = layer.lora_A[name].size(0)
+                    stacked_A[idx, :adapter_rank] = layer.lora_A[name] * layer.scaling[name]
+                    stacked_B[idx, :, :adapter_rank] = layer.lora_B[name]
+            layer.batch_adapters = (stacked_A, stacked_B, rows)
+        yield
+    finally:
+        for layer in layers:
+            layer.batch_adapters = None
+
+
+def adapter_state_dict(model: nn.Module, adapter_name: str) -> Dict[str, torch.Tensor]:
+    """Parameters of one adapter, named <layer>.lora_A / <layer>.lora_B."""
+    state = {}
+    for name, layer in lora_layers(model):
+        state[f"{name}.lora_A"] = layer.lora_A[adapter_name].detach().cpu()
+        state[f"{name}.lora_B"] = layer.lora_B[adapter_name].detach().cpu()
+    return state
+
+
+def save_adapter(model: nn.Module, save_directory: str, adapter_name: str = "default") -> None:
+    """Write one adapter's weights and LoRAConfig; the base model is not saved."""
+    os.makedirs(save_directory, exist_ok=True)
+    with open(os.path.join(save_directory, "adapter_config.json"), 'w') as f:
+        json.dump(dataclasses.asdict(model.lora_configs[adapter_name]), f, indent=2)
+    torch.save(adapter_state_dict(model, adapter_name), os.path.join(save_directory, "adapter_model.bin"))
+    logger.info(f"Saved adapter '{adapter_name}' to {save_directory}")
+
+
+def load_adapter(model: LuminaLM, save_directory: str, adapter_name: str) -> None:
+    """Add an adapter written by save_adapter to model under adapter_name."""
+    with open(os.path.join(save_directory, "adapter_config.json")) as f:
+        config = LoRAConfig(**json.load(f))
+    state = torch.load(os.path.join(save_directory, "adapter_model.bin"), map_location="cpu", weights_only=True)
+    add_lora(model, config, adapter_name)
+    layers = dict(lora_layers(model))
+    with torch.no_grad():
+        for key, tensor in state.items():
+            layer_name, _, kind = key.rpartition(".")
+            getattr(layers[layer_name], kind)[adapter_name].copy_(tensor)
+
+
+def compare_finetuning(
+    config: LuminaLMConfig,
+    lora_config: LoRAConfig,
+    batch_size: int = 8,
+    src_len: int = 64,
+    tgt_len: int = 16,
+    steps: int = 10
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Train full fine-tuning and LoRA for a few steps on synthetic batches.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Trainable parameters, gradient and optimizer state bytes,
+        seconds per step and checkpoint bytes of "full" and "lora".
+    """
+    from benchmark_training import synthetic_batches
+    from sharding import build_optimizer, local_state_bytes
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    report = {}
+    for mode in ("full", "lora"):
+        torch.manual_seed(0)
+        model = LuminaLM(config).to(device)
+        if mode == "lora":
+            add_lora(model, lora_config)
+        optimizer = build_optimizer(model, lr=1e-4)
+        criterion = nn.CrossEntropyLoss(ignore_index=config.pad_token_id)
+        batches = synthetic_batches(config, batch_size, src_len, tgt_len, device=device)
+        if device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(device)
+        times = []
+        for step in range(steps + 1):
+            batch = next(batches)
+            start = time.perf_counter()
+            logits = model(input_ids=batch['input_ids'], decoder_input_ids=batch['decoder_input_ids'])
+            loss = criterion(logits.view(-1, logits.size(-1)), batch['labels'].reshape(-1))
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            if step > 0:  # first step allocates optimizer state
+                times.append(time.perf_counter() - start)
+        state_bytes = local_state_bytes(model, optimizer)
+        checkpoint = adapter_state_dict(model, "default") if mode == "lora" else model.state_dict()
+        report[mode] = {
+            'trainable_parameters': sum(p.numel() for p in model.parameters() if p.requires_grad),
+            'gradient_bytes': state_bytes['gradient_bytes'],
+            'optimizer_state_bytes': state_bytes['optimizer_state_bytes'],
+            'seconds_per_step': sum(times) / len(times),
+            'checkpoint_bytes': sum(t.numel() * t.element_size() for t in checkpoint.values()),
+        }
+        if device.type == "cuda":
+            report[mode]['peak_memory_bytes'] = torch.cuda.max_memory_allocated(device)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare LuminaLM full fine-tuning with LoRA.")
+    parser.add_argument("--config_path", type=str, required=True, help="Path to configuration YAML file.")
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--src_len", type=int, default=64)
+    parser.add_argument("--tgt_len", type=int, default=16)
+    parser.add_argument("--steps", type=int, default=10)
+    args = parser.parse_args()
+
+    with open(args.config_path, 'r') as config_file:
+        config_data = yaml.safe_load(config_file)
+    config = LuminaLMConfig(**config_data['model'])
+    lora_config = LoRAConfig(**(config_data['training'].get('lora') or {}))
+    report = compare_finetuning(config, lora_config, args.batch_size, args.src_len, args.tgt_len, args.steps)
+    for mode, stats in report.items():
+        logger.info(
+            f"{mode}: {stats['trainable_parameters']} trainable parameters, "
+            f"{(stats['gradient_bytes'] + stats['optimizer_state_bytes']) / 2**20:.1f} MiB gradients + optimizer state, "
+            f"{stats['seconds_per_step'] * 1000:.1f} ms/step, checkpoint {stats['checkpoint_bytes'] / 2**20:.2f} MiB"
+        )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
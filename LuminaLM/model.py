@@ -8,13 +8,21 @@ import logging
 from dataclasses import dataclass
 import json
 import math
-from torch.utils.checkpoint import checkpoint
 from torch.cuda.amp import autocast
+from sampling import SamplingParams, sample_next_token
+from constraints import TokenTrie, TrieConstraint
+from prefix_cache import PrefixCache
+from checkpointing import CHECKPOINT_POLICIES, checkpoint_sublayer, layer_checkpoint_modes
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Cached attention keys and values, each of shape (batch_size, n_head, seq_len, head_dim)
+KeyValue = Tuple[torch.Tensor, torch.Tensor]
+# Per decoder layer: (self-attention, cross-attention) keys and values
+LayerKeyValue = Tuple[Optional[KeyValue], Optional[KeyValue]]
+
 @dataclass
 class LuminaLMConfig:
     """Configuration for Encoder-Decoder LuminaLM model."""
@@ -28,6 +36,9 @@ class LuminaLMConfig:
     resid_pdrop: float = 0.1
     attn_pdrop: float = 0.1
     use_checkpoint: bool = True
+    checkpoint_policy: str = "full"  # none, full, attention, ffn, every_k or budget
+    checkpoint_every_k: int = 2
+    checkpoint_budget_mb: Optional[float] = None  # Activation budget of the budget policy
     layer_norm_epsilon: float = 1e-5
     initializer_range: float = 0.02
     pad_token_id: int = 0
@@ -75,8 +86,19 @@ class LuminaLMConfig:
         assert 0.0 <= self.embd_pdrop <= 1.0, "embd_pdrop must be between 0 and 1"
         assert 0.0 <= self.resid_pdrop <= 1.0, "resid_pdrop must be between 0 and 1"
         assert 0.0 <= self.attn_pdrop <= 1.0, "attn_pdrop must be between 0 and 1"
+        assert self.checkpoint_policy in CHECKPOINT_POLICIES, f"checkpoint_policy must be one of {CHECKPOINT_POLICIES}"
+        assert self.checkpoint_every_k > 0, "checkpoint_every_k must be positive"
+        assert self.checkpoint_policy != "budget" or self.checkpoint_budget_mb, "checkpoint_budget_mb is required by the budget policy"
         logger.info("Configuration parameters are valid.")
 
+
+def is_compiling() -> bool:
+    """Whether torch.compile is tracing the current code; eager-only runtime checks are skipped then."""
+    compiler = getattr(torch, 'compiler', None)
+    if compiler is not None and hasattr(compiler, 'is_compiling'):
+        return compiler.is_compiling()
+    return False
+
 # Rotary Embeddings Helper Functions
 def rotate_half(x: torch.Tensor) -> torch.Tensor:
     """Rotate half of the dimensions of the tensor for rotary embeddings."""
@@ -168,30 +190,74 @@ class FlashAttention(nn.Module):
     def forward(
         self, 
         query: torch.Tensor, 
-        key: torch.Tensor, 
-        value: torch.Tensor, 
+        key: Optional[torch.Tensor], 
+        value: Optional[torch.Tensor], 
         mask: Optional[torch.Tensor] = None, 
-        position_ids: Optional[torch.Tensor] = None
-    ) -> torch.Tensor:
+        position_ids: Optional[torch.Tensor] = None,
+        past_key_value: Optional[KeyValue] = None,
+        use_cache: bool = False,
+        is_causal: bool = False,
+        cache_position: Optional[torch.Tensor] = None
+    ) -> Union[torch.Tensor, Tuple[torch.Tensor, KeyValue]]:
+        """
+        Multi-head attention with an optional key/value cache.
+
+        Args:
+            query (torch.Tensor): Query input of shape (batch_size, seq_len, n_embd).
+            key (Optional[torch.Tensor]): Key input; None reuses past_key_value as is
+                (precomputed cross-attention keys and values).
+            value (Optional[torch.Tensor]): Value input, same shape as key.
+            mask (Optional[torch.Tensor]): Padding mask of shape (batch_size, 1, 1, key_len)
+                or (batch_size, 1, seq_len, key_len).
+            position_ids (Optional[torch.Tensor]): Positional IDs for rotary embeddings.
+            past_key_value (Optional[KeyValue]): Cached keys and values of shape
+                (batch_size, n_head, past_len, head_dim), prepended to the new ones.
+            use_cache (bool): Also return the keys and values for the next step.
+            is_causal (bool): Mask keys positioned after each query.
+            cache_position (Optional[torch.Tensor]): Indices along past_key_value's length
+                to write the new keys and values to, in place, instead of appending them
+                (a preallocated static cache; mask the slots not yet written).
+
+        Returns:
+            Union[torch.Tensor, Tuple[torch.Tensor, KeyValue]]: Attention output, and the
+            updated keys and values when use_cache is set.
+        """
         batch_size, seq_len, _ = query.size()
 
-        # Input validation for tensor types and shapes
-        if not isinstance(query, torch.Tensor) or not isinstance(key, torch.Tensor) or not isinstance(value, torch.Tensor):
-            raise TypeError("Query, key, and value must all be torch.Tensor.")
-        if query.shape != key.shape or key.shape != value.shape:
-            raise ValueError("Query, key, and value must have the same shape.")
-        if mask is not None and mask.shape != (batch_size, 1, 1, seq_len):
-            raise ValueError(f"Invalid attention mask shape. Expected ({batch_size}, 1, 1, {seq_len}), got {mask.shape}")
+        # Input validation for tensor types and shapes, skipped inside compiled graphs
+        if not is_compiling():
+            if key is None or value is None:
+                if past_key_value is None:
+                    raise ValueError("Key and value are required when no past_key_value is given.")
+            elif not isinstance(query, torch.Tensor) or not isinstance(key, torch.Tensor) or not isinstance(value, torch.Tensor):
+                raise TypeError("Query, key, and value must all be torch.Tensor.")
+            elif key.shape != value.shape or key.size(0) != batch_size or key.size(-1) != query.size(-1):
+                raise ValueError("Key and value must have the same shape and match the query batch and embedding size.")
 
         # Project and reshape
         q = self.q_proj(query).view(batch_size, -1, self.n_head, self.head_dim).transpose(1, 2)
-        k = self.k_proj(key).view(batch_size, -1, self.n_head, self.head_dim).transpose(1, 2)
-        v = self.v_proj(value).view(batch_size, -1, self.n_head, self.head_dim).transpose(1, 2)
-
-        # Apply rotary embeddings if enabled
-        if hasattr(self, 'rotary_emb') and position_ids is not None:
-            cos, sin = self.rotary_emb(seq_len, query.device)
-            q, k = apply_rotary_pos_emb(q, k, cos, sin)
+        if key is None:
+            k, v = past_key_value
+        else:
+            k = self.k_proj(key).view(batch_size, -1, self.n_head, self.head_dim).transpose(1, 2)
+            v = self.v_proj(value).view(batch_size, -1, self.n_head, self.head_dim).transpose(1, 2)
+            past_len = 0 if past_key_value is None else past_key_value[0].size(2)
+
+            # Apply rotary embeddings if enabled
+            if hasattr(self, 'rotary_emb') and position_ids is not None and k.size(2) == seq_len:
+                cos, sin = self.rotary_emb(past_len + seq_len, query.device)
+                q, k = apply_rotary_pos_emb(q, k, cos[:, :, past_len:], sin[:, :, past_len:])
+
+            if past_key_value is not None and cache_position is not None:
+                k = past_key_value[0].index_copy_(2, cache_position, k)
+                v = past_key_value[1].index_copy_(2, cache_position, v)
+            elif past_key_value is not None:
+                k = torch.cat([past_key_value[0], k], dim=2)
+                v = torch.cat([past_key_value[1], v], dim=2)
+
+        key_len = k.size(2)
+        if not is_compiling() and mask is not None and mask.shape not in ((batch_size, 1, 1, key_len), (batch_size, 1, seq_len, key_len)):
+            raise ValueError(f"Invalid attention mask shape. Expected ({batch_size}, 1, 1, {key_len}), got {mask.shape}")
 
         # Scaled dot-product attention
         with autocast(enabled=True):
@@ -199,6 +265,11 @@ class FlashAttention(nn.Module):
 
             if mask is not None:
                 attn_weights = attn_weights.masked_fill(mask == 0, float('-inf'))
+            if is_causal:
+                # Query i sits at absolute position key_len - seq_len + i
+                query_positions = torch.arange(seq_len, device=query.device).unsqueeze(1) + (key_len - seq_len)
+                causal_mask = torch.arange(key_len, device=query.device).unsqueeze(0) <= query_positions
+                attn_weights = attn_weights.masked_fill(~causal_mask, float('-inf'))
 
             attn_weights = F.softmax(attn_weights, dim=-1)
             attn_weights = self.dropout(attn_weights)
@@ -208,6 +279,8 @@ class FlashAttention(nn.Module):
         context = context.transpose(1, 2).contiguous().view(batch_size, -1, self.n_head * self.head_dim)
         output = self.out_proj(context)
 
+        if use_cache:
+            return output, (k, v)
         return output
 
 # Feed Forward Layer of Transformer
@@ -246,7 +319,20 @@ class EncoderBlock(nn.Module):
         self.ff = FeedForward(config)
         self.ln1 = nn.LayerNorm(config.n_embd, eps=config.layer_norm_epsilon)
         self.ln2 = nn.LayerNorm(config.n_embd, eps=config.layer_norm_epsilon)
-        self.use_checkpoint = config.use_checkpoint
+        # One of checkpointing.CHECKPOINT_MODES, set per layer by LuminaLM.set_checkpoint_policy
+        self.checkpoint_mode = "full" if config.use_checkpoint else "none"
+
+    def _attention_block(self, x: torch.Tensor, mask: Optional[torch.Tensor], position_ids: Optional[torch.Tensor]) -> torch.Tensor:
+        with autocast(enabled=True):
+            h = self.ln1(x)
+            return x + self.attn(h, h, h, mask, position_ids)
+
+    def _ffn_block(self, x: torch.Tensor) -> torch.Tensor:
+        with autocast(enabled=True):
+            return x + self.ff(self.ln2(x))
+
+    def _block(self, x: torch.Tensor, mask: Optional[torch.Tensor], position_ids: Optional[torch.Tensor]) -> torch.Tensor:
+        return self._ffn_block(self._attention_block(x, mask, position_ids))
 
     def forward(
         self, 
@@ -265,16 +351,11 @@ class EncoderBlock(nn.Module):
         Returns:
             torch.Tensor: Encoder output.
         """
-        def _forward(x: torch.Tensor) -> torch.Tensor:
-            with autocast(enabled=True):
-                attn_output = self.attn(self.ln1(x), self.ln1(x), self.ln1(x), mask, position_ids)
-                x = x + attn_output
-                x = x + self.ff(self.ln2(x))
-            return x
-
-        if self.use_checkpoint and x.requires_grad:
-            return checkpoint(_forward, x)
-        return _forward(x)
+        mode = self.checkpoint_mode if x.requires_grad else "none"
+        if mode == "full":
+            return checkpoint_sublayer(True, self._block, x, mask, position_ids)
+        x = checkpoint_sublayer(mode == "attention", self._attention_block, x, mask, position_ids)
+        return checkpoint_sublayer(mode == "ffn", self._ffn_block, x)
 
 # Decoder Block
 class DecoderBlock(nn.Module):
@@ -287,7 +368,39 @@ class DecoderBlock(nn.Module):
         self.ln1 = nn.LayerNorm(config.n_embd, eps=config.layer_norm_epsilon)
         self.ln2 = nn.LayerNorm(config.n_embd, eps=config.layer_norm_epsilon)
         self.ln3 = nn.LayerNorm(config.n_embd, eps=config.layer_norm_epsilon)
-        self.use_checkpoint = config.use_checkpoint
+        # One of checkpointing.CHECKPOINT_MODES, set per layer by LuminaLM.set_checkpoint_policy
+        self.checkpoint_mode = "full" if config.use_checkpoint else "none"
+
+    def _self_attention_block(self, x: torch.Tensor, self_mask: Optional[torch.Tensor], position_ids: Optional[torch.Tensor]) -> torch.Tensor:
+        with autocast(enabled=True):
+            h = self.ln1(x)
+            return x + self.self_attn(h, h, h, mask=self_mask, position_ids=position_ids, is_causal=True)
+
+    def _cross_attention_block(
+        self,
+        x: torch.Tensor,
+        encoder_output: torch.Tensor,
+        cross_mask: Optional[torch.Tensor],
+        position_ids: Optional[torch.Tensor]
+    ) -> torch.Tensor:
+        with autocast(enabled=True):
+            return x + self.cross_attn(self.ln2(x), encoder_output, encoder_output, mask=cross_mask, position_ids=position_ids)
+
+    def _ffn_block(self, x: torch.Tensor) -> torch.Tensor:
+        with autocast(enabled=True):
+            return x + self.ff(self.ln3(x))
+
+    def _block(
+        self,
+        x: torch.Tensor,
+        encoder_output: torch.Tensor,
+        self_mask: Optional[torch.Tensor],
+        cross_mask: Optional[torch.Tensor],
+        position_ids: Optional[torch.Tensor]
+    ) -> torch.Tensor:
+        x = self._self_attention_block(x, self_mask, position_ids)
+        x = self._cross_attention_block(x, encoder_output, cross_mask, position_ids)
+        return self._ffn_block(x)
 
     def forward(
         self,
@@ -295,8 +408,11 @@ class DecoderBlock(nn.Module):
         encoder_output: torch.Tensor,
         self_mask: Optional[torch.Tensor] = None,
         cross_mask: Optional[torch.Tensor] = None,
-        position_ids: Optional[torch.Tensor] = None
-    ) -> torch.Tensor:
+        position_ids: Optional[torch.Tensor] = None,
+        past_key_value: Optional[LayerKeyValue] = None,
+        use_cache: bool = False,
+        cache_position: Optional[torch.Tensor] = None
+    ) -> Union[torch.Tensor, Tuple[torch.Tensor, LayerKeyValue]]:
         """
         Forward pass for decoder block.
 
@@ -306,27 +422,42 @@ class DecoderBlock(nn.Module):
             self_mask (Optional[torch.Tensor]): Self-attention mask.
             cross_mask (Optional[torch.Tensor]): Cross-attention mask.
             position_ids (Optional[torch.Tensor]): Positional IDs for rotary embeddings.
+            past_key_value (Optional[LayerKeyValue]): Cached (self-attention, cross-attention)
+                keys and values; a None cross-attention entry is computed from encoder_output.
+            use_cache (bool): Also return the updated cache for the next decoding step.
+            cache_position (Optional[torch.Tensor]): With use_cache, write the new self-attention
+                keys and values into the cached ones at these indices instead of appending them.
 
         Returns:
-            torch.Tensor: Decoder output.
+            Union[torch.Tensor, Tuple[torch.Tensor, LayerKeyValue]]: Decoder output, and the
+            updated cache when use_cache is set.
         """
-        def _forward(x: torch.Tensor) -> torch.Tensor:
+        if use_cache:
+            past_self, past_cross = past_key_value if past_key_value is not None else (None, None)
+            cross_input = encoder_output if past_cross is None else None
             with autocast(enabled=True):
-                # Self-attention layer
-                self_attn_output = self.self_attn(self.ln1(x), self.ln1(x), self.ln1(x), mask=self_mask, position_ids=position_ids)
+                self_attn_output, present_self = self.self_attn(
+                    self.ln1(x), self.ln1(x), self.ln1(x), mask=self_mask, position_ids=position_ids,
+                    past_key_value=past_self, use_cache=True, is_causal=True, cache_position=cache_position
+                )
                 x = x + self_attn_output
 
-                # Cross-attention layer
-                cross_attn_output = self.cross_attn(self.ln2(x), encoder_output, encoder_output, mask=cross_mask, position_ids=position_ids)
+                cross_attn_output, present_cross = self.cross_attn(
+                    self.ln2(x), cross_input, cross_input, mask=cross_mask,
+                    past_key_value=past_cross, use_cache=True
+                )
                 x = x + cross_attn_output
 
-                # Feed-forward layer
                 x = x + self.ff(self.ln3(x))
-            return x
+            return x, (present_self, present_cross)
 
-        if self.use_checkpoint and x.requires_grad:
-            return checkpoint(_forward, x)
-        return _forward(x)
+        # encoder_output is passed explicitly so that checkpointed blocks still propagate its gradient
+        mode = self.checkpoint_mode if x.requires_grad else "none"
+        if mode == "full":
+            return checkpoint_sublayer(True, self._block, x, encoder_output, self_mask, cross_mask, position_ids)
+        x = checkpoint_sublayer(mode == "attention", self._self_attention_block, x, self_mask, position_ids)
+        x = checkpoint_sublayer(mode == "attention", self._cross_attention_block, x, encoder_output, cross_mask, position_ids)
+        return checkpoint_sublayer(mode == "ffn", self._ffn_block, x)
 
 # LuminaLM Model
 class LuminaLM(nn.Module):
@@ -359,6 +490,25 @@ class LuminaLM(nn.Module):
         # Initialize weights
         self.apply(self._init_weights)
 
+        # Activation checkpointing; the budget policy starts from full until profiled
+        policy = config.checkpoint_policy if config.use_checkpoint else "none"
+        self.set_checkpoint_policy("full" if policy == "budget" else policy)
+
+    def set_checkpoint_policy(self, policy: str, every_k: Optional[int] = None) -> None:
+        """
+        Assign each encoder and decoder block its activation checkpoint mode.
+
+        Args:
+            policy (str): "none", "full", "attention", "ffn" or "every_k"; use
+                checkpointing.select_checkpoint_policy to resolve a memory budget.
+            every_k (Optional[int]): Period of the "every_k" policy, defaults to config.checkpoint_every_k.
+        """
+        every_k = every_k or self.config.checkpoint_every_k
+        for layers in (self.encoder, self.decoder):
+            for layer, mode in zip(layers, layer_checkpoint_modes(policy, len(layers), every_k)):
+                layer.checkpoint_mode = mode
+        self.checkpoint_policy = policy
+
     def _init_weights(self, module: nn.Module) -> None:
         """Custom weight initialization with variance scaling based on layer depth."""
         if isinstance(module, (nn.Linear, nn.Embedding)):
@@ -371,87 +521,263 @@ class LuminaLM(nn.Module):
             module.bias.data.zero_()
             module.weight.data.fill_(1.0)
 
+    def get_input_embeddings(self) -> nn.Embedding:
+        return self.wte
+
+    def save_pretrained(self, save_directory: str, state_dict: Optional[Dict[str, torch.Tensor]] = None) -> None:
+        """Save the configuration and weights (state_dict, e.g. gathered from shards, or this model's) to a directory."""
+        os.makedirs(save_directory, exist_ok=True)
+        self.config.to_json(os.path.join(save_directory, "config.json"))
+        torch.save(state_dict if state_dict is not None else self.state_dict(), os.path.join(save_directory, "pytorch_model.bin"))
+        logger.info(f"Saved model to {save_directory}")
+
+    @classmethod
+    def from_pretrained(cls, save_directory: str, map_location: Optional[Union[str, torch.device]] = "cpu") -> 'LuminaLM':
+        """Load a model written by save_pretrained."""
+        model = cls(LuminaLMConfig.from_json(os.path.join(save_directory, "config.json")))
+        model.load_state_dict(
+            torch.load(os.path.join(save_directory, "pytorch_model.bin"), map_location=map_location, weights_only=True)
+        )
+        return model
+
     def get_depth(self, module: nn.Module) -> int:
         """Get the depth of a module within the network."""
         if isinstance(module, (EncoderBlock, DecoderBlock)):
             return 1
         return 0
 
-    def forward(
+    def _embed(self, input_ids: torch.Tensor, past_length: int = 0, position_ids: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Token plus learned position embeddings, positions starting at past_length unless position_ids are given."""
+        if position_ids is None:
+            position_ids = torch.arange(past_length, past_length + input_ids.size(1), device=input_ids.device).unsqueeze(0)
+        return self.drop(self.wte(input_ids) + self.position_embeddings(position_ids))
+
+    def encode(
         self,
         input_ids: torch.Tensor,
-        decoder_input_ids: torch.Tensor,
         attention_mask: Optional[torch.Tensor] = None,
-        decoder_attention_mask: Optional[torch.Tensor] = None,
+        position_ids: Optional[torch.Tensor] = None
     ) -> torch.Tensor:
-        """Forward pass of the LuminaLM model."""
-        device = input_ids.device
-
-        # Input Validation
-        if not isinstance(input_ids, torch.Tensor) or not isinstance(decoder_input_ids, torch.Tensor):
-            raise TypeError("Input tensors must be of type torch.Tensor.")
-        if input_ids.dim() != 2 or decoder_input_ids.dim() != 2:
-            raise ValueError("Input tensors must be of rank 2 (batch_size, seq_len).")
-
-        # Encode if encoder_outputs not provided
-        encoder_embeddings = self.drop(self.wte(input_ids) + self.position_embeddings(input_ids))
+        """Run the encoder stack and return the normalized encoder hidden states."""
+        encoder_embeddings = self._embed(input_ids, position_ids=position_ids)
         encoder_hidden_states = encoder_embeddings
 
         for layer in self.encoder:
             encoder_hidden_states = layer(encoder_hidden_states, attention_mask)
 
-        encoder_outputs = self.encoder_ln(encoder_hidden_states)
+        return self.encoder_ln(encoder_hidden_states)
 
-        # Decode
-        decoder_embeddings = self.drop(self.wte(decoder_input_ids) + self.position_embeddings(decoder_input_ids))
+    def decode(
+        self,
+        decoder_input_ids: torch.Tensor,
+        encoder_outputs: torch.Tensor,
+        decoder_attention_mask: Optional[torch.Tensor] = None,
+        encoder_attention_mask: Optional[torch.Tensor] = None,
+        past_key_values: Optional[List[LayerKeyValue]] = None,
+        use_cache: bool = False,
+        position_ids: Optional[torch.Tensor] = None,
+    ) -> Union[torch.Tensor, Tuple[torch.Tensor, List[LayerKeyValue]]]:
+        """
+        Run the decoder stack over encoder outputs and return the normalized decoder hidden states.
+
+        With use_cache, decoder_input_ids only holds the tokens following those already
+        in past_key_values, and the updated per-layer cache is returned as well.
+        """
+        past_length = 0
+        if past_key_values is not None and past_key_values[0][0] is not None:
+            past_length = past_key_values[0][0][0].size(2)
+        decoder_embeddings = self._embed(decoder_input_ids, past_length, position_ids)
         decoder_hidden_states = decoder_embeddings
 
+        if not use_cache:
+            for idx, decoder_layer in enumerate(self.decoder):
+                decoder_hidden_states = decoder_layer(
+                    decoder_hidden_states, encoder_outputs, self_mask=decoder_attention_mask, cross_mask=encoder_attention_mask
+                )
+            return self.decoder_ln(decoder_hidden_states)
+
+        presents = []
         for idx, decoder_layer in enumerate(self.decoder):
-            decoder_hidden_states = decoder_layer(decoder_hidden_states, encoder_outputs, self_mask=decoder_attention_mask)
+            decoder_hidden_states, present = decoder_layer(
+                decoder_hidden_states,
+                encoder_outputs,
+                self_mask=decoder_attention_mask,
+                cross_mask=encoder_attention_mask,
+                past_key_value=None if past_key_values is None else past_key_values[idx],
+                use_cache=True
+            )
+            presents.append(present)
+        return self.decoder_ln(decoder_hidden_states), presents
+
+    def forward(
+        self,
+        input_ids: torch.Tensor,
+        decoder_input_ids: torch.Tensor,
+        attention_mask: Optional[torch.Tensor] = None,
+        decoder_attention_mask: Optional[torch.Tensor] = None,
+        cross_attention_mask: Optional[torch.Tensor] = None,
+        position_ids: Optional[torch.Tensor] = None,
+        decoder_position_ids: Optional[torch.Tensor] = None,
+        encoder_outputs: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """
+        Forward pass of the LuminaLM model.
+
+        cross_attention_mask defaults to attention_mask. Packed rows (see packing) pass
+        block-diagonal masks of shape (batch_size, 1, query_len, key_len) and position ids
+        that restart at every packed example. Precomputed encoder_outputs (see feature_store)
+        skip the encoder.
+        """
+        # Input Validation, skipped inside compiled graphs
+        if not is_compiling():
+            if not isinstance(input_ids, torch.Tensor) or not isinstance(decoder_input_ids, torch.Tensor):
+                raise TypeError("Input tensors must be of type torch.Tensor.")
+            if input_ids.dim() != 2 or decoder_input_ids.dim() != 2:
+                raise ValueError("Input tensors must be of rank 2 (batch_size, seq_len).")
+
+        # Encode, unless precomputed
+        if encoder_outputs is None:
+            encoder_outputs = self.encode(input_ids, attention_mask, position_ids)
+        else:
+            encoder_outputs = encoder_outputs.to(self.wte.weight.dtype)
 
-        decoder_outputs = self.decoder_ln(decoder_hidden_states)
+        # Decode
+        cross_attention_mask = attention_mask if cross_attention_mask is None else cross_attention_mask
+        decoder_outputs = self.decode(
+            decoder_input_ids, encoder_outputs, decoder_attention_mask, cross_attention_mask, position_ids=decoder_position_ids
+        )
         logits = self.lm_head(decoder_outputs)
 
         return logits
 
+    def constrained_logits(
+        self,
+        hidden_states: torch.Tensor,
+        candidate_ids: torch.Tensor,
+        valid: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        Project hidden states onto a per-row subset of the vocabulary.
+
+        Args:
+            hidden_states (torch.Tensor): Decoder outputs of shape (batch_size, n_embd).
+            candidate_ids (torch.Tensor): Candidate token ids of shape (batch_size, width).
+            valid (torch.Tensor): Mask of real (non-padding) candidate columns.
+
+        Returns:
+            torch.Tensor: Logits of shape (batch_size, width), -inf on padding columns.
+        """
+        weight = self.lm_head.weight[candidate_ids]
+        logits = torch.einsum('be,bce->bc', hidden_states, weight)
+        return logits.masked_fill(~valid, float('-inf'))
+
+    @torch.no_grad()
     def generate(
         self,
         input_ids: torch.Tensor,
         max_length: int,
-        temperature: float = 1.0,
-        top_k: Optional[int] = None,
-        top_p: Optional[float] = None,
+        temperature: Union[float, torch.Tensor] = 1.0,
+        top_k: Optional[Union[int, torch.Tensor]] = None,
+        top_p: Optional[Union[float, torch.Tensor]] = None,
         early_stopping: bool = True,
+        repetition_penalty: Optional[Union[float, torch.Tensor]] = None,
+        no_repeat_ngram_size: Optional[Union[int, torch.Tensor]] = None,
+        generator: Optional[torch.Generator] = None,
+        trie: Optional[TokenTrie] = None,
+        decoder_input_ids: Optional[torch.Tensor] = None,
+        attention_mask: Optional[torch.Tensor] = None,
+        prefix_cache: Optional[PrefixCache] = None,
     ) -> torch.Tensor:
-        """Generate text from the model given an input prompt."""
+        """
+        Generate text from the model given an input prompt.
+
+        The encoder runs once over input_ids and the decoder extends
+        decoder_input_ids (a BOS token by default) one cached step at a time.
+        Sampling parameters are scalars or per-row tensors of shape (batch_size,),
+        so one batch can mix greedy (temperature 0) and sampled requests. When a
+        TokenTrie is given, the continuation is restricted to its allowed
+        sequences followed by EOS. A PrefixCache lets decoder prompts start from
+        the longest cached prefix.
+
+        Returns:
+            torch.Tensor: Decoder prompt followed by the generated tokens.
+        """
         if not isinstance(input_ids, torch.Tensor):
             raise TypeError("Input tensor must be of type torch.Tensor.")
         if max_length <= 0:
             raise ValueError("max_length must be a positive integer.")
 
         batch_size = input_ids.size(0)
-        generated_tokens = input_ids
+        device = input_ids.device
+        if decoder_input_ids is None:
+            decoder_input_ids = torch.full((batch_size, 1), self.config.bos_token_id, dtype=torch.long, device=device)
+        prompt_length = decoder_input_ids.size(1)
+        generated_tokens = decoder_input_ids
+        params = SamplingParams.from_values(
+            batch_size,
+            device,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+            no_repeat_ngram_size=no_repeat_ngram_size,
+        )
+        constraint = TrieConstraint(trie, batch_size, device) if trie is not None else None
+
+        encoder_outputs = self.encode(input_ids, attention_mask)
+        past_key_values = None
+        cached_length = 0
+        lookup = None
+        if prefix_cache is not None:
+            lookup = prefix_cache.lookup(input_ids, decoder_input_ids)
+            past_key_values, cached_length = lookup.past_key_values, lookup.length
 
         for _ in range(max_length):
-            logits = self.forward(input_ids=generated_tokens, decoder_input_ids=generated_tokens)
-
-            # Apply temperature
-            logits = logits[:, -1, :] / temperature
-
-            # Top-K and top-p filtering
-            if top_k is not None:
-                logits = self.top_k_filtering(logits, top_k)
-            if top_p is not None:
-                logits = self.top_p_filtering(logits, top_p)
-
-            probs = F.softmax(logits, dim=-1)
-            next_token = torch.multinomial(probs, num_samples=1)
+            candidate_ids = valid = None
+            if constraint is not None:
+                candidate_ids, valid = constraint.allowed_tokens()
+
+            if candidate_ids is not None and candidate_ids.size(1) == 1:
+                # Every row has a single admissible continuation; skip the model call
+                next_token = candidate_ids[:, 0]
+            else:
+                # Feed every token not yet in the cache (the prompt suffix on the first step)
+                hidden_states, past_key_values = self.decode(
+                    generated_tokens[:, cached_length:],
+                    encoder_outputs,
+                    encoder_attention_mask=attention_mask,
+                    past_key_values=past_key_values,
+                    use_cache=True
+                )
+                cached_length = generated_tokens.size(1)
+                if lookup is not None:
+                    prefix_cache.insert(lookup.namespaces, decoder_input_ids, past_key_values)
+                    prefix_cache.release(lookup)
+                    lookup = None
+                hidden_states = hidden_states[:, -1, :]
+
+                # Penalties, temperature, top-k/top-p and sampling in one batched pass
+                if candidate_ids is None:
+                    next_token = sample_next_token(
+                        self.lm_head(hidden_states), params, input_ids=generated_tokens, generator=generator
+                    )
+                else:
+                    logits = self.constrained_logits(hidden_states, candidate_ids, valid)
+                    next_token = sample_next_token(
+                        logits, params, input_ids=generated_tokens, candidate_ids=candidate_ids, generator=generator
+                    )
+
+            if constraint is not None:
+                constraint.advance(next_token)
+            next_token = next_token.unsqueeze(1)
 
             generated_tokens = torch.cat([generated_tokens, next_token], dim=1)
 
             if early_stopping and (next_token == self.config.eos_token_id).all():
                 break
 
+        if lookup is not None:
+            prefix_cache.release(lookup)
         return generated_tokens
 
     @staticmethod
@@ -0,0 +1,123 @@
+"""
+Shared-encoder training for QA examples with several acceptable answers.
+
+Token caches built with max_targets > 1 keep every distinct answer of an
+example. Instead of repeating the question and context once per answer,
+`MultiTargetCollator` puts each example in one batch row:
+
+* the encoder row holds the input once, so the encoder runs once per example
+  (group) however many answers it has;
+* the decoder row concatenates BOS + answer of every target, with position
+  ids restarting for each target and a block-diagonal self-attention mask
+  (see packing), so targets do not see each other;
+* every target cross-attends to the same encoder outputs of its row; the
+  cross-attention mask is the encoder padding mask, so the encoder outputs
+  are shared by all targets without being expanded or copied.
+
+`loss_weights` gives every label token the weight 1 / (label tokens of its
+group x groups in the batch), so `group_weighted_loss` averages the loss
+within each group first and then over groups: a question with five answers
+counts as much as a question with one.
+
+Usage:
+    collate_fn = MultiTargetCollator(pad_token_id=0, bos_token_id=1, eos_token_id=2)
+    loss = group_weighted_loss(model(**inputs), labels, loss_weights)
+"""
+import logging
+import numpy as np
+import torch
+import torch.nn as nn
+from dataclasses import dataclass
+from typing import Any, Dict, List
+from torch.utils.data import ConcatDataset, Dataset, Subset
+from collator import LuminaLMCollator, round_up
+from packing import block_diagonal_mask
+from token_cache import TokenCacheDataset
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MultiTargetCollator(LuminaLMCollator):
+    """
+    One row per example: the input once, all of its targets concatenated on the decoder side.
+
+    Examples without a targets entry are treated as having decoder_input_ids as their only target.
+    """
+    def __call__(self, examples: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        if not examples:
+            raise ValueError("Cannot collate an empty batch.")
+        target_length = None if self.max_length is None else self.max_length - 1
+        inputs = [example['input_ids'][:self.max_length] for example in examples]
+        targets = [
+            [target[:target_length] for target in (example['targets'] if 'targets' in example else [example['decoder_input_ids']])]
+            for example in examples
+        ]
+
+        input_ids = torch.from_numpy(self._pad(inputs))
+        lengths = torch.tensor([len(ids) for ids in inputs])
+        attention_mask = (torch.arange(input_ids.size(1)).unsqueeze(0) < lengths.unsqueeze(1))[:, None, None, :]
+
+        row_lengths = [sum(len(target) + 1 for target in row) for row in targets]
+        decoder_length = round_up(max(row_lengths), self.pad_to_multiple_of)
+        shape = (len(examples), decoder_length)
+        decoder_input_ids = np.full(shape, self.pad_token_id, dtype=np.int64)
+        labels = np.full(shape, self.pad_token_id, dtype=np.int64)
+        positions = np.zeros(shape, dtype=np.int64)
+        segments = np.zeros(shape, dtype=np.int64)
+        for row, row_targets in enumerate(targets):
+            offset = 0
+            for segment, target in enumerate(row_targets, start=1):
+                end = offset + len(target) + 1
+                decoder_input_ids[row, offset] = self.bos_token_id
+                decoder_input_ids[row, offset + 1:end] = target
+                labels[row, offset:end - 1] = target
+                labels[row, end - 1] = self.eos_token_id
+                positions[row, offset:end] = np.arange(len(target) + 1)
+                segments[row, offset:end] = segment
+                offset = end
+
+        labels = torch.from_numpy(labels)
+        counts = (labels != self.pad_token_id).sum(dim=1, keepdim=True)
+        groups = (counts > 0).sum()
+        loss_weights = (labels != self.pad_token_id) / (counts.clamp(min=1) * groups.clamp(min=1))
+        segments = torch.from_numpy(segments)
+        return {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'decoder_input_ids': torch.from_numpy(decoder_input_ids),
+            'decoder_attention_mask': block_diagonal_mask(segments, segments),
+            'decoder_position_ids': torch.from_numpy(positions),
+            'labels': labels,
+            'loss_weights': loss_weights,
+        }
+
+
+def group_weighted_loss(logits: torch.Tensor, labels: torch.Tensor, loss_weights: torch.Tensor) -> torch.Tensor:
+    """
+    Cross-entropy averaged within each group (batch row), then over groups.
+
+    Args:
+        logits (torch.Tensor): Decoder logits of shape (batch_size, seq_len, vocab_size).
+        labels (torch.Tensor): Labels of shape (batch_size, seq_len).
+        loss_weights (torch.Tensor): Per-token weights from MultiTargetCollator; zero on padding.
+    """
+    token_loss = nn.functional.cross_entropy(logits.reshape(-1, logits.size(-1)), labels.reshape(-1), reduction='none')
+    return (token_loss * loss_weights.reshape(-1).to(token_loss.dtype)).sum()
+
+
+def target_counts(dataset: Dataset) -> np.ndarray:
+    """Targets of every example of a (concatenated, subset) token cache."""
+    if isinstance(dataset, TokenCacheDataset):
+        return dataset.num_targets()
+    if isinstance(dataset, ConcatDataset):
+        return np.concatenate([target_counts(part) for part in dataset.datasets])
+    if isinstance(dataset, Subset):
+        return target_counts(dataset.dataset)[np.asarray(dataset.indices, dtype=np.int64)]
+    return np.array([len(dataset[idx].get('targets', [None])) for idx in range(len(dataset))], dtype=np.int64)
+
+
+def encoder_pass_savings(dataset: Dataset) -> float:
+    """Fraction of encoder passes saved against one pass per (input, target) pair."""
+    counts = target_counts(dataset)
+    return 1.0 - len(counts) / max(int(counts.sum()), 1)
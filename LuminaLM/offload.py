@@ -0,0 +1,260 @@
+"""
+Layer-streaming inference for memory-constrained hosts.
+
+EncoderBlock/DecoderBlock weights live in one checkpoint shard per layer and
+are memory-mapped and copied into a bounded pool of resident blocks on
+demand. A background thread loads the upcoming layers while the current one
+computes, so at most max_resident_layers blocks are materialized at any time.
+Embeddings, final layer norms and the output head stay resident.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import dataclasses
+import yaml
+import torch
+import torch.nn as nn
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+from model import LuminaLM, LuminaLMConfig, EncoderBlock, DecoderBlock
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE = "config.json"
+RESIDENT_SHARD = "resident.pt"
+
+
+def _shard_file(name: str) -> str:
+    return f"{name}.pt"
+
+
+def save_layer_shards(model: LuminaLM, save_directory: str) -> None:
+    """Write one shard per encoder/decoder layer plus a shard of the always-resident weights."""
+    os.makedirs(save_directory, exist_ok=True)
+    model.config.to_json(os.path.join(save_directory, CONFIG_FILE))
+    for prefix, layers in (("encoder", model.encoder), ("decoder", model.decoder)):
+        for idx, layer in enumerate(layers):
+            torch.save(layer.state_dict(), os.path.join(save_directory, _shard_file(f"{prefix}.{idx}")))
+    resident = {
+        name: tensor for name, tensor in model.state_dict().items()
+        if not name.startswith(("encoder.", "decoder."))
+    }
+    torch.save(resident, os.path.join(save_directory, RESIDENT_SHARD))
+    logger.info(f"Saved {len(model.encoder) + len(model.decoder)} layer shards to {save_directory}")
+
+
+class LayerStreamer:
+    """Bounded pool of resident blocks filled from mmap'd shards by a background thread."""
+
+    def __init__(
+        self,
+        shard_directory: str,
+        config: LuminaLMConfig,
+        max_resident_layers: int = 2,
+        device: Optional[torch.device] = None
+    ):
+        if max_resident_layers < 1:
+            raise ValueError("max_resident_layers must be at least 1.")
+        self.shard_directory = shard_directory
+        self.config = config
+        self.max_resident_layers = max_resident_layers
+        self.device = device or torch.device("cpu")
+        self._resident: 'OrderedDict[str, nn.Module]' = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._current: Optional[str] = None
+        # One loader thread: loads are I/O and memcpy bound and must not compete with each other
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="layer-prefetch")
+        self.loads = 0
+        self.bytes_loaded = 0
+        self.load_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def _build(self, name: str) -> nn.Module:
+        """Allocate an uninitialized block; its weights and buffers come from the shard."""
+        block_cls = EncoderBlock if name.startswith("encoder.") else DecoderBlock
+        with torch.device("meta"):
+            block = block_cls(self.config)
+        return block.to_empty(device=self.device).eval()
+
+    def _load_into(self, name: str, module: nn.Module) -> nn.Module:
+        start = time.perf_counter()
+        state = torch.load(
+            os.path.join(self.shard_directory, _shard_file(name)), map_location="cpu", mmap=True, weights_only=True
+        )
+        module.load_state_dict(state)
+        self.bytes_loaded += sum(t.numel() * t.element_size() for t in state.values())
+        del state
+        self.load_seconds += time.perf_counter() - start
+        self.loads += 1
+        return module
+
+    def _acquire(self, name: str) -> Optional[nn.Module]:
+        """Get a module for name, evicting the least recently used idle layer when at the budget."""
+        if len(self._resident) + len(self._pending) < self.max_resident_layers:
+            return self._build(name)
+        for victim in self._resident:
+            if victim != self._current:
+                module = self._resident.pop(victim)
+                same_kind = victim.split(".")[0] == name.split(".")[0]
+                return module if same_kind else self._build(name)
+        return None
+
+    def _schedule(self, name: str) -> bool:
+        if name in self._resident or name in self._pending:
+            return True
+        module = self._acquire(name)
+        if module is None:
+            return False
+        self._pending[name] = self._executor.submit(self._load_into, name, module)
+        return True
+
+    def prefetch(self, names: List[str]) -> None:
+        """Start loading upcoming layers in order, as far as the budget allows."""
+        for name in names:
+            if not self._schedule(name):
+                break
+
+    def get(self, name: str) -> nn.Module:
+        """Return the resident block for name, loading it if needed."""
+        self._current = None
+        if not self._schedule(name):
+            raise RuntimeError(f"Cannot make layer {name} resident.")
+        if name in self._pending:
+            start = time.perf_counter()
+            self._resident[name] = self._pending.pop(name).result()
+            self.wait_seconds += time.perf_counter() - start
+        self._resident.move_to_end(name)
+        self._current = name
+        return self._resident[name]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'max_resident_layers': self.max_resident_layers,
+            'loads': self.loads,
+            'bytes_loaded': self.bytes_loaded,
+            'load_seconds': self.load_seconds,
+            'wait_seconds': self.wait_seconds,
+        }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+class StreamedLayers:
+    """Sequence of streamed blocks that iterates like the nn.ModuleList it replaces."""
+
+    def __init__(self, streamer: LayerStreamer, names: List[str], schedule: List[str]):
+        self.streamer = streamer
+        self.names = names
+        # Global execution order used to prefetch across stack boundaries
+        self.schedule = schedule
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, idx: int) -> nn.Module:
+        return self.streamer.get(self.names[idx])
+
+    def __iter__(self) -> Iterator[nn.Module]:
+        lookahead = self.streamer.max_resident_layers - 1
+        for name in self.names:
+            layer = self.streamer.get(name)
+            position = self.schedule.index(name)
+            upcoming = [self.schedule[(position + i) % len(self.schedule)] for i in range(1, lookahead + 1)]
+            self.streamer.prefetch(upcoming)
+            yield layer
+
+
+class StreamingLuminaLM(LuminaLM):
+    """LuminaLM whose encoder and decoder blocks are streamed from layer shards."""
+
+    def __init__(
+        self,
+        shard_directory: str,
+        max_resident_layers: int = 2,
+        device: Optional[torch.device] = None
+    ):
+        config = LuminaLMConfig.from_json(os.path.join(shard_directory, CONFIG_FILE))
+        super().__init__(dataclasses.replace(config, n_encoder_layers=0, n_decoder_layers=0))
+        self.config = config
+        self.load_state_dict(
+            torch.load(os.path.join(shard_directory, RESIDENT_SHARD), map_location="cpu", weights_only=True)
+        )
+        self.to(device or torch.device("cpu")).eval()
+
+        self.streamer = LayerStreamer(shard_directory, config, max_resident_layers, device)
+        encoder_names = [f"encoder.{i}" for i in range(config.n_encoder_layers)]
+        decoder_names = [f"decoder.{i}" for i in range(config.n_decoder_layers)]
+        del self.encoder
+        del self.decoder
+        self.encoder = StreamedLayers(self.streamer, encoder_names, encoder_names + decoder_names)
+        # Decode steps cycle through the decoder stack, so its schedule wraps around
+        self.decoder = StreamedLayers(self.streamer, decoder_names, decoder_names)
+
+    def close(self) -> None:
+        self.streamer.close()
+
+
+def benchmark_resident_budgets(
+    shard_directory: str,
+    budgets: List[int],
+    batch_size: int = 8,
+    src_len: int = 64,
+    max_length: int = 16,
+    seed: int = 0
+) -> List[Dict[str, float]]:
+    """Measure greedy generation throughput for each resident-layer budget."""
+    results = []
+    for budget in budgets:
+        model = StreamingLuminaLM(shard_directory, max_resident_layers=budget)
+        generator = torch.Generator().manual_seed(seed)
+        input_ids = torch.randint(3, model.config.vocab_size, (batch_size, src_len), generator=generator)
+        start = time.perf_counter()
+        output = model.generate(input_ids, max_length=max_length, temperature=0.0, early_stopping=False)
+        elapsed = time.perf_counter() - start
+        stats = model.streamer.stats()
+        model.close()
+        generated = batch_size * (output.size(1) - 1)
+        results.append({
+            **stats,
+            'batch_size': batch_size,
+            'seconds': elapsed,
+            'tokens_per_sec': generated / elapsed,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Layer-streaming inference throughput versus resident-layer budget.")
+    parser.add_argument("--shard_dir", type=str, required=True, help="Directory of layer shards.")
+    parser.add_argument("--config_path", type=str, help="YAML config; writes randomly initialized shards if --shard_dir is empty.")
+    parser.add_argument("--budgets", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--src_len", type=int, default=64)
+    parser.add_argument("--max_length", type=int, default=16)
+    parser.add_argument("--output", type=str, help="Optional JSON report path.")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.shard_dir, CONFIG_FILE)):
+        if not args.config_path:
+            parser.error("--config_path is required to create shards.")
+        with open(args.config_path, 'r') as config_file:
+            config = LuminaLMConfig(**yaml.safe_load(config_file)['model'])
+        save_layer_shards(LuminaLM(config), args.shard_dir)
+
+    results = benchmark_resident_budgets(args.shard_dir, args.budgets, args.batch_size, args.src_len, args.max_length)
+    print(f"{'resident':>8} {'tokens/s':>10} {'loads':>6} {'load s':>8} {'wait s':>8}")
+    for row in results:
+        print(f"{row['max_resident_layers']:>8} {row['tokens_per_sec']:>10.1f} {row['loads']:>6} "
+              f"{row['load_seconds']:>8.2f} {row['wait_seconds']:>8.2f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
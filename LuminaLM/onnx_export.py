@@ -0,0 +1,310 @@
+"""
+ONNX export of LuminaLM and an ONNX Runtime generation backend.
+
+The model is exported as two graphs:
+
+* encoder.onnx: input_ids, attention_mask -> cross-attention keys and values
+  of every decoder layer (computed once per request).
+* decoder_step.onnx: decoder_input_ids, attention_mask, past self-attention
+  keys/values and the cross-attention keys/values -> next-token logits and
+  the updated self-attention keys/values.
+
+Batch, source, target and past lengths are dynamic axes. OnnxLuminaLM runs
+both graphs with onnxruntime I/O binding, so the keys and values stay in ORT
+buffers between decode steps instead of round-tripping through Python.
+"""
+import os
+import time
+import inspect
+import json
+import logging
+import argparse
+import yaml
+import numpy as np
+import torch
+import torch.nn as nn
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from model import LuminaLM, LuminaLMConfig
+from sampling import SamplingParams, sample_next_token
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE = "config.json"
+ENCODER_FILE = "encoder.onnx"
+DECODER_STEP_FILE = "decoder_step.onnx"
+# The graphs use dynamic_axes, which only the TorchScript exporter accepts; newer
+# PyTorch releases default to the dynamo exporter
+EXPORT_KWARGS = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+
+
+def _kv_names(prefix: str, n_layers: int) -> List[str]:
+    names = []
+    for idx in range(n_layers):
+        names += [f"{prefix}_key_{idx}", f"{prefix}_value_{idx}"]
+    return names
+
+
+def _attention_mask_4d(attention_mask: torch.Tensor) -> torch.Tensor:
+    """(batch_size, src_len) padding mask to the (batch_size, 1, 1, src_len) shape FlashAttention expects."""
+    return attention_mask[:, None, None, :]
+
+
+class EncoderGraph(nn.Module):
+    """wte + encoder stack + encoder_ln, followed by the decoder cross-attention key/value projections."""
+
+    def __init__(self, model: LuminaLM):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        encoder_outputs = self.model.encode(input_ids, _attention_mask_4d(attention_mask))
+        batch_size = input_ids.size(0)
+        outputs = []
+        for layer in self.model.decoder:
+            attn = layer.cross_attn
+            outputs.append(attn.k_proj(encoder_outputs).view(batch_size, -1, attn.n_head, attn.head_dim).transpose(1, 2))
+            outputs.append(attn.v_proj(encoder_outputs).view(batch_size, -1, attn.n_head, attn.head_dim).transpose(1, 2))
+        return tuple(outputs)
+
+
+class DecoderStepGraph(nn.Module):
+    """One cached decoder step with explicit past and present self-attention keys and values."""
+
+    def __init__(self, model: LuminaLM):
+        super().__init__()
+        self.model = model
+
+    def forward(
+        self,
+        decoder_input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        *key_values: torch.Tensor
+    ) -> Tuple[torch.Tensor, ...]:
+        n_layers = len(self.model.decoder)
+        past, cross = key_values[:2 * n_layers], key_values[2 * n_layers:]
+
+        # Position ids offset by the past length, as tensor ops so the offset stays dynamic
+        past_length = past[0].shape[2]
+        position_ids = (torch.arange(decoder_input_ids.shape[1], device=decoder_input_ids.device) + past_length).unsqueeze(0)
+        hidden_states = self.model._embed(decoder_input_ids, position_ids=position_ids)
+
+        cross_mask = _attention_mask_4d(attention_mask)
+        presents = []
+        for idx, layer in enumerate(self.model.decoder):
+            layer_past = ((past[2 * idx], past[2 * idx + 1]), (cross[2 * idx], cross[2 * idx + 1]))
+            hidden_states, (present_self, _) = layer(
+                hidden_states, None, cross_mask=cross_mask, past_key_value=layer_past, use_cache=True
+            )
+            presents += [present_self[0], present_self[1]]
+
+        logits = self.model.lm_head(self.model.decoder_ln(hidden_states[:, -1, :]))
+        return (logits, *presents)
+
+
+def export_onnx(model: LuminaLM, output_dir: str, opset_version: int = 17) -> Tuple[str, str]:
+    """
+    Export the encoder and cached decoder step graphs.
+
+    Returns:
+        Tuple[str, str]: Paths of the encoder and decoder step graphs.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    # The exporter restores the train/eval mode of the graph modules, and with it the model's
+    was_training = model.training
+    model.eval()
+    try:
+        config = model.config
+        config.to_json(os.path.join(output_dir, CONFIG_FILE))
+        n_layers = config.n_decoder_layers
+        head_dim = config.n_embd // config.n_head
+
+        batch_size, src_len, tgt_len, past_len = 2, 8, 1, 3
+        input_ids = torch.randint(3, config.vocab_size, (batch_size, src_len))
+        attention_mask = torch.ones(batch_size, src_len, dtype=torch.long)
+        encoder_path = os.path.join(output_dir, ENCODER_FILE)
+        cross_names = _kv_names("cross", n_layers)
+        with torch.no_grad():
+            torch.onnx.export(
+                EncoderGraph(model).eval(),
+                (input_ids, attention_mask),
+                encoder_path,
+                input_names=["input_ids", "attention_mask"],
+                output_names=cross_names,
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "src_len"},
+                    "attention_mask": {0: "batch", 1: "src_len"},
+                    **{name: {0: "batch", 2: "src_len"} for name in cross_names},
+                },
+                opset_version=opset_version,
+                **EXPORT_KWARGS,
+            )
+
+            decoder_input_ids = torch.randint(3, config.vocab_size, (batch_size, tgt_len))
+            past = [torch.randn(batch_size, config.n_head, past_len, head_dim) for _ in range(2 * n_layers)]
+            cross = [torch.randn(batch_size, config.n_head, src_len, head_dim) for _ in range(2 * n_layers)]
+            past_names = _kv_names("past", n_layers)
+            present_names = _kv_names("present", n_layers)
+            decoder_path = os.path.join(output_dir, DECODER_STEP_FILE)
+            torch.onnx.export(
+                DecoderStepGraph(model).eval(),
+                (decoder_input_ids, attention_mask, *past, *cross),
+                decoder_path,
+                input_names=["decoder_input_ids", "attention_mask", *past_names, *cross_names],
+                output_names=["logits", *present_names],
+                dynamic_axes={
+                    "decoder_input_ids": {0: "batch", 1: "tgt_len"},
+                    "attention_mask": {0: "batch", 1: "src_len"},
+                    **{name: {0: "batch", 2: "past_len"} for name in past_names},
+                    **{name: {0: "batch", 2: "src_len"} for name in cross_names},
+                    "logits": {0: "batch"},
+                    **{name: {0: "batch", 2: "total_len"} for name in present_names},
+                },
+                opset_version=opset_version,
+                **EXPORT_KWARGS,
+            )
+    finally:
+        model.train(was_training)
+    logger.info(f"Exported ONNX graphs to {output_dir}")
+    return encoder_path, decoder_path
+
+
+class OnnxLuminaLM:
+    """Generation driver running the exported graphs with ONNX Runtime."""
+
+    def __init__(self, export_dir: str, intra_op_num_threads: Optional[int] = None):
+        if ort is None:
+            raise ImportError("onnxruntime is required for the ONNX backend.")
+        self.config = LuminaLMConfig.from_json(os.path.join(export_dir, CONFIG_FILE))
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_num_threads is not None:
+            options.intra_op_num_threads = intra_op_num_threads
+        providers = ["CPUExecutionProvider"]
+        self.encoder = ort.InferenceSession(os.path.join(export_dir, ENCODER_FILE), options, providers=providers)
+        self.decoder_step = ort.InferenceSession(os.path.join(export_dir, DECODER_STEP_FILE), options, providers=providers)
+        n_layers = self.config.n_decoder_layers
+        self.cross_names = _kv_names("cross", n_layers)
+        self.past_names = _kv_names("past", n_layers)
+        self.present_names = _kv_names("present", n_layers)
+
+    def generate(
+        self,
+        input_ids: Union[torch.Tensor, np.ndarray],
+        max_length: int,
+        temperature: Union[float, torch.Tensor] = 1.0,
+        top_k: Optional[Union[int, torch.Tensor]] = None,
+        top_p: Optional[Union[float, torch.Tensor]] = None,
+        early_stopping: bool = True,
+        attention_mask: Optional[Union[torch.Tensor, np.ndarray]] = None,
+        decoder_input_ids: Optional[torch.Tensor] = None,
+        generator: Optional[torch.Generator] = None,
+    ) -> torch.Tensor:
+        """Generate like LuminaLM.generate, running the model graphs in ONNX Runtime."""
+        if max_length <= 0:
+            raise ValueError("max_length must be a positive integer.")
+        input_ids = np.ascontiguousarray(np.asarray(input_ids, dtype=np.int64))
+        batch_size = input_ids.shape[0]
+        if attention_mask is None:
+            attention_mask = np.ones_like(input_ids)
+        attention_mask = np.ascontiguousarray(np.asarray(attention_mask, dtype=np.int64))
+        if decoder_input_ids is None:
+            decoder_input_ids = torch.full((batch_size, 1), self.config.bos_token_id, dtype=torch.long)
+        params = SamplingParams.from_values(batch_size, temperature=temperature, top_k=top_k, top_p=top_p)
+
+        # Cross-attention keys/values are computed once and stay bound as ORT values
+        encoder_binding = self.encoder.io_binding()
+        encoder_binding.bind_cpu_input("input_ids", input_ids)
+        encoder_binding.bind_cpu_input("attention_mask", attention_mask)
+        for name in self.cross_names:
+            encoder_binding.bind_output(name)
+        self.encoder.run_with_iobinding(encoder_binding)
+        cross_values = encoder_binding.get_outputs()
+
+        step_binding = self.decoder_step.io_binding()
+        step_binding.bind_cpu_input("attention_mask", attention_mask)
+        for name, value in zip(self.cross_names, cross_values):
+            step_binding.bind_ortvalue_input(name, value)
+        head_dim = self.config.n_embd // self.config.n_head
+        empty = np.zeros((batch_size, self.config.n_head, 0, head_dim), dtype=np.float32)
+        for name in self.past_names:
+            step_binding.bind_cpu_input(name, empty)
+
+        generated_tokens = decoder_input_ids
+        step_input = decoder_input_ids
+        for _ in range(max_length):
+            # Keep the array referenced until the run completes; the binding points at its memory
+            step_ids = np.ascontiguousarray(step_input.numpy())
+            step_binding.bind_cpu_input("decoder_input_ids", step_ids)
+            # Presents grow every step, so ORT allocates fresh outputs instead of reusing the last ones
+            for name in ["logits", *self.present_names]:
+                step_binding.bind_output(name)
+            self.decoder_step.run_with_iobinding(step_binding)
+            outputs = step_binding.get_outputs()
+
+            # Presents become the next step's past without leaving ORT memory
+            for name, value in zip(self.past_names, outputs[1:]):
+                step_binding.bind_ortvalue_input(name, value)
+
+            logits = torch.from_numpy(outputs[0].numpy())
+            next_token = sample_next_token(logits, params, input_ids=generated_tokens, generator=generator).unsqueeze(1)
+            generated_tokens = torch.cat([generated_tokens, next_token], dim=1)
+            step_input = next_token
+
+            if early_stopping and (next_token == self.config.eos_token_id).all():
+                break
+
+        return generated_tokens
+
+
+def benchmark_backends(
+    model: LuminaLM,
+    export_dir: str,
+    batch_size: int = 4,
+    src_len: int = 64,
+    max_length: int = 32,
+    intra_op_num_threads: Optional[int] = None,
+    seed: int = 0
+) -> Dict[str, float]:
+    """Greedy-decoding tokens/sec of the PyTorch and ONNX Runtime backends."""
+    generator = torch.Generator().manual_seed(seed)
+    input_ids = torch.randint(3, model.config.vocab_size, (batch_size, src_len), generator=generator)
+    onnx_model = OnnxLuminaLM(export_dir, intra_op_num_threads)
+    results = {}
+    for name, backend in (("pytorch", model.eval()), ("onnxruntime", onnx_model)):
+        backend.generate(input_ids, max_length=2, temperature=0.0, early_stopping=False)
+        start = time.perf_counter()
+        output = backend.generate(input_ids, max_length=max_length, temperature=0.0, early_stopping=False)
+        elapsed = time.perf_counter() - start
+        results[f"{name}_tokens_per_sec"] = batch_size * (output.size(1) - 1) / elapsed
+    results["speedup"] = results["onnxruntime_tokens_per_sec"] / results["pytorch_tokens_per_sec"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export LuminaLM to ONNX and compare backend throughput.")
+    parser.add_argument("--config_path", type=str, required=True, help="Path to configuration YAML file.")
+    parser.add_argument("--weights", type=str, help="Optional state dict to load before exporting.")
+    parser.add_argument("--output_dir", type=str, default="onnx_model")
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--src_len", type=int, default=64)
+    parser.add_argument("--max_length", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.config_path, 'r') as config_file:
+        config = LuminaLMConfig(**yaml.safe_load(config_file)['model'])
+    model = LuminaLM(config)
+    if args.weights:
+        model.load_state_dict(torch.load(args.weights, map_location="cpu", weights_only=True))
+    export_onnx(model, args.output_dir)
+    print(json.dumps(benchmark_backends(model, args.output_dir, args.batch_size, args.src_len, args.max_length, args.threads), indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
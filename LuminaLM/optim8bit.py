@@ -0,0 +1,284 @@
+"""
+AdamW with block-wise 8-bit quantized moments, in plain PyTorch.
+
+Stock AdamW keeps two fp32 moments per parameter (8 bytes). `AdamW8bit`
+stores each moment as one uint8 code per element plus one fp32 absmax per
+block of `block_size` elements (about 2 bytes per parameter for both moments):
+
+* every step the moments of a parameter are dequantized to fp32, updated
+  exactly as in AdamW, and the parameter gets the fp32 update (parameters in
+  lower precision are updated through an fp32 copy);
+* the new moments are quantized again per block: scaled by the block's absmax
+  and mapped to the nearest value of a 256-entry dynamic (exponent + fraction)
+  code, which keeps relative precision for small moments. The first moment
+  uses a signed code, the second moment an unsigned one;
+* tensors with fewer than `min_8bit_size` elements (biases, LayerNorm) keep
+  fp32 moments; they are a negligible share of the memory.
+
+The optimizer state holds only tensors and step counters, so state_dict() /
+load_state_dict() and the resumable checkpoints of training_state work
+unchanged. `compare_optimizers` trains the same model with both optimizers
+and reports the loss curves and optimizer-state memory.
+
+Usage:
+    optimizer = AdamW8bit(model.parameters(), lr=5e-5, weight_decay=0.01)
+    python optim8bit.py --config_path config.yaml --steps 200
+"""
+import json
+import math
+import logging
+import argparse
+import yaml
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from model import LuminaLM, LuminaLMConfig
+
+logger = logging.getLogger(__name__)
+
+OPTIMIZERS = ("adamw", "adamw8bit")
+
+
+def create_dynamic_map(signed: bool = True, max_exponent_bits: int = 7, total_bits: int = 8) -> torch.Tensor:
+    """
+    Sorted 2**total_bits code values in [-1, 1] (signed) or [0, 1].
+
+    Each exponent 10**-k, k < max_exponent_bits, gets a linear range of fractions, with more
+    fractions for larger exponents; 0 and 1 are represented exactly.
+    """
+    non_sign_bits = total_bits - (1 if signed else 0)
+    values: List[float] = []
+    for i in range(max_exponent_bits):
+        # 2**(i + 1) fractions per exponent for 8-bit unsigned codes, half as many (and their negatives) when signed
+        fraction_items = 2 ** (i + non_sign_bits - max_exponent_bits) + 1
+        boundaries = torch.linspace(0.1, 1, fraction_items)
+        means = ((boundaries[:-1] + boundaries[1:]) / 2.0 * 10 ** (-(max_exponent_bits - 1) + i)).tolist()
+        values += means + ([-mean for mean in means] if signed else [])
+    values += [0.0, 1.0]
+    if len(values) != 2 ** total_bits:
+        raise ValueError(f"Dynamic map has {len(values)} values instead of {2 ** total_bits}.")
+    return torch.tensor(sorted(values), dtype=torch.float32)
+
+
+def quantize_blockwise(
+    tensor: torch.Tensor,
+    code: torch.Tensor,
+    block_size: int,
+    out: Optional[torch.Tensor] = None
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Quantize a tensor to uint8 indices into code, with one absmax scale per block.
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: Flat uint8 codes and fp32 absmax of every block.
+    """
+    flat = tensor.reshape(-1).float()
+    num_blocks = math.ceil(flat.numel() / block_size)
+    padded = nn.functional.pad(flat, (0, num_blocks * block_size - flat.numel())).view(num_blocks, block_size)
+    absmax = padded.abs().amax(dim=1)
+    normalized = (padded / absmax.clamp(min=torch.finfo(torch.float32).tiny).unsqueeze(1)).reshape(-1)[:flat.numel()]
+    # Nearest code value: compare against the midpoints between neighbouring codes
+    midpoints = (code[1:] + code[:-1]) / 2
+    indices = torch.bucketize(normalized, midpoints).to(torch.uint8)
+    if out is not None:
+        out.copy_(indices)
+        indices = out
+    return indices, absmax
+
+
+def dequantize_blockwise(indices: torch.Tensor, absmax: torch.Tensor, code: torch.Tensor, block_size: int) -> torch.Tensor:
+    """Flat fp32 tensor of quantize_blockwise's codes."""
+    values = code[indices.long()]
+    num_blocks = absmax.numel()
+    padded = nn.functional.pad(values, (0, num_blocks * block_size - values.numel())).view(num_blocks, block_size)
+    return (padded * absmax.unsqueeze(1)).reshape(-1)[:values.numel()]
+
+
+class AdamW8bit(optim.Optimizer):
+    """
+    AdamW (decoupled weight decay) with block-wise 8-bit first and second moments.
+
+    Args:
+        params (Iterable): Parameters or parameter groups.
+        lr (float): Learning rate.
+        betas (Tuple[float, float]): Moment decay rates.
+        eps (float): Denominator term.
+        weight_decay (float): Decoupled weight decay.
+        block_size (int): Elements sharing one absmax scale.
+        min_8bit_size (int): Smaller tensors keep fp32 moments.
+    """
+    def __init__(
+        self,
+        params: Iterable,
+        lr: float = 1e-3,
+        betas: Tuple[float, float] = (0.9, 0.999),
+        eps: float = 1e-8,
+        weight_decay: float = 1e-2,
+        block_size: int = 2048,
+        min_8bit_size: int = 4096
+    ):
+        if lr < 0.0:
+            raise ValueError(f"Invalid learning rate: {lr}")
+        if not 0.0 <= betas[0] < 1.0 or not 0.0 <= betas[1] < 1.0:
+            raise ValueError(f"Invalid betas: {betas}")
+        if block_size <= 0:
+            raise ValueError("block_size must be a positive integer.")
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay, block_size=block_size, min_8bit_size=min_8bit_size)
+        super().__init__(params, defaults)
+        self._codes: Dict[Tuple[torch.device, bool], torch.Tensor] = {}
+
+    def _code(self, device: torch.device, signed: bool) -> torch.Tensor:
+        if (device, signed) not in self._codes:
+            self._codes[(device, signed)] = create_dynamic_map(signed).to(device)
+        return self._codes[(device, signed)]
+
+    def _init_state(self, param: torch.Tensor, group: Dict[str, Any]) -> Dict[str, Any]:
+        state = self.state[param]
+        state['step'] = torch.tensor(0.0)
+        if param.numel() >= group['min_8bit_size']:
+            num_blocks = math.ceil(param.numel() / group['block_size'])
+            zero_signed = int(torch.argmin(self._code(param.device, True).abs()))
+            state['exp_avg_q'] = torch.full((param.numel(),), zero_signed, dtype=torch.uint8, device=param.device)
+            state['exp_avg_absmax'] = torch.zeros(num_blocks, dtype=torch.float32, device=param.device)
+            state['exp_avg_sq_q'] = torch.zeros(param.numel(), dtype=torch.uint8, device=param.device)
+            state['exp_avg_sq_absmax'] = torch.zeros(num_blocks, dtype=torch.float32, device=param.device)
+        else:
+            state['exp_avg'] = torch.zeros_like(param, dtype=torch.float32)
+            state['exp_avg_sq'] = torch.zeros_like(param, dtype=torch.float32)
+        return state
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        # Optimizer.load_state_dict casts state tensors to the parameter dtype; restore the storage dtypes
+        super().load_state_dict(state_dict)
+        for state in self.state.values():
+            for key in ('exp_avg_q', 'exp_avg_sq_q'):
+                if key in state:
+                    state[key] = state[key].to(torch.uint8)
+            for key in ('exp_avg_absmax', 'exp_avg_sq_absmax', 'exp_avg', 'exp_avg_sq'):
+                if key in state:
+                    state[key] = state[key].float()
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            block_size = group['block_size']
+            for param in group['params']:
+                if param.grad is None:
+                    continue
+                if param.grad.is_sparse:
+                    raise RuntimeError("AdamW8bit does not support sparse gradients.")
+                state = self.state[param] if self.state[param] else self._init_state(param, group)
+                state['step'] += 1
+                step = state['step'].item()
+                quantized = 'exp_avg_q' in state
+
+                grad = param.grad.float()
+                if quantized:
+                    signed, unsigned = self._code(param.device, True), self._code(param.device, False)
+                    exp_avg = dequantize_blockwise(state['exp_avg_q'], state['exp_avg_absmax'], signed, block_size).view_as(grad)
+                    exp_avg_sq = dequantize_blockwise(state['exp_avg_sq_q'], state['exp_avg_sq_absmax'], unsigned, block_size).view_as(grad)
+                else:
+                    exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
+
+                exp_avg.lerp_(grad, 1 - beta1)
+                exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                bias_correction1 = 1 - beta1 ** step
+                bias_correction2 = 1 - beta2 ** step
+                denom = (exp_avg_sq / bias_correction2).sqrt_().add_(group['eps'])
+
+                # fp32 master update, also for lower-precision parameters
+                master = param.float() if param.dtype != torch.float32 else param
+                master.mul_(1 - group['lr'] * group['weight_decay'])
+                master.addcdiv_(exp_avg, denom, value=-group['lr'] / bias_correction1)
+                if master is not param:
+                    param.copy_(master)
+
+                if quantized:
+                    _, state['exp_avg_absmax'] = quantize_blockwise(exp_avg, signed, block_size, out=state['exp_avg_q'])
+                    _, state['exp_avg_sq_absmax'] = quantize_blockwise(exp_avg_sq, unsigned, block_size, out=state['exp_avg_sq_q'])
+        return loss
+
+
+def build_optimizer_class(name: str) -> type:
+    """Optimizer class of a training.optimizer name."""
+    if name not in OPTIMIZERS:
+        raise ValueError(f"Unknown optimizer '{name}'. Expected one of {OPTIMIZERS}.")
+    return AdamW8bit if name == "adamw8bit" else optim.AdamW
+
+
+def compare_optimizers(
+    config: LuminaLMConfig,
+    steps: int = 200,
+    batch_size: int = 8,
+    src_len: int = 32,
+    tgt_len: int = 16,
+    lr: float = 1e-3,
+    num_batches: int = 4
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Train the same model with AdamW and AdamW8bit on a fixed set of synthetic batches.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Per optimizer the loss of every step, the final loss and
+        the optimizer state bytes.
+    """
+    from benchmark_training import synthetic_batches
+    from sharding import local_state_bytes
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    generator = synthetic_batches(config, batch_size, src_len, tgt_len, device=device)
+    batches = [next(generator) for _ in range(num_batches)]
+    criterion = nn.CrossEntropyLoss(ignore_index=config.pad_token_id)
+    report = {}
+    for name in OPTIMIZERS:
+        torch.manual_seed(0)
+        model = LuminaLM(config).to(device)
+        optimizer = build_optimizer_class(name)(model.parameters(), lr=lr, weight_decay=0.01)
+        losses = []
+        for step in range(steps):
+            batch = batches[step % num_batches]
+            logits = model(input_ids=batch['input_ids'], decoder_input_ids=batch['decoder_input_ids'])
+            loss = criterion(logits.view(-1, logits.size(-1)), batch['labels'].reshape(-1))
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            losses.append(loss.item())
+        report[name] = {
+            'losses': losses,
+            'final_loss': sum(losses[-10:]) / len(losses[-10:]),
+            'optimizer_state_bytes': local_state_bytes(model, optimizer)['optimizer_state_bytes'],
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare AdamW and 8-bit AdamW on LuminaLM.")
+    parser.add_argument("--config_path", type=str, required=True, help="Path to configuration YAML file.")
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--output", type=str, default=None, help="Optional JSON report path.")
+    args = parser.parse_args()
+
+    with open(args.config_path, 'r') as config_file:
+        config_data = yaml.safe_load(config_file)
+    config = LuminaLMConfig(**config_data['model'])
+    report = compare_optimizers(config, args.steps, args.batch_size, lr=args.lr)
+    for name, stats in report.items():
+        logger.info(
+            f"{name}: final loss {stats['final_loss']:.4f}, optimizer state {stats['optimizer_state_bytes'] / 2**20:.1f} MiB"
+        )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,318 @@
+"""
+Sequence packing of QA examples for LuminaLM training.
+
+Padding every example to a multiple of block_size spends most of the decoder
+compute on padding, since most answers are a few tokens long. `PackedDataset`
+instead concatenates several (input, target) pairs into fixed-length rows:
+
+* encoder rows hold the inputs and decoder rows the targets of the same
+  examples, each example tagged with a segment id (0 marks padding);
+* position ids restart at 0 for every example, so each example sees the same
+  positions as it would alone;
+* `collate_packed` builds block-diagonal self-attention masks for the encoder
+  and decoder, and a cross-attention mask from decoder segments to the
+  encoder segments of the same example, so examples never attend to each
+  other (the decoder's causal mask is applied by the model on top);
+* labels are built per example (target + EOS, decoder input BOS + target) and
+  are pad_token_id everywhere else, which the training criterion ignores.
+
+Examples are assigned to rows first-fit over a window of open rows, in dataset
+order.
+
+Usage:
+    python packing.py --config_path config.yaml --tokenizer Medical_tokenizer.json --steps 20
+"""
+import time
+import json
+import logging
+import argparse
+import numpy as np
+import yaml
+import torch
+import torch.nn as nn
+from typing import Dict, List, Sequence
+from torch.utils.data import ConcatDataset, Dataset, Subset
+from token_cache import TokenCacheDataset
+from collator import LuminaLMCollator
+
+logger = logging.getLogger(__name__)
+
+
+def pack_examples(
+    input_lengths: Sequence[int],
+    target_lengths: Sequence[int],
+    encoder_length: int,
+    decoder_length: int,
+    max_open_rows: int = 64
+) -> List[List[int]]:
+    """
+    Group examples into rows whose inputs and targets fit encoder_length and decoder_length.
+
+    Each example goes to the first open row with room on both sides, or opens a new row.
+    When more than max_open_rows are open, the oldest one is closed.
+
+    Args:
+        input_lengths (Sequence[int]): Encoder tokens of every example (clipped to encoder_length).
+        target_lengths (Sequence[int]): Decoder tokens of every example, including BOS (clipped to decoder_length).
+
+    Returns:
+        List[List[int]]: Example indices of every row.
+    """
+    if max_open_rows < 1:
+        raise ValueError("max_open_rows must be a positive integer.")
+    rows: List[List[int]] = []
+    open_rows: List[List[int]] = []  # [encoder tokens used, decoder tokens used, row index]
+    for idx, (input_length, target_length) in enumerate(zip(input_lengths, target_lengths)):
+        input_length, target_length = min(input_length, encoder_length), min(target_length, decoder_length)
+        for row in open_rows:
+            if row[0] + input_length <= encoder_length and row[1] + target_length <= decoder_length:
+                row[0] += input_length
+                row[1] += target_length
+                rows[row[2]].append(idx)
+                break
+        else:
+            open_rows.append([input_length, target_length, len(rows)])
+            rows.append([idx])
+            if len(open_rows) > max_open_rows:
+                open_rows.pop(0)
+    return rows
+
+
+def example_lengths(dataset: Dataset, field: str = "input_ids") -> np.ndarray:
+    """Token counts of a (concatenated, subset) token cache, read from its offsets only; "targets" sums all targets."""
+    if isinstance(dataset, TokenCacheDataset) or hasattr(dataset, "lengths"):
+        return dataset.lengths(field)
+    if isinstance(dataset, ConcatDataset):
+        return np.concatenate([example_lengths(part, field) for part in dataset.datasets])
+    if isinstance(dataset, Subset):
+        return example_lengths(dataset.dataset, field)[np.asarray(dataset.indices, dtype=np.int64)]
+    if field == "targets":
+        examples = (dataset[idx] for idx in range(len(dataset)))
+        return np.array([
+            sum(len(target) for target in (example['targets'] if 'targets' in example else [example['decoder_input_ids']]))
+            for example in examples
+        ], dtype=np.int64)
+    return np.array([len(dataset[idx][field]) for idx in range(len(dataset))], dtype=np.int64)
+
+
+class PackedDataset(Dataset):
+    """
+    Fixed-length rows of packed examples of a tokenized QA dataset.
+
+    Args:
+        dataset (Dataset): Examples with input_ids and decoder_input_ids (the target tokens),
+            e.g. a TokenCacheDataset or a ConcatDataset/Subset of them.
+        encoder_length (int): Tokens per encoder row; longer inputs are truncated.
+        decoder_length (int): Tokens per decoder row; longer targets are truncated.
+        pad_token_id (int): Padding id of tokens and labels.
+        bos_token_id (int): First decoder input of every example.
+        eos_token_id (int): Last label of every example.
+        max_open_rows (int): Rows considered for each example while packing.
+    """
+    def __init__(
+        self,
+        dataset: Dataset,
+        encoder_length: int,
+        decoder_length: int,
+        pad_token_id: int = 0,
+        bos_token_id: int = 1,
+        eos_token_id: int = 2,
+        max_open_rows: int = 64
+    ):
+        self.dataset = dataset
+        self.encoder_length = encoder_length
+        self.decoder_length = decoder_length
+        self.pad_token_id = pad_token_id
+        self.bos_token_id = bos_token_id
+        self.eos_token_id = eos_token_id
+        self.input_lengths = example_lengths(dataset, "input_ids")
+        # The decoder sees BOS + target and predicts target + EOS
+        self.target_lengths = example_lengths(dataset, "decoder_input_ids") + 1
+        rows = pack_examples(self.input_lengths, self.target_lengths, encoder_length, decoder_length, max_open_rows)
+        self.row_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(row) for row in rows], out=self.row_offsets[1:])
+        self.example_ids = np.fromiter((idx for row in rows for idx in row), dtype=np.int64, count=int(self.row_offsets[-1]))
+        logger.info(
+            f"Packed {len(dataset)} examples into {len(rows)} rows "
+            f"(padding {self.padding_fraction('encoder'):.1%} encoder, {self.padding_fraction('decoder'):.1%} decoder)"
+        )
+
+    def __len__(self) -> int:
+        return len(self.row_offsets) - 1
+
+    def padding_fraction(self, side: str = "decoder") -> float:
+        """Fraction of the encoder or decoder row tokens that are padding."""
+        if side == "encoder":
+            real, length = np.minimum(self.input_lengths, self.encoder_length).sum(), self.encoder_length
+        else:
+            real, length = np.minimum(self.target_lengths, self.decoder_length).sum(), self.decoder_length
+        return 1.0 - float(real) / max(len(self) * length, 1)
+
+    def __getitem__(self, idx: int) -> Dict[str, np.ndarray]:
+        rows = {
+            'input_ids': np.full(self.encoder_length, self.pad_token_id, dtype=np.int64),
+            'position_ids': np.zeros(self.encoder_length, dtype=np.int64),
+            'segment_ids': np.zeros(self.encoder_length, dtype=np.int64),
+            'decoder_input_ids': np.full(self.decoder_length, self.pad_token_id, dtype=np.int64),
+            'labels': np.full(self.decoder_length, self.pad_token_id, dtype=np.int64),
+            'decoder_position_ids': np.zeros(self.decoder_length, dtype=np.int64),
+            'decoder_segment_ids': np.zeros(self.decoder_length, dtype=np.int64),
+        }
+        encoder_offset = decoder_offset = 0
+        for segment, example_id in enumerate(self.example_ids[self.row_offsets[idx]:self.row_offsets[idx + 1]], start=1):
+            example = self.dataset[int(example_id)]
+            inputs = np.asarray(example['input_ids'][:self.encoder_length], dtype=np.int64)
+            target = np.asarray(example['decoder_input_ids'][:self.decoder_length - 1], dtype=np.int64)
+
+            end = encoder_offset + len(inputs)
+            rows['input_ids'][encoder_offset:end] = inputs
+            rows['position_ids'][encoder_offset:end] = np.arange(len(inputs))
+            rows['segment_ids'][encoder_offset:end] = segment
+            encoder_offset = end
+
+            end = decoder_offset + len(target) + 1
+            rows['decoder_input_ids'][decoder_offset] = self.bos_token_id
+            rows['decoder_input_ids'][decoder_offset + 1:end] = target
+            rows['labels'][decoder_offset:end - 1] = target
+            rows['labels'][end - 1] = self.eos_token_id
+            rows['decoder_position_ids'][decoder_offset:end] = np.arange(len(target) + 1)
+            rows['decoder_segment_ids'][decoder_offset:end] = segment
+            decoder_offset = end
+        return rows
+
+
+def block_diagonal_mask(query_segments: torch.Tensor, key_segments: torch.Tensor) -> torch.Tensor:
+    """
+    Attention mask letting every query attend only to keys of its own segment.
+
+    Padding queries (segment 0) may attend to every key, so their softmax stays finite;
+    no real query attends to them.
+
+    Args:
+        query_segments (torch.Tensor): Segment ids of shape (batch_size, query_len).
+        key_segments (torch.Tensor): Segment ids of shape (batch_size, key_len).
+
+    Returns:
+        torch.Tensor: Boolean mask of shape (batch_size, 1, query_len, key_len).
+    """
+    same_segment = query_segments.unsqueeze(-1) == key_segments.unsqueeze(-2)
+    return (same_segment | (query_segments == 0).unsqueeze(-1)).unsqueeze(1)
+
+
+def collate_packed(rows: List[Dict[str, np.ndarray]]) -> Dict[str, torch.Tensor]:
+    """Stack packed rows into the keyword arguments of LuminaLM.forward plus labels."""
+    batch = {key: torch.from_numpy(np.stack([row[key] for row in rows])) for key in rows[0]}
+    segments, decoder_segments = batch.pop('segment_ids'), batch.pop('decoder_segment_ids')
+    batch['attention_mask'] = block_diagonal_mask(segments, segments)
+    batch['decoder_attention_mask'] = block_diagonal_mask(decoder_segments, decoder_segments)
+    batch['cross_attention_mask'] = block_diagonal_mask(decoder_segments, segments)
+    return batch
+
+
+def measure_throughput(
+    model: nn.Module,
+    batches: Sequence[Dict[str, torch.Tensor]],
+    pad_token_id: int,
+    device: torch.device
+) -> Dict[str, float]:
+    """
+    Train on batches and count real (non-padding) tokens per second.
+
+    Returns:
+        Dict[str, float]: tokens_per_sec (encoder plus decoder tokens), target_tokens_per_sec
+        and the padding_fraction of the encoder and decoder tensors.
+    """
+    criterion = nn.CrossEntropyLoss(ignore_index=pad_token_id)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    model.train()
+    real_tokens = target_tokens = total_tokens = 0
+    start = time.perf_counter()
+    for batch in batches:
+        inputs = {key: value.to(device) for key, value in batch.items()}
+        labels = inputs.pop('labels')
+        logits = model(**inputs)
+        loss = criterion(logits.view(-1, logits.size(-1)), labels.view(-1))
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        # Every real decoder position has a label; inputs never contain the pad id
+        targets = int((batch['labels'] != pad_token_id).sum())
+        target_tokens += targets
+        real_tokens += targets + int((batch['input_ids'] != pad_token_id).sum())
+        total_tokens += batch['input_ids'].numel() + batch['labels'].numel()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    return {
+        'tokens_per_sec': real_tokens / elapsed,
+        'target_tokens_per_sec': target_tokens / elapsed,
+        'padding_fraction': 1.0 - real_tokens / max(total_tokens, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare padded and packed LuminaLM training on the QA mixture.")
+    parser.add_argument("--config_path", type=str, required=True, help="Path to configuration YAML file.")
+    parser.add_argument("--tokenizer", type=str, default="Medical_tokenizer.json")
+    parser.add_argument("--steps", type=int, default=20, help="Training steps timed per layout.")
+    parser.add_argument("--output", type=str, default=None, help="Optional JSON report path.")
+    args = parser.parse_args()
+
+    from datasets import load_dataset
+    from tokenizers import Tokenizer
+    from model import LuminaLM, LuminaLMConfig
+    from token_cache import load_or_build_token_cache
+    with open(args.config_path, 'r') as config_file:
+        config_data = yaml.safe_load(config_file)
+    config = LuminaLMConfig(**config_data['model'])
+    training_config = config_data['training']
+    batch_size = training_config['batch_size']
+    tokenizer = Tokenizer.from_file(args.tokenizer)
+    caches = []
+    for dataset_name, splits in {"squad": ["train", "validation"], "trivia_qa": ["train"], "nq_open": ["train"]}.items():
+        for split in splits:
+            caches.append(load_or_build_token_cache(
+                load_dataset(dataset_name, split=split), tokenizer, training_config.get('token_cache_dir', "token_cache"),
+                config.block_size, config.pad_token_id, source=f"{dataset_name}/{split}"
+            ))
+    dataset = ConcatDataset(caches)
+    order = np.random.default_rng(0).permutation(len(dataset))
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    # The previous layout: one example per row, padded to a multiple of block_size
+    collator = LuminaLMCollator(
+        config.pad_token_id, config.bos_token_id, config.eos_token_id, pad_to_multiple_of=config.block_size
+    )
+    padded = [
+        collator([dataset[int(idx)] for idx in order[start:start + batch_size]])
+        for start in range(0, args.steps * batch_size, batch_size)
+    ]
+    packed_dataset = PackedDataset(
+        Subset(dataset, order.tolist()),
+        training_config.get('packing_encoder_length', config.block_size),
+        training_config.get('packing_decoder_length', config.block_size),
+        config.pad_token_id, config.bos_token_id, config.eos_token_id
+    )
+    packed = [
+        collate_packed([packed_dataset[row] for row in range(start, start + batch_size)])
+        for start in range(0, args.steps * batch_size, batch_size)
+    ]
+
+    report = {'num_examples': len(dataset), 'num_packed_rows': len(packed_dataset)}
+    for name, batches in (("padded", padded), ("packed", packed)):
+        torch.manual_seed(0)
+        model = LuminaLM(config).to(device)
+        measure_throughput(model, batches[:1], config.pad_token_id, device)  # warmup
+        report[name] = measure_throughput(model, batches[1:], config.pad_token_id, device)
+        logger.info(
+            f"{name}: padding {report[name]['padding_fraction']:.1%}, {report[name]['tokens_per_sec']:.0f} tokens/sec, "
+            f"{report[name]['target_tokens_per_sec']:.0f} target tokens/sec"
+        )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,11 +1,277 @@
-import model as model
-# Function to count the number of parameters
-def count_parameters(model):
+"""
+Analytical cost model of LuminaLM, computed from LuminaLMConfig alone.
+
+Reports parameters per module, forward FLOPs per token of the encoder and of
+one cached decoder step, training activation memory with and without
+checkpointing, KV-cache bytes per token and optimizer-state memory, without
+allocating any weights. Activation figures are estimates of the tensors
+autograd keeps for backward; they ignore allocator overhead and the dropout
+masks.
+
+Usage:
+    python parameters.py --config_path config.yaml
+    python parameters.py --config_path config.yaml --n_embd 256 512 768 --n_layers 4 6 12
+"""
+import argparse
+import dataclasses
+import itertools
+import yaml
+import torch.nn as nn
+from typing import Dict, List, Optional
+from model import LuminaLMConfig
+
+# Optimizer state bytes per trainable parameter (fp32 states; adamw8bit stores two uint8 moments)
+OPTIMIZER_STATE_BYTES = {
+    'sgd': 0,
+    'sgd_momentum': 4,
+    'adamw': 8,
+    'adamw8bit': 2,
+}
+
+
+def count_parameters(model: nn.Module) -> int:
+    """Number of trainable parameters of an instantiated model."""
     return sum(p.numel() for p in model.parameters() if p.requires_grad)
 
-# Example usage with Sentient Sculptor model
-model_config = model.LuminaLMConfig()  # Initialize a smaller custom GPT configuration
-model = model.LuminaLM(model_config)  # Randomly initialized Sentient Sculptor model
 
-total_params = count_parameters(model)
-print(f'Total number of trainable parameters: {total_params}')
+class ModelCost:
+    """Analytical parameter, FLOP and memory counts of a LuminaLMConfig."""
+
+    def __init__(self, config: LuminaLMConfig, dtype_bytes: int = 4):
+        """
+        Args:
+            config (LuminaLMConfig): Model configuration.
+            dtype_bytes (int): Bytes per element of weights, activations and caches.
+        """
+        self.config = config
+        self.dtype_bytes = dtype_bytes
+
+    # Parameters
+
+    def attention_parameters(self) -> int:
+        n_embd = self.config.n_embd
+        # q, k, v projections without bias, output projection with bias
+        return 4 * n_embd * n_embd + n_embd
+
+    def feed_forward_parameters(self) -> int:
+        n_embd = self.config.n_embd
+        return 8 * n_embd * n_embd + 5 * n_embd
+
+    def layer_norm_parameters(self) -> int:
+        return 2 * self.config.n_embd
+
+    def encoder_layer_parameters(self) -> int:
+        return self.attention_parameters() + self.feed_forward_parameters() + 2 * self.layer_norm_parameters()
+
+    def decoder_layer_parameters(self) -> int:
+        return 2 * self.attention_parameters() + self.feed_forward_parameters() + 3 * self.layer_norm_parameters()
+
+    def parameters_per_module(self) -> Dict[str, int]:
+        """Trainable parameters by top-level module of LuminaLM."""
+        config = self.config
+        return {
+            'wte': config.vocab_size * config.n_embd,
+            'position_embeddings': config.max_position_embeddings * config.n_embd,
+            'encoder': config.n_encoder_layers * self.encoder_layer_parameters(),
+            'encoder_ln': self.layer_norm_parameters(),
+            'decoder': config.n_decoder_layers * self.decoder_layer_parameters(),
+            'decoder_ln': self.layer_norm_parameters(),
+            # The output head shares the token embedding weight
+            'lm_head': 0 if config.shared_embeddings else config.vocab_size * config.n_embd,
+        }
+
+    def total_parameters(self) -> int:
+        return sum(self.parameters_per_module().values())
+
+    # FLOPs (2 per multiply-accumulate, forward pass)
+
+    def encoder_flops_per_token(self, src_len: int) -> int:
+        """Encoder FLOPs per source token, including the decoder's cross-attention key/value projections."""
+        config = self.config
+        n_embd = config.n_embd
+        attention = 8 * n_embd * n_embd + 4 * src_len * n_embd
+        feed_forward = 16 * n_embd * n_embd
+        cross_key_value = 4 * n_embd * n_embd
+        return config.n_encoder_layers * (attention + feed_forward) + config.n_decoder_layers * cross_key_value
+
+    def decoder_step_flops(self, src_len: int, context_len: int) -> int:
+        """FLOPs of one cached decoder step attending to context_len target and src_len source positions."""
+        config = self.config
+        n_embd = config.n_embd
+        self_attention = 8 * n_embd * n_embd + 4 * context_len * n_embd
+        # Cross-attention keys and values come from the cache
+        cross_attention = 4 * n_embd * n_embd + 4 * src_len * n_embd
+        feed_forward = 16 * n_embd * n_embd
+        lm_head = 2 * n_embd * config.vocab_size
+        return config.n_decoder_layers * (self_attention + cross_attention + feed_forward) + lm_head
+
+    # Memory
+
+    def _attention_activations(self, query_len: int, key_len: int) -> int:
+        """Saved elements of one attention sublayer per sequence."""
+        config = self.config
+        # LayerNorm input and output, q, k, v, context, plus the attention probabilities twice
+        return 6 * query_len * config.n_embd + 2 * config.n_head * query_len * key_len
+
+    def _feed_forward_activations(self, length: int) -> int:
+        # LayerNorm input and output, fc1 output, GELU output and their dropout outputs
+        return 10 * length * self.config.n_embd
+
+    def activation_bytes(self, batch_size: int, src_len: int, tgt_len: int, checkpoint_policy: str = "none") -> int:
+        """
+        Estimated activation memory of one training step.
+
+        Args:
+            batch_size (int): Sequences per batch.
+            src_len (int): Encoder sequence length.
+            tgt_len (int): Decoder sequence length.
+            checkpoint_policy (str): "none", "full", "attention", "ffn" or "every_k".
+
+        Returns:
+            int: Bytes kept for backward, plus the recomputed block's peak under checkpointing.
+        """
+        config = self.config
+        n_embd = config.n_embd
+        encoder_attention = self._attention_activations(src_len, src_len)
+        encoder_ffn = self._feed_forward_activations(src_len)
+        decoder_attention = (self._attention_activations(tgt_len, tgt_len)
+                             + self._attention_activations(tgt_len, src_len))
+        decoder_ffn = self._feed_forward_activations(tgt_len)
+
+        stacks = (
+            (config.n_encoder_layers, encoder_attention, encoder_ffn, src_len),
+            (config.n_decoder_layers, decoder_attention, decoder_ffn, tgt_len),
+        )
+        total = 0
+        recompute_peak = 0
+        for n_layers, attention, ffn, length in stacks:
+            block_input = length * n_embd
+            if checkpoint_policy == "none":
+                per_layer = [attention + ffn] * n_layers
+            elif checkpoint_policy == "full":
+                per_layer = [block_input] * n_layers
+            elif checkpoint_policy == "attention":
+                per_layer = [block_input + ffn] * n_layers
+            elif checkpoint_policy == "ffn":
+                per_layer = [attention + block_input] * n_layers
+            elif checkpoint_policy == "every_k":
+                every_k = config.checkpoint_every_k
+                per_layer = [block_input if idx % every_k == 0 else attention + ffn for idx in range(n_layers)]
+            else:
+                raise ValueError(f"Unsupported checkpoint policy '{checkpoint_policy}'.")
+            total += sum(per_layer)
+            if checkpoint_policy != "none" and n_layers:
+                recompute_peak = max(recompute_peak, attention + ffn)
+
+        # Embeddings and final LayerNorms on both sides, logits for the loss
+        total += 2 * (src_len + tgt_len) * n_embd + tgt_len * config.vocab_size
+        return (total + recompute_peak) * batch_size * self.dtype_bytes
+
+    def kv_cache_bytes_per_token(self) -> Dict[str, int]:
+        """Decoder cache bytes per generated (self-attention) and per source (cross-attention) token."""
+        per_token = self.config.n_decoder_layers * 2 * self.config.n_embd * self.dtype_bytes
+        return {'self_attention': per_token, 'cross_attention': per_token}
+
+    def training_state_bytes(self, optimizer: str = "adamw") -> Dict[str, int]:
+        """Weights, gradients and optimizer states of a training run."""
+        if optimizer not in OPTIMIZER_STATE_BYTES:
+            raise ValueError(f"Unknown optimizer '{optimizer}'. Expected one of {sorted(OPTIMIZER_STATE_BYTES)}.")
+        n_params = self.total_parameters()
+        return {
+            'weights': n_params * self.dtype_bytes,
+            'gradients': n_params * self.dtype_bytes,
+            'optimizer_states': n_params * OPTIMIZER_STATE_BYTES[optimizer],
+        }
+
+    def summary(self, batch_size: int, src_len: int, tgt_len: int, optimizer: str = "adamw") -> Dict[str, float]:
+        """Flat report used by the sweep table."""
+        config = self.config
+        return {
+            'n_embd': config.n_embd,
+            'n_head': config.n_head,
+            'n_encoder_layers': config.n_encoder_layers,
+            'n_decoder_layers': config.n_decoder_layers,
+            'parameters': self.total_parameters(),
+            'encoder_flops_per_token': self.encoder_flops_per_token(src_len),
+            'decoder_step_flops': self.decoder_step_flops(src_len, tgt_len),
+            'activation_bytes': self.activation_bytes(batch_size, src_len, tgt_len, "none"),
+            'activation_bytes_checkpointed': self.activation_bytes(batch_size, src_len, tgt_len, "full"),
+            'kv_cache_bytes_per_token': self.kv_cache_bytes_per_token()['self_attention'],
+            'optimizer_state_bytes': self.training_state_bytes(optimizer)['optimizer_states'],
+        }
+
+
+def sweep(
+    base_config: LuminaLMConfig,
+    n_embd: Optional[List[int]] = None,
+    n_head: Optional[List[int]] = None,
+    n_layers: Optional[List[int]] = None,
+    vocab_size: Optional[List[int]] = None
+) -> List[LuminaLMConfig]:
+    """Candidate configs over the cartesian product of the given values; n_layers sets both stacks."""
+    candidates = []
+    for embd, head, layers, vocab in itertools.product(
+        n_embd or [base_config.n_embd],
+        n_head or [base_config.n_head],
+        n_layers or [None],
+        vocab_size or [base_config.vocab_size]
+    ):
+        if embd % head != 0:
+            continue
+        overrides = dict(n_embd=embd, n_head=head, vocab_size=vocab)
+        if layers is not None:
+            overrides.update(n_encoder_layers=layers, n_decoder_layers=layers)
+        candidates.append(dataclasses.replace(base_config, **overrides))
+    return candidates
+
+
+def format_table(rows: List[Dict[str, float]]) -> str:
+    """Fixed-width table of summary rows, sizes in millions and MiB."""
+    header = (f"{'n_embd':>6} {'heads':>5} {'enc':>3} {'dec':>3} {'params M':>9} {'enc MFLOP/tok':>13} "
+              f"{'dec MFLOP/step':>14} {'act MiB':>9} {'act ckpt MiB':>12} {'KV KiB/tok':>10} {'optim MiB':>9}")
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        lines.append(
+            f"{row['n_embd']:>6} {row['n_head']:>5} {row['n_encoder_layers']:>3} {row['n_decoder_layers']:>3} "
+            f"{row['parameters'] / 1e6:>9.2f} {row['encoder_flops_per_token'] / 1e6:>13.1f} "
+            f"{row['decoder_step_flops'] / 1e6:>14.1f} {row['activation_bytes'] / 2**20:>9.1f} "
+            f"{row['activation_bytes_checkpointed'] / 2**20:>12.1f} {row['kv_cache_bytes_per_token'] / 2**10:>10.1f} "
+            f"{row['optimizer_state_bytes'] / 2**20:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analytical parameter, FLOP and memory costs of LuminaLM configs.")
+    parser.add_argument("--config_path", type=str, help="YAML config providing the base model section.")
+    parser.add_argument("--n_embd", type=int, nargs="+", help="Embedding sizes to sweep.")
+    parser.add_argument("--n_head", type=int, nargs="+", help="Head counts to sweep.")
+    parser.add_argument("--n_layers", type=int, nargs="+", help="Encoder and decoder depths to sweep.")
+    parser.add_argument("--vocab_size", type=int, nargs="+", help="Vocabulary sizes to sweep.")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--src_len", type=int, help="Encoder length, defaults to block_size.")
+    parser.add_argument("--tgt_len", type=int, help="Decoder length, defaults to block_size.")
+    parser.add_argument("--dtype_bytes", type=int, default=4, help="4 for fp32, 2 for fp16/bf16.")
+    parser.add_argument("--optimizer", type=str, default="adamw", choices=sorted(OPTIMIZER_STATE_BYTES))
+    args = parser.parse_args()
+
+    base_config = LuminaLMConfig()
+    if args.config_path:
+        with open(args.config_path, 'r') as config_file:
+            base_config = LuminaLMConfig(**yaml.safe_load(config_file)['model'])
+    src_len = args.src_len or base_config.block_size
+    tgt_len = args.tgt_len or base_config.block_size
+
+    configs = sweep(base_config, args.n_embd, args.n_head, args.n_layers, args.vocab_size)
+    rows = [ModelCost(config, args.dtype_bytes).summary(args.batch_size, src_len, tgt_len, args.optimizer) for config in configs]
+    print(f"batch_size={args.batch_size} src_len={src_len} tgt_len={tgt_len} dtype_bytes={args.dtype_bytes} optimizer={args.optimizer}")
+    print(format_table(rows))
+
+    if len(configs) == 1:
+        print("\nParameters per module:")
+        for name, count in ModelCost(configs[0], args.dtype_bytes).parameters_per_module().items():
+            print(f"  {name:<20} {count:>12,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+"""
+Pipeline-parallel training of LuminaLM across processes.
+
+The encoder and decoder blocks form one sequence of layers that is cut into
+contiguous stages, one per rank: by default the encoder on the first stage and
+the decoder on the second, or a balanced split (or an explicit
+`pipeline_layers` list of blocks per stage) for more stages. Each batch is cut
+into micro-batches that flow through the stages with the 1F1B
+(one-forward-one-backward) schedule: stage s runs S - s - 1 warm-up forwards,
+then alternates forward and backward, then drains the remaining backwards.
+Activations and their gradients travel with point-to-point send/recv, so gloo
+on CPU processes works as well as NCCL.
+
+Stages hold only their own blocks. The token and position embeddings, needed
+by the encoder and decoder embedding stages (and by the last stage when
+`lm_head` is tied to `wte`), are replicated there and kept in sync by
+all-reducing their gradients within the stages that share them.
+
+Every stage is given the whole batch and uses what it needs: input ids on the
+first stage, decoder ids where the decoder starts and labels on the last.
+
+Usage:
+    python pipeline.py --config_path config.yaml --world_size 2 --num_microbatches 4
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import tempfile
+import numpy as np
+import yaml
+import torch
+import torch.nn as nn
+import torch.distributed as dist
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from model import LuminaLM, LuminaLMConfig
+from distributed import (
+    DistributedConfig, init_distributed, cleanup_distributed, wrap_model, get_rank, get_world_size, spawn_local
+)
+
+logger = logging.getLogger(__name__)
+
+
+def partition_layers(
+    config: LuminaLMConfig, num_stages: int, layers_per_stage: Optional[Sequence[int]] = None
+) -> List[Tuple[int, int]]:
+    """
+    Contiguous [start, end) ranges of blocks per stage, counting encoder blocks then decoder blocks.
+
+    Args:
+        config (LuminaLMConfig): Model configuration.
+        num_stages (int): Number of pipeline stages.
+        layers_per_stage (Optional[Sequence[int]]): Blocks of each stage; by default two stages
+            split encoder from decoder and more stages get a balanced split.
+    """
+    total = config.n_encoder_layers + config.n_decoder_layers
+    if not 1 <= num_stages <= total:
+        raise ValueError(f"num_stages must be between 1 and the number of blocks ({total}), got {num_stages}.")
+    if layers_per_stage is None:
+        if num_stages == 2:
+            layers_per_stage = [config.n_encoder_layers, config.n_decoder_layers]
+        else:
+            layers_per_stage = [total // num_stages + (stage < total % num_stages) for stage in range(num_stages)]
+    if len(layers_per_stage) != num_stages or sum(layers_per_stage) != total or min(layers_per_stage) < 1:
+        raise ValueError(f"layers_per_stage {list(layers_per_stage)} must give {num_stages} stages {total} blocks in total.")
+    bounds = np.cumsum([0, *layers_per_stage]).tolist()
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class PipelineStage(nn.Module):
+    """The blocks of one stage, taken from a full LuminaLM whose other modules are dropped."""
+    def __init__(self, model: LuminaLM, start: int, end: int, is_last: bool):
+        super().__init__()
+        config = model.config
+        n_encoder = config.n_encoder_layers
+        self.encoder_range = range(start, min(end, n_encoder))
+        self.decoder_range = range(max(start, n_encoder) - n_encoder, max(end - n_encoder, 0))
+        self.embeds_encoder = start == 0
+        self.ends_encoder = start < n_encoder <= end
+        self.embeds_decoder = start <= n_encoder < end
+        self.receives_decoder = start > n_encoder
+        self.is_last = is_last
+
+        # Owned modules keep their LuminaLM names, so the stage state dicts merge into a full one
+        for idx in range(n_encoder):
+            if idx not in self.encoder_range:
+                model.encoder[idx] = nn.Identity()
+        for idx in range(config.n_decoder_layers):
+            if idx not in self.decoder_range:
+                model.decoder[idx] = nn.Identity()
+        embeds = self.embeds_encoder or self.embeds_decoder
+        if not embeds:
+            model.wte = None
+            model.position_embeddings = None
+        if not self.ends_encoder:
+            model.encoder_ln = None
+        if not is_last:
+            model.decoder_ln = None
+            model.lm_head = None
+        self.model = model
+
+    def forward(
+        self,
+        batch: Dict[str, torch.Tensor],
+        encoder_hidden: Optional[torch.Tensor] = None,
+        decoder_hidden: Optional[torch.Tensor] = None
+    ) -> Tuple[Optional[torch.Tensor], Optional[torch.Tensor]]:
+        """
+        Run this stage on a micro-batch.
+
+        Returns:
+            Tuple[Optional[torch.Tensor], Optional[torch.Tensor]]: Encoder and decoder hidden states
+            for the next stage; on the last stage, (None, logits).
+        """
+        attention_mask = batch.get('attention_mask')
+        if self.embeds_encoder:
+            encoder_hidden = self.model._embed(batch['input_ids'])
+        for idx in self.encoder_range:
+            encoder_hidden = self.model.encoder[idx](encoder_hidden, attention_mask)
+        if self.ends_encoder:
+            encoder_hidden = self.model.encoder_ln(encoder_hidden)
+
+        if self.embeds_decoder:
+            decoder_hidden = self.model._embed(batch['decoder_input_ids'])
+        for idx in self.decoder_range:
+            decoder_hidden = self.model.decoder[idx](
+                decoder_hidden, encoder_hidden, self_mask=batch.get('decoder_attention_mask'), cross_mask=attention_mask
+            )
+        if self.is_last:
+            return None, self.model.lm_head(self.model.decoder_ln(decoder_hidden))
+        return encoder_hidden, decoder_hidden
+
+
+class PipelineParallel(nn.Module):
+    """
+    One pipeline stage per rank, trained with the 1F1B schedule.
+
+    Args:
+        model (LuminaLM): Full model, built identically (same seed) on every rank.
+        num_microbatches (int): Micro-batches each batch is split into.
+        layers_per_stage (Optional[Sequence[int]]): Blocks per stage, see partition_layers.
+    """
+    def __init__(self, model: LuminaLM, num_microbatches: int = 4, layers_per_stage: Optional[Sequence[int]] = None):
+        super().__init__()
+        if num_microbatches < 1:
+            raise ValueError("num_microbatches must be a positive integer.")
+        self.config = model.config
+        self.num_stages = get_world_size()
+        self.stage_id = get_rank()
+        self.num_microbatches = num_microbatches
+        self.ranges = partition_layers(model.config, self.num_stages, layers_per_stage)
+        start, end = self.ranges[self.stage_id]
+        self.stage = PipelineStage(model, start, end, is_last=self.stage_id == self.num_stages - 1)
+        self.wait_seconds = 0.0
+        self._pending: List[Tuple[dist.Work, torch.Tensor]] = []
+        self._shared = self._shared_parameter_groups()
+
+    @property
+    def module(self) -> LuminaLM:
+        """This stage's (partial) LuminaLM, for saving with a gathered full state dict."""
+        return self.stage.model
+
+    @property
+    def is_first(self) -> bool:
+        return self.stage_id == 0
+
+    @property
+    def is_last(self) -> bool:
+        return self.stage_id == self.num_stages - 1
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return next(self.stage.parameters()).dtype
+
+    @property
+    def device(self) -> torch.device:
+        return next(self.stage.parameters()).device
+
+    def _shared_parameter_groups(self) -> List[Tuple[nn.Parameter, Optional[dist.ProcessGroup], bool]]:
+        """
+        Process groups of the stages that replicate the embeddings.
+
+        Returns:
+            List[Tuple[nn.Parameter, Optional[dist.ProcessGroup], bool]]: Each shared parameter of this stage,
+            the group of its replicas and whether this stage is the lowest (owning) replica.
+        """
+        stage_flags = []
+        for stage_id, (start, end) in enumerate(self.ranges):
+            n_encoder = self.config.n_encoder_layers
+            embeds = start == 0 or start <= n_encoder < end
+            is_last = stage_id == self.num_stages - 1
+            stage_flags.append((embeds, embeds or (is_last and self.config.shared_embeddings)))
+        position_ranks = [rank for rank, (embeds, _) in enumerate(stage_flags) if embeds]
+        token_ranks = [rank for rank, (_, holds_wte) in enumerate(stage_flags) if holds_wte]
+
+        shared = []
+        model = self.stage.model
+        for ranks, get_parameter in (
+            (token_ranks, lambda: model.wte.weight if model.wte is not None else model.lm_head.weight),
+            (position_ranks, lambda: model.position_embeddings.embeddings.weight),
+        ):
+            # new_group is collective: every rank creates every group, in the same order
+            group = dist.new_group(ranks=ranks) if len(ranks) > 1 else None
+            if self.stage_id in ranks:
+                parameter = get_parameter()
+                if group is not None:
+                    dist.broadcast(parameter.data, src=ranks[0], group=group)
+                shared.append((parameter, group, self.stage_id == ranks[0]))
+        return shared
+
+    def _send(self, tensors: Sequence[torch.Tensor], dst: int) -> None:
+        # Non-blocking sends: a stage sending activations never waits on a neighbour sending gradients
+        for tensor in tensors:
+            tensor = tensor.detach().contiguous()
+            self._pending.append((dist.isend(tensor, dst), tensor))
+
+    def _recv(self, shapes: Sequence[torch.Size], src: int) -> List[torch.Tensor]:
+        start = time.perf_counter()
+        tensors = []
+        for shape in shapes:
+            tensor = torch.empty(shape, dtype=self.dtype, device=self.device)
+            dist.recv(tensor, src)
+            tensors.append(tensor)
+        self.wait_seconds += time.perf_counter() - start
+        return tensors
+
+    def _wait_sends(self) -> None:
+        start = time.perf_counter()
+        for work, _ in self._pending:
+            work.wait()
+        self._pending = []
+        self.wait_seconds += time.perf_counter() - start
+
+    def _input_shapes(self, micro_batch: Dict[str, torch.Tensor]) -> List[torch.Size]:
+        batch_size, src_len = micro_batch['input_ids'].shape
+        shapes = [torch.Size((batch_size, src_len, self.config.n_embd))]
+        if self.stage.receives_decoder:
+            shapes.append(torch.Size((batch_size, micro_batch['decoder_input_ids'].size(1), self.config.n_embd)))
+        return shapes
+
+    def _run(
+        self,
+        batch: Dict[str, torch.Tensor],
+        criterion: Callable[[torch.Tensor, torch.Tensor], torch.Tensor],
+        train: bool
+    ) -> torch.Tensor:
+        micro_batches = [
+            dict(zip(batch, values))
+            for values in zip(*(tensor.tensor_split(self.num_microbatches) for tensor in batch.values()))
+        ]
+        micro_batches = [micro_batch for micro_batch in micro_batches if micro_batch['input_ids'].size(0) > 0]
+        num_microbatches = len(micro_batches)
+        inputs, outputs = [], []
+        total_loss = torch.zeros((), device=self.device)
+
+        def forward_step(idx: int) -> None:
+            nonlocal total_loss
+            micro_batch = micro_batches[idx]
+            received = [] if self.is_first else self._recv(self._input_shapes(micro_batch), self.stage_id - 1)
+            for tensor in received:
+                tensor.requires_grad_(train)
+            encoder_hidden, decoder_hidden = self.stage(
+                micro_batch, received[0] if received else None, received[1] if len(received) > 1 else None
+            )
+            if self.is_last:
+                logits = decoder_hidden
+                loss = criterion(logits.view(-1, logits.size(-1)), micro_batch['labels'].reshape(-1)) / num_microbatches
+                total_loss = total_loss + loss.detach()
+                sent = [loss]
+            else:
+                sent = [tensor for tensor in (encoder_hidden, decoder_hidden) if tensor is not None]
+                self._send(sent, self.stage_id + 1)
+            if train:
+                inputs.append(received)
+                outputs.append(sent)
+
+        def backward_step() -> None:
+            received, sent = inputs.pop(0), outputs.pop(0)
+            if self.is_last:
+                torch.autograd.backward(sent)
+            else:
+                grads = self._recv([tensor.shape for tensor in sent], self.stage_id + 1)
+                torch.autograd.backward(sent, grads)
+            if not self.is_first:
+                self._send([
+                    tensor.grad if tensor.grad is not None else torch.zeros_like(tensor) for tensor in received
+                ], self.stage_id - 1)
+
+        if train:
+            warmup = min(self.num_stages - self.stage_id - 1, num_microbatches)
+            for idx in range(warmup):
+                forward_step(idx)
+            for idx in range(warmup, num_microbatches):
+                forward_step(idx)
+                backward_step()
+            for _ in range(warmup):
+                backward_step()
+            self._wait_sends()
+            self._sync_shared_gradients()
+        else:
+            with torch.no_grad():
+                for idx in range(num_microbatches):
+                    forward_step(idx)
+            self._wait_sends()
+
+        # Every stage returns the loss computed on the last one
+        dist.broadcast(total_loss, src=self.num_stages - 1)
+        return total_loss
+
+    def _sync_shared_gradients(self) -> None:
+        for parameter, group, _ in self._shared:
+            if group is None:
+                continue
+            if parameter.grad is None:
+                parameter.grad = torch.zeros_like(parameter)
+            dist.all_reduce(parameter.grad, group=group)
+
+    def train_step(
+        self,
+        input_ids: torch.Tensor,
+        decoder_input_ids: torch.Tensor,
+        labels: torch.Tensor,
+        criterion: Callable[[torch.Tensor, torch.Tensor], torch.Tensor],
+        attention_mask: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        """
+        Forward and backward passes of one batch through all stages; the caller steps the optimizer.
+
+        Returns:
+            torch.Tensor: Batch loss (mean of the micro-batch losses) on every rank, detached.
+        """
+        batch = {'input_ids': input_ids, 'decoder_input_ids': decoder_input_ids, 'labels': labels}
+        if attention_mask is not None:
+            batch['attention_mask'] = attention_mask
+        return self._run(batch, criterion, train=True)
+
+    def eval_step(
+        self,
+        input_ids: torch.Tensor,
+        decoder_input_ids: torch.Tensor,
+        labels: torch.Tensor,
+        criterion: Callable[[torch.Tensor, torch.Tensor], torch.Tensor],
+        attention_mask: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        """Forward-only pass of one batch; returns the loss on every rank."""
+        batch = {'input_ids': input_ids, 'decoder_input_ids': decoder_input_ids, 'labels': labels}
+        if attention_mask is not None:
+            batch['attention_mask'] = attention_mask
+        return self._run(batch, criterion, train=False)
+
+    def clip_grad_norm_(self, max_norm: float) -> torch.Tensor:
+        """Clip by the gradient norm over all stages, counting each shared parameter once."""
+        replicas = {id(parameter) for parameter, _, owner in self._shared if not owner}
+        squares = torch.zeros((), dtype=torch.float64, device=self.device)
+        for parameter in self.stage.parameters():
+            if parameter.grad is not None and id(parameter) not in replicas:
+                squares += parameter.grad.detach().double().pow(2).sum()
+        dist.all_reduce(squares)
+        total_norm = squares.sqrt()
+        clip_coef = max_norm / (total_norm.item() + 1e-6)
+        if clip_coef < 1.0:
+            for parameter in self.stage.parameters():
+                if parameter.grad is not None:
+                    parameter.grad.mul_(clip_coef)
+        return total_norm.float()
+
+    def gather_full_state(self) -> Optional[Dict[str, torch.Tensor]]:
+        """Full LuminaLM state dict merged from all stages on rank 0; None on other ranks. Collective."""
+        state = {name: tensor.cpu() for name, tensor in self.stage.model.state_dict().items()}
+        states = [None] * self.num_stages if self.is_first else None
+        dist.gather_object(state, states, dst=0)
+        if not self.is_first:
+            return None
+        merged = {}
+        for stage_state in states:
+            merged.update(stage_state)
+        if self.config.shared_embeddings:
+            # The tied head is saved under both names, like LuminaLM.state_dict()
+            merged['lm_head.weight'] = merged['wte.weight']
+        return merged
+
+
+def bubble_fraction(num_stages: int, num_microbatches: int) -> float:
+    """Idle fraction of an ideal 1F1B pipeline with equal stage times."""
+    return (num_stages - 1) / (num_microbatches + num_stages - 1)
+
+
+def _benchmark_rank(
+    rank: int, world_size: int, config: LuminaLMConfig, mode: str,
+    batch_size: int, num_microbatches: int, steps: int, warmup: int, output_dir: str
+) -> None:
+    from benchmark_training import synthetic_batches
+    device = init_distributed("gloo")
+    torch.manual_seed(0)
+    model = LuminaLM(config)
+    criterion = nn.CrossEntropyLoss(ignore_index=config.pad_token_id)
+    batches = synthetic_batches(config, batch_size, config.block_size, config.block_size, seed=0)
+    if mode == "pipeline":
+        model = PipelineParallel(model, num_microbatches)
+    else:
+        model = wrap_model(model, device, DistributedConfig())
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+
+    step_seconds, wait_seconds = [], []
+    for step in range(warmup + steps):
+        batch = next(batches)
+        start = time.perf_counter()
+        optimizer.zero_grad(set_to_none=True)
+        if mode == "pipeline":
+            model.wait_seconds = 0.0
+            model.train_step(batch['input_ids'], batch['decoder_input_ids'], batch['labels'], criterion)
+        else:
+            # Data parallel: the same global batch, split across ranks
+            local = {name: tensor[rank::world_size] for name, tensor in batch.items()}
+            logits = model(input_ids=local['input_ids'], decoder_input_ids=local['decoder_input_ids'])
+            criterion(logits.view(-1, logits.size(-1)), local['labels'].reshape(-1)).backward()
+        optimizer.step()
+        if step >= warmup:
+            step_seconds.append(time.perf_counter() - start)
+            wait_seconds.append(model.wait_seconds if mode == "pipeline" else 0.0)
+
+    with open(os.path.join(output_dir, f"rank{rank}.json"), 'w') as f:
+        json.dump({'step_seconds': float(np.median(step_seconds)), 'wait_fraction': float(np.sum(wait_seconds) / np.sum(step_seconds))}, f)
+    cleanup_distributed()
+
+
+def benchmark_pipeline(
+    config: LuminaLMConfig,
+    world_size: int = 2,
+    batch_size: int = 8,
+    num_microbatches: int = 4,
+    steps: int = 10,
+    warmup: int = 2
+) -> List[Dict[str, Any]]:
+    """Samples/sec of pipeline and data parallel training at the same global batch, with the pipeline bubble."""
+    rows = []
+    for mode in ("data_parallel", "pipeline"):
+        with tempfile.TemporaryDirectory() as output_dir:
+            spawn_local(_benchmark_rank, world_size, config, mode, batch_size, num_microbatches, steps, warmup, output_dir)
+            reports = []
+            for rank in range(world_size):
+                with open(os.path.join(output_dir, f"rank{rank}.json")) as f:
+                    reports.append(json.load(f))
+        step_seconds = max(report['step_seconds'] for report in reports)
+        row = {'mode': mode, 'world_size': world_size, 'batch_size': batch_size, 'step_ms': step_seconds * 1000,
+               'samples_per_sec': batch_size / step_seconds}
+        if mode == "pipeline":
+            row['num_microbatches'] = num_microbatches
+            # Time stages spend blocked on their neighbours, and the ideal schedule's bubble
+            row['measured_bubble_fraction'] = float(np.mean([report['wait_fraction'] for report in reports]))
+            row['ideal_bubble_fraction'] = bubble_fraction(world_size, num_microbatches)
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline versus data parallel LuminaLM training with gloo on CPU.")
+    parser.add_argument("--config_path", type=str, required=True, help="Path to configuration YAML file.")
+    parser.add_argument("--world_size", type=int, default=2)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--num_microbatches", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--output", type=str, help="Optional JSON report path.")
+    args = parser.parse_args()
+
+    with open(args.config_path, 'r') as config_file:
+        config = LuminaLMConfig(**yaml.safe_load(config_file)['model'])
+    rows = benchmark_pipeline(config, args.world_size, args.batch_size, args.num_microbatches, args.steps, args.warmup)
+
+    for row in rows:
+        line = f"{row['mode']:>13}: {row['step_ms']:.1f} ms/step, {row['samples_per_sec']:.1f} samples/s"
+        if row['mode'] == "pipeline":
+            line += (f", bubble {row['measured_bubble_fraction']:.1%} measured / "
+                     f"{row['ideal_bubble_fraction']:.1%} ideal ({row['num_microbatches']} micro-batches)")
+        print(line)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
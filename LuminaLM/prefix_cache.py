@@ -0,0 +1,264 @@
+"""
+Radix-tree prefix cache for LuminaLM decoder self-attention keys and values.
+
+Decoder prompts that share a prefix (answer templates, few-shot scaffolds)
+reuse the cached self-attention keys and values of the longest cached match
+and only run the remaining suffix through the decoder. Cached segments are
+reference counted while in use and evicted least-recently-used first once the
+memory budget is exceeded.
+
+Decoder self-attention keys of layer l > 0 depend on the cross-attention
+output of the layers below, hence on the encoder input. A prefix can only be
+shared across encoder inputs when the configuration proves it independent of
+them (a single decoder layer); otherwise every entry is namespaced by a hash
+of the encoder input.
+"""
+import hashlib
+import logging
+import threading
+import torch
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Hashable
+
+logger = logging.getLogger(__name__)
+
+KeyValue = Tuple[torch.Tensor, torch.Tensor]
+
+
+def decoder_prefix_is_encoder_independent(config) -> bool:
+    """Whether cached decoder self-attention keys and values never depend on the encoder input."""
+    # Only the first decoder layer's self-attention runs before any cross-attention
+    return config.n_decoder_layers <= 1
+
+
+class _RadixNode:
+    """Edge of the radix tree holding the keys and values of its token segment."""
+
+    __slots__ = ('tokens', 'kv', 'children', 'parent', 'ref_count', 'last_access', 'nbytes')
+
+    def __init__(self, tokens: Tuple[int, ...], kv: List[KeyValue], parent: Optional['_RadixNode']):
+        self.tokens = tokens
+        # Per decoder layer: keys and values of shape (n_head, len(tokens), head_dim)
+        self.kv = kv
+        self.children: Dict[int, '_RadixNode'] = {}
+        self.parent = parent
+        self.ref_count = 0
+        self.last_access = 0
+        self.nbytes = sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in kv)
+
+    def split(self, length: int) -> '_RadixNode':
+        """Split the edge after length tokens and return the new upper node."""
+        upper = _RadixNode(
+            self.tokens[:length],
+            [(k[:, :length].clone(), v[:, :length].clone()) for k, v in self.kv],
+            self.parent
+        )
+        # Pins stay on the lower node; the upper node cannot be evicted while it has a child
+        upper.last_access = self.last_access
+        self.parent.children[self.tokens[0]] = upper
+        self.tokens = self.tokens[length:]
+        self.kv = [(k[:, length:].clone(), v[:, length:].clone()) for k, v in self.kv]
+        self.nbytes = sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in self.kv)
+        self.parent = upper
+        upper.children[self.tokens[0]] = self
+        return upper
+
+
+@dataclass
+class PrefixLookup:
+    """Result of a batched prefix lookup; release() it once the cached tensors are no longer needed."""
+    length: int
+    past_key_values: Optional[List[Tuple[KeyValue, None]]]
+    namespaces: List[Hashable]
+    nodes: List[List[_RadixNode]] = field(default_factory=list)
+
+
+class PrefixCache:
+    """Radix tree of decoder prompt prefixes with reference counting and LRU eviction."""
+
+    def __init__(self, config, max_bytes: int = 512 * 1024 * 1024):
+        """
+        Args:
+            config (LuminaLMConfig): Model configuration, used to decide whether
+                prefixes can be shared across encoder inputs.
+            max_bytes (int): Memory budget for cached keys and values.
+        """
+        self.max_bytes = max_bytes
+        self.encoder_independent = decoder_prefix_is_encoder_independent(config)
+        self._roots: Dict[Hashable, _RadixNode] = {}
+        self._lock = threading.Lock()
+        self._clock = 0
+        self.bytes_used = 0
+        self.lookups = 0
+        self.hits = 0
+        self.queried_tokens = 0
+        self.hit_tokens = 0
+        self.evictions = 0
+
+    def namespace(self, input_ids: torch.Tensor) -> Hashable:
+        """Namespace of one encoder input row."""
+        if self.encoder_independent:
+            return None
+        return hashlib.sha1(input_ids.detach().cpu().numpy().tobytes()).hexdigest()
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def _match(self, namespace: Hashable, tokens: Tuple[int, ...]) -> Tuple[int, List[_RadixNode]]:
+        """Longest cached prefix of tokens and the nodes covering it."""
+        node = self._roots.get(namespace)
+        matched, path = 0, []
+        if node is None:
+            return matched, path
+        while matched < len(tokens):
+            child = node.children.get(tokens[matched])
+            if child is None:
+                break
+            common = 0
+            limit = min(len(child.tokens), len(tokens) - matched)
+            while common < limit and child.tokens[common] == tokens[matched + common]:
+                common += 1
+            path.append(child)
+            matched += common
+            if common < len(child.tokens):
+                break
+            node = child
+        return matched, path
+
+    def lookup(self, input_ids: torch.Tensor, decoder_input_ids: torch.Tensor) -> PrefixLookup:
+        """
+        Find the longest cached decoder prefix shared by every row of a batch.
+
+        At least the last prompt token is left uncached so that the caller gets
+        its hidden state. The returned nodes are pinned against eviction until
+        release() is called.
+
+        Args:
+            input_ids (torch.Tensor): Encoder input of shape (batch_size, src_len).
+            decoder_input_ids (torch.Tensor): Decoder prompt of shape (batch_size, tgt_len).
+
+        Returns:
+            PrefixLookup: Matched length and stacked per-layer self-attention keys and values.
+        """
+        with self._lock:
+            namespaces = [self.namespace(row) for row in input_ids]
+            rows = [tuple(row) for row in decoder_input_ids[:, :-1].tolist()]
+            matches = [self._match(ns, tokens) for ns, tokens in zip(namespaces, rows)]
+            length = min(matched for matched, _ in matches)
+
+            self.lookups += len(rows)
+            self.queried_tokens += sum(len(tokens) for tokens in rows)
+            self.hit_tokens += length * len(rows)
+            if length == 0:
+                return PrefixLookup(0, None, namespaces)
+            self.hits += len(rows)
+
+            now = self._tick()
+            pinned = []
+            for _, path in matches:
+                for node in path:
+                    node.ref_count += 1
+                    node.last_access = now
+                pinned.append(path)
+
+            past_key_values = []
+            for layer in range(len(pinned[0][0].kv)):
+                keys, values = [], []
+                for path in pinned:
+                    keys.append(torch.cat([node.kv[layer][0] for node in path], dim=1)[:, :length])
+                    values.append(torch.cat([node.kv[layer][1] for node in path], dim=1)[:, :length])
+                past_key_values.append(((torch.stack(keys), torch.stack(values)), None))
+            return PrefixLookup(length, past_key_values, namespaces, pinned)
+
+    def release(self, lookup: PrefixLookup) -> None:
+        """Unpin the nodes of a lookup."""
+        with self._lock:
+            for path in lookup.nodes:
+                for node in path:
+                    node.ref_count -= 1
+            lookup.nodes = []
+            self._evict()
+
+    def insert(
+        self,
+        namespaces: List[Hashable],
+        decoder_input_ids: torch.Tensor,
+        past_key_values: List[Tuple[KeyValue, Optional[KeyValue]]]
+    ) -> None:
+        """
+        Cache the self-attention keys and values of every row's decoder prompt.
+
+        Args:
+            namespaces (List[Hashable]): Per-row namespaces from a previous lookup.
+            decoder_input_ids (torch.Tensor): Decoder prompt of shape (batch_size, tgt_len).
+            past_key_values (List[Tuple[KeyValue, Optional[KeyValue]]]): Decoder cache covering
+                at least the prompt positions.
+        """
+        length = decoder_input_ids.size(1)
+        with self._lock:
+            now = self._tick()
+            for row, (namespace, tokens) in enumerate(zip(namespaces, decoder_input_ids.tolist())):
+                tokens = tuple(tokens)
+                root = self._roots.get(namespace)
+                if root is None:
+                    root = self._roots[namespace] = _RadixNode((), [], None)
+
+                node, matched = root, 0
+                while matched < length:
+                    child = node.children.get(tokens[matched])
+                    if child is None:
+                        segment = [
+                            (k[row, :, matched:length].clone(), v[row, :, matched:length].clone())
+                            for (k, v), _ in past_key_values
+                        ]
+                        leaf = _RadixNode(tokens[matched:], segment, node)
+                        leaf.last_access = now
+                        node.children[tokens[matched]] = leaf
+                        self.bytes_used += leaf.nbytes
+                        break
+                    common = 0
+                    limit = min(len(child.tokens), length - matched)
+                    while common < limit and child.tokens[common] == tokens[matched + common]:
+                        common += 1
+                    if common < len(child.tokens):
+                        child = child.split(common)
+                    child.last_access = now
+                    node, matched = child, matched + common
+            self._evict()
+
+    def _evict(self) -> None:
+        """Evict least-recently-used unpinned leaves until the budget is met."""
+        while self.bytes_used > self.max_bytes:
+            victim = None
+            for namespace, root in self._roots.items():
+                stack = list(root.children.values())
+                while stack:
+                    node = stack.pop()
+                    if node.children:
+                        stack.extend(node.children.values())
+                    elif node.ref_count == 0 and (victim is None or node.last_access < victim[1].last_access):
+                        victim = (namespace, node)
+            if victim is None:
+                logger.debug("Prefix cache over budget but every entry is pinned.")
+                return
+            namespace, node = victim
+            del node.parent.children[node.tokens[0]]
+            self.bytes_used -= node.nbytes
+            self.evictions += 1
+            if not self._roots[namespace].children:
+                del self._roots[namespace]
+
+    def stats(self) -> Dict[str, float]:
+        """Hit-rate and memory metrics."""
+        with self._lock:
+            return {
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+                'token_hit_rate': self.hit_tokens / self.queried_tokens if self.queried_tokens else 0.0,
+                'bytes_used': self.bytes_used,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'namespaces': len(self._roots),
+            }
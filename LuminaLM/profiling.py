@@ -0,0 +1,295 @@
+"""
+Opt-in per-module latency, FLOP and memory profiler for LuminaLM.
+
+ModuleProfiler registers forward (and optionally backward) hooks on every
+EncoderBlock, DecoderBlock, FlashAttention, FeedForward and the lm_head while
+attached, and removes them all on detach, so an unattached model runs without
+any hook. Each call records wall time, analytical FLOPs, output bytes and, on
+CUDA, the change in allocated memory. Calls are aggregated per module type and
+exported as JSON or as a Chrome trace (chrome://tracing, Perfetto).
+
+Module ranges are also emitted as torch.profiler record_function annotations,
+and an optional torch.profiler schedule restricts recording to its active steps.
+
+Block FLOPs are inclusive of their attention and feed-forward children, so the
+per-type totals overlap. Forward hooks of checkpointed blocks also fire when
+the block is recomputed during backward.
+"""
+import json
+import time
+import logging
+import argparse
+import yaml
+import torch
+import torch.nn as nn
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from torch.profiler import ProfilerAction
+from model import LuminaLM, LuminaLMConfig, EncoderBlock, DecoderBlock, FlashAttention, FeedForward
+
+logger = logging.getLogger(__name__)
+
+PROFILED_TYPES = (EncoderBlock, DecoderBlock, FlashAttention, FeedForward)
+_RECORDING_ACTIONS = (ProfilerAction.RECORD, ProfilerAction.RECORD_AND_SAVE)
+
+
+def _output_bytes(output: Any) -> int:
+    if isinstance(output, torch.Tensor):
+        return output.numel() * output.element_size()
+    if isinstance(output, (tuple, list)):
+        return sum(_output_bytes(item) for item in output)
+    return 0
+
+
+def _first_tensor(value: Any) -> Optional[torch.Tensor]:
+    if isinstance(value, torch.Tensor):
+        return value
+    if isinstance(value, (tuple, list)):
+        for item in value:
+            tensor = _first_tensor(item)
+            if tensor is not None:
+                return tensor
+    return None
+
+
+def estimate_flops(module: nn.Module, args: Tuple, kwargs: Dict[str, Any]) -> int:
+    """Forward FLOPs (2 per multiply-accumulate) of one call, excluding profiled children."""
+    if isinstance(module, FlashAttention):
+        query = args[0]
+        key = args[1] if len(args) > 1 else kwargs.get('key')
+        past_key_value = args[5] if len(args) > 5 else kwargs.get('past_key_value')
+        batch_size, query_len, n_embd = query.shape
+        past_len = past_key_value[0].size(2) if past_key_value is not None else 0
+        new_len = key.size(1) if key is not None else 0
+        key_len = past_len + new_len
+        projections = 2 * batch_size * n_embd * n_embd * (2 * query_len + 2 * new_len)
+        return projections + 4 * batch_size * query_len * key_len * n_embd
+    if isinstance(module, FeedForward):
+        x = args[0]
+        return 16 * x.numel() * x.size(-1)
+    if isinstance(module, nn.Linear):
+        return 2 * args[0].numel() * module.out_features
+    # Blocks: LayerNorms and residual adds are negligible, children are added on exit
+    return 0
+
+
+class ModuleProfiler:
+    """Hooks recording per-call wall time, FLOPs and memory of LuminaLM modules."""
+
+    def __init__(
+        self,
+        model: LuminaLM,
+        record_backward: bool = True,
+        schedule: Optional[Callable[[int], ProfilerAction]] = None
+    ):
+        """
+        Args:
+            model (LuminaLM): Model to profile.
+            record_backward (bool): Also time each module's backward pass.
+            schedule (Optional[Callable[[int], ProfilerAction]]): torch.profiler.schedule; calls
+                are only recorded on steps where it returns RECORD or RECORD_AND_SAVE.
+        """
+        self.model = model
+        self.record_backward = record_backward
+        self.schedule = schedule
+        self.step_num = 0
+        self.events: List[Dict[str, Any]] = []
+        self._handles = []
+        self._stack: List[Dict[str, Any]] = []
+        self._backward_starts: Dict[int, List[float]] = defaultdict(list)
+        self._origin = time.perf_counter()
+        self._modules = {}
+        for name, module in model.named_modules():
+            if isinstance(module, PROFILED_TYPES):
+                self._modules[module] = (name, type(module).__name__)
+        self._modules[model.lm_head] = ("lm_head", "lm_head")
+
+    @property
+    def attached(self) -> bool:
+        return bool(self._handles)
+
+    def attach(self) -> 'ModuleProfiler':
+        """Register the hooks."""
+        if self.attached:
+            return self
+        for module in self._modules:
+            self._handles.append(module.register_forward_pre_hook(self._forward_pre_hook, with_kwargs=True))
+            self._handles.append(module.register_forward_hook(self._forward_hook, with_kwargs=True))
+            if self.record_backward:
+                self._handles.append(module.register_full_backward_pre_hook(self._backward_pre_hook))
+                self._handles.append(module.register_full_backward_hook(self._backward_hook))
+        return self
+
+    def detach(self) -> None:
+        """Remove every hook; the model is back to its unprofiled cost."""
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        self._stack = []
+        self._backward_starts.clear()
+
+    def __enter__(self) -> 'ModuleProfiler':
+        return self.attach()
+
+    def __exit__(self, *exc) -> None:
+        self.detach()
+
+    def step(self) -> None:
+        """Advance the schedule; call once per iteration, next to torch.profiler's prof.step()."""
+        self.step_num += 1
+
+    def reset(self) -> None:
+        self.events = []
+
+    def _recording(self) -> bool:
+        return self.schedule is None or self.schedule(self.step_num) in _RECORDING_ACTIONS
+
+    @staticmethod
+    def _now(tensor: Optional[torch.Tensor]) -> float:
+        if tensor is not None and tensor.is_cuda:
+            torch.cuda.synchronize(tensor.device)
+        return time.perf_counter()
+
+    def _forward_pre_hook(self, module: nn.Module, args: Tuple, kwargs: Dict[str, Any]) -> None:
+        if not self._recording():
+            return
+        name, module_type = self._modules[module]
+        tensor = _first_tensor(args)
+        annotation = torch.autograd.profiler.record_function(f"{module_type}:{name}")
+        annotation.__enter__()
+        self._stack.append({
+            'module': module,
+            'annotation': annotation,
+            'flops': estimate_flops(module, args, kwargs),
+            'allocated': torch.cuda.memory_allocated(tensor.device) if tensor is not None and tensor.is_cuda else 0,
+            'start': self._now(tensor),
+        })
+
+    def _forward_hook(self, module: nn.Module, args: Tuple, kwargs: Dict[str, Any], output: Any) -> None:
+        if not self._stack or self._stack[-1]['module'] is not module:
+            return
+        frame = self._stack.pop()
+        tensor = _first_tensor(output)
+        end = self._now(tensor)
+        frame['annotation'].__exit__(None, None, None)
+        if self._stack:
+            self._stack[-1]['flops'] += frame['flops']
+        allocated = 0
+        if tensor is not None and tensor.is_cuda:
+            allocated = torch.cuda.memory_allocated(tensor.device) - frame['allocated']
+        name, module_type = self._modules[module]
+        self.events.append({
+            'name': name,
+            'type': module_type,
+            'phase': 'forward',
+            'step': self.step_num,
+            'start_s': frame['start'] - self._origin,
+            'duration_s': end - frame['start'],
+            'flops': frame['flops'],
+            'output_bytes': _output_bytes(output),
+            'allocated_bytes': allocated,
+        })
+
+    def _backward_pre_hook(self, module: nn.Module, grad_output: Tuple) -> None:
+        if self._recording():
+            self._backward_starts[id(module)].append(self._now(_first_tensor(grad_output)))
+
+    def _backward_hook(self, module: nn.Module, grad_input: Tuple, grad_output: Tuple) -> None:
+        starts = self._backward_starts.get(id(module))
+        if not starts:
+            return
+        start = starts.pop()
+        end = self._now(_first_tensor(grad_input))
+        name, module_type = self._modules[module]
+        self.events.append({
+            'name': name,
+            'type': module_type,
+            'phase': 'backward',
+            'step': self.step_num,
+            'start_s': start - self._origin,
+            'duration_s': end - start,
+            'flops': 0,
+            'output_bytes': _output_bytes(grad_input),
+            'allocated_bytes': 0,
+        })
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Per module type: calls, forward/backward time, FLOPs, achieved FLOP/s and bytes."""
+        totals: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for event in self.events:
+            row = totals[event['type']]
+            if event['phase'] == 'forward':
+                row['calls'] += 1
+                row['forward_s'] += event['duration_s']
+                row['flops'] += event['flops']
+                row['output_bytes'] += event['output_bytes']
+                row['allocated_bytes'] += event['allocated_bytes']
+            else:
+                row['backward_s'] += event['duration_s']
+        report = {}
+        for module_type, row in totals.items():
+            row = dict(row)
+            row.setdefault('backward_s', 0.0)
+            row['forward_flops_per_s'] = row.get('flops', 0.0) / row['forward_s'] if row.get('forward_s') else 0.0
+            report[module_type] = row
+        return report
+
+    def export_json(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(), 'events': self.events}, f, indent=2)
+
+    def export_chrome_trace(self, path: str) -> None:
+        """Write the recorded calls in the Chrome trace event format."""
+        trace = [
+            {
+                'name': f"{event['type']}:{event['name']}",
+                'cat': event['phase'],
+                'ph': 'X',
+                'ts': event['start_s'] * 1e6,
+                'dur': event['duration_s'] * 1e6,
+                'pid': 0,
+                'tid': 0 if event['phase'] == 'forward' else 1,
+                'args': {key: event[key] for key in ('step', 'flops', 'output_bytes', 'allocated_bytes')},
+            }
+            for event in self.events
+        ]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-module profile of LuminaLM training steps on random data.")
+    parser.add_argument("--config_path", type=str, required=True, help="Path to configuration YAML file.")
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--seq_len", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--json", type=str, default="module_profile.json")
+    parser.add_argument("--trace", type=str, default="module_trace.json")
+    args = parser.parse_args()
+
+    with open(args.config_path, 'r') as config_file:
+        config = LuminaLMConfig(**yaml.safe_load(config_file)['model'])
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = LuminaLM(config).to(device).train()
+    input_ids = torch.randint(3, config.vocab_size, (args.batch_size, args.seq_len), device=device)
+
+    # Skip the first step: it includes allocator and kernel warm-up
+    profiler = ModuleProfiler(model, schedule=torch.profiler.schedule(wait=0, warmup=1, active=args.steps))
+    with profiler:
+        for _ in range(args.steps + 1):
+            model(input_ids=input_ids, decoder_input_ids=input_ids).float().mean().backward()
+            model.zero_grad(set_to_none=True)
+            profiler.step()
+
+    print(f"{'module':>14} {'calls':>6} {'fwd ms':>9} {'bwd ms':>9} {'GFLOP':>9} {'GFLOP/s':>9}")
+    for module_type, row in sorted(profiler.summary().items(), key=lambda item: -item[1]['forward_s']):
+        print(f"{module_type:>14} {int(row['calls']):>6} {row['forward_s'] * 1000:>9.2f} {row['backward_s'] * 1000:>9.2f} "
+              f"{row['flops'] / 1e9:>9.3f} {row['forward_flops_per_s'] / 1e9:>9.2f}")
+    profiler.export_json(args.json)
+    profiler.export_chrome_trace(args.trace)
+    logger.info(f"Wrote {args.json} and {args.trace}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
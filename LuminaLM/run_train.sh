@@ -20,8 +20,21 @@ if [ ! -f "$CONFIG_PATH" ]; then
     exit 1
 fi
 
+# Number of training processes; more than one launches DistributedDataParallel through torchrun
+NPROC=${NPROC:-1}
+
+# RESUME=1 continues from the latest complete checkpoint
+TRAIN_ARGS=(--config_path "$CONFIG_PATH")
+if [ -n "$RESUME" ]; then
+    TRAIN_ARGS+=(--resume)
+fi
+
 # Running the training script with the YAML config file
-$PYTHON train.py --config_path "$CONFIG_PATH"
+if [ "$NPROC" -gt 1 ]; then
+    $PYTHON -m torch.distributed.run --standalone --nproc_per_node "$NPROC" train.py "${TRAIN_ARGS[@]}"
+else
+    $PYTHON train.py "${TRAIN_ARGS[@]}"
+fi
 
 # Check if the training script ran successfully
 if [ $? -eq 0 ]; then
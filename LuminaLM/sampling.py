@@ -0,0 +1,287 @@
+"""
+Batched logits processing and sampling for LuminaLM decoding.
+
+Every sampling parameter is a per-row tensor, so a continuous batch that mixes
+requests with different client settings is processed in one pass per step.
+Logits may be full-vocabulary (batch, vocab_size) or a compact candidate view
+(batch, n) together with the vocabulary ids of each column; the compact view
+lets callers that already know the admissible tokens skip the full vocabulary.
+"""
+import torch
+import torch.nn.functional as F
+from dataclasses import dataclass, fields
+from typing import Optional, Union, List, Tuple
+
+RowValue = Union[int, float, torch.Tensor, None]
+
+# Initial candidate width for nucleus-only rows; widened geometrically until
+# the requested probability mass is covered.
+NUCLEUS_CANDIDATES = 64
+
+
+def _as_row_tensor(
+    value: RowValue,
+    batch_size: int,
+    default: Union[int, float],
+    dtype: torch.dtype,
+    device: Optional[torch.device]
+) -> torch.Tensor:
+    """Broadcast a scalar or validate a per-row tensor of shape (batch_size,)."""
+    if value is None:
+        value = default
+    if isinstance(value, torch.Tensor):
+        value = value.to(device=device, dtype=dtype).reshape(-1)
+        if value.numel() == 1:
+            return value.expand(batch_size).clone()
+        if value.numel() != batch_size:
+            raise ValueError(f"Expected {batch_size} per-row values, got {value.numel()}.")
+        return value
+    return torch.full((batch_size,), value, dtype=dtype, device=device)
+
+
+@dataclass
+class SamplingParams:
+    """
+    Per-row sampling parameters for a decode batch.
+
+    temperature 0 selects greedy decoding, top_k 0 and top_p 1.0 disable the
+    respective filters, repetition_penalty 1.0 and no_repeat_ngram_size 0
+    disable the penalties.
+    """
+    temperature: torch.Tensor
+    top_k: torch.Tensor
+    top_p: torch.Tensor
+    repetition_penalty: torch.Tensor
+    no_repeat_ngram_size: torch.Tensor
+
+    @classmethod
+    def from_values(
+        cls,
+        batch_size: int,
+        device: Optional[torch.device] = None,
+        temperature: RowValue = 1.0,
+        top_k: RowValue = None,
+        top_p: RowValue = None,
+        repetition_penalty: RowValue = None,
+        no_repeat_ngram_size: RowValue = None,
+    ) -> 'SamplingParams':
+        """Build parameters from scalars or per-row tensors."""
+        params = cls(
+            temperature=_as_row_tensor(temperature, batch_size, 1.0, torch.float32, device),
+            top_k=_as_row_tensor(top_k, batch_size, 0, torch.long, device),
+            top_p=_as_row_tensor(top_p, batch_size, 1.0, torch.float32, device),
+            repetition_penalty=_as_row_tensor(repetition_penalty, batch_size, 1.0, torch.float32, device),
+            no_repeat_ngram_size=_as_row_tensor(no_repeat_ngram_size, batch_size, 0, torch.long, device),
+        )
+        params.validate()
+        return params
+
+    @classmethod
+    def cat(cls, params: List['SamplingParams']) -> 'SamplingParams':
+        """Concatenate the parameters of several requests into one batch."""
+        return cls(**{f.name: torch.cat([getattr(p, f.name) for p in params]) for f in fields(cls)})
+
+    def select(self, rows: torch.Tensor) -> 'SamplingParams':
+        """Return the parameters of a subset of rows."""
+        return SamplingParams(**{f.name: getattr(self, f.name)[rows] for f in fields(self)})
+
+    def validate(self) -> None:
+        """Validate parameter ranges."""
+        if (self.temperature < 0).any():
+            raise ValueError("temperature must be non-negative.")
+        if (self.top_k < 0).any():
+            raise ValueError("top_k must be non-negative.")
+        if ((self.top_p <= 0) | (self.top_p > 1)).any():
+            raise ValueError("top_p must be in (0, 1].")
+        if (self.repetition_penalty <= 0).any():
+            raise ValueError("repetition_penalty must be positive.")
+        if (self.no_repeat_ngram_size < 0).any():
+            raise ValueError("no_repeat_ngram_size must be non-negative.")
+
+
+def _token_presence_mask(
+    tokens: torch.Tensor,
+    valid: torch.Tensor,
+    width: int,
+    candidate_ids: Optional[torch.Tensor] = None
+) -> torch.Tensor:
+    """Boolean (batch, width) mask of the columns whose token id occurs in tokens[valid]."""
+    if candidate_ids is None:
+        index = torch.where(valid, tokens, torch.full_like(tokens, width))
+        mask = torch.zeros(tokens.size(0), width + 1, dtype=torch.bool, device=tokens.device)
+        mask.scatter_(1, index, True)
+        return mask[:, :width]
+    matches = candidate_ids.unsqueeze(-1) == tokens.unsqueeze(1)
+    return (matches & valid.unsqueeze(1)).any(-1)
+
+
+def apply_repetition_penalty(
+    logits: torch.Tensor,
+    input_ids: torch.Tensor,
+    penalty: torch.Tensor,
+    candidate_ids: Optional[torch.Tensor] = None
+) -> torch.Tensor:
+    """Penalize tokens already present in input_ids (CTRL-style, per-row penalty)."""
+    active = penalty != 1.0
+    if not bool(active.any()):
+        return logits
+    valid = torch.ones_like(input_ids, dtype=torch.bool)
+    seen = _token_presence_mask(input_ids, valid, logits.size(-1), candidate_ids) & active.unsqueeze(1)
+    p = penalty.unsqueeze(1).to(logits.dtype)
+    penalized = torch.where(logits < 0, logits * p, logits / p)
+    return torch.where(seen, penalized, logits)
+
+
+def block_repeated_ngrams(
+    logits: torch.Tensor,
+    input_ids: torch.Tensor,
+    ngram_size: torch.Tensor,
+    candidate_ids: Optional[torch.Tensor] = None
+) -> torch.Tensor:
+    """Ban tokens that would complete an n-gram already present in input_ids (per-row n)."""
+    active = ngram_size > 0
+    if not bool(active.any()):
+        return logits
+    batch_size, seq_len = input_ids.shape
+    blocked = torch.zeros(batch_size, logits.size(-1), dtype=torch.bool, device=logits.device)
+    # One vectorized pass per distinct n-gram size present in the batch
+    for n in torch.unique(ngram_size[active]).tolist():
+        if seq_len < n:
+            continue
+        rows = (ngram_size == n).nonzero(as_tuple=True)[0]
+        seq = input_ids[rows]
+        windows = seq.unfold(1, n, 1)
+        prefix = seq[:, seq_len - n + 1:]
+        match = (windows[:, :, :-1] == prefix.unsqueeze(1)).all(-1)
+        rows_candidates = None if candidate_ids is None else candidate_ids[rows]
+        blocked[rows] = _token_presence_mask(windows[:, :, -1], match, logits.size(-1), rows_candidates)
+    return logits.masked_fill(blocked, float('-inf'))
+
+
+def apply_temperature(logits: torch.Tensor, temperature: torch.Tensor) -> torch.Tensor:
+    """Scale logits by per-row temperature; greedy rows (temperature 0) are left unscaled."""
+    t = torch.where(temperature > 0, temperature, torch.ones_like(temperature))
+    return logits / t.unsqueeze(1).to(logits.dtype)
+
+
+def top_k_top_p_candidates(
+    logits: torch.Tensor,
+    top_k: torch.Tensor,
+    top_p: torch.Tensor,
+    candidate_ids: Optional[torch.Tensor] = None
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Select the top-k / nucleus candidates of every row with partial top-k selection.
+
+    Args:
+        logits (torch.Tensor): Scaled logits of shape (batch_size, width).
+        top_k (torch.Tensor): Per-row top-k, 0 disables the filter.
+        top_p (torch.Tensor): Per-row nucleus mass, 1.0 disables the filter.
+        candidate_ids (Optional[torch.Tensor]): Vocabulary ids of the logits columns.
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: Candidate logits (filtered entries set to
+        -inf) and their vocabulary ids, both of shape (batch_size, n) and sorted in
+        descending order. n is the smallest width covering every row's kept set,
+        so the full vocabulary is never sorted.
+    """
+    width = logits.size(-1)
+    use_k = top_k > 0
+    use_p = top_p < 1.0
+    any_p = bool(use_p.any())
+    k_cap = torch.where(use_k, top_k.clamp(max=width), torch.full_like(top_k, width))
+    no_k_cap = NUCLEUS_CANDIDATES if any_p else width
+    row_cap = torch.where(use_k | ~use_p, k_cap, torch.full_like(k_cap, no_k_cap))
+    n = min(width, int(row_cap.max()))
+
+    lse_full = logits.float().logsumexp(-1) if any_p else None
+    while True:
+        values, index = logits.topk(n, dim=-1)
+        keep = torch.arange(n, device=logits.device).unsqueeze(0) < k_cap.unsqueeze(1)
+        if not any_p:
+            break
+
+        # Nucleus mass is measured over the top-k set when it fits in the candidates
+        lse_k = values.float().masked_fill(~keep, float('-inf')).logsumexp(-1)
+        lse = torch.where(k_cap <= n, lse_k, lse_full)
+        probs = (values.float() - lse.unsqueeze(1)).exp()
+        cumulative_probs = probs.cumsum(-1)
+        covered = ~use_p | (k_cap <= n) | (cumulative_probs[:, -1] > top_p)
+        if n == width or bool(covered.all()):
+            beyond_nucleus = (cumulative_probs - probs) > top_p.unsqueeze(1)
+            keep = keep & ~(beyond_nucleus & use_p.unsqueeze(1))
+            break
+        n = min(width, n * 4)
+
+    values = values.masked_fill(~keep, float('-inf'))
+    if candidate_ids is not None:
+        index = candidate_ids.gather(1, index)
+    return values, index
+
+
+def sample_next_token(
+    logits: torch.Tensor,
+    params: SamplingParams,
+    input_ids: Optional[torch.Tensor] = None,
+    candidate_ids: Optional[torch.Tensor] = None,
+    generator: Optional[torch.Generator] = None
+) -> torch.Tensor:
+    """
+    Run the logits-processor pipeline and pick the next token of every row.
+
+    Args:
+        logits (torch.Tensor): Next-token logits of shape (batch_size, width).
+        params (SamplingParams): Per-row sampling parameters.
+        input_ids (Optional[torch.Tensor]): Tokens generated so far, used by the
+            repetition penalty and n-gram blocking.
+        candidate_ids (Optional[torch.Tensor]): Vocabulary ids of the logits columns
+            when logits is a compact candidate view; padding columns must be -inf.
+        generator (Optional[torch.Generator]): Random generator for sampling.
+
+    Returns:
+        torch.Tensor: Next token ids of shape (batch_size,).
+    """
+    raw_logits = logits
+    if input_ids is not None:
+        logits = apply_repetition_penalty(logits, input_ids, params.repetition_penalty, candidate_ids)
+        logits = block_repeated_ngrams(logits, input_ids, params.no_repeat_ngram_size, candidate_ids)
+
+    # Greedy rows take the argmax shortcut. Rows whose masks and penalties leave no allowed token
+    # cannot be sampled from; they fall back to the argmax of the unpenalized logits.
+    greedy = params.temperature <= 0
+    exhausted = torch.isneginf(logits).all(-1)
+    next_tokens = torch.zeros(logits.size(0), dtype=torch.long, device=logits.device)
+    argmax_rows = (greedy | exhausted).nonzero(as_tuple=True)[0]
+    if argmax_rows.numel() > 0:
+        row_logits = torch.where(exhausted[argmax_rows].unsqueeze(1), raw_logits[argmax_rows], logits[argmax_rows])
+        choice = row_logits.argmax(-1, keepdim=True)
+        if candidate_ids is not None:
+            choice = candidate_ids[argmax_rows].gather(1, choice)
+        next_tokens[argmax_rows] = choice.squeeze(1)
+    if argmax_rows.numel() == logits.size(0):
+        return next_tokens
+    greedy = greedy | exhausted
+
+    scaled = apply_temperature(logits, params.temperature)
+    filtered = (params.top_k > 0) | (params.top_p < 1.0)
+
+    full_rows = (~greedy & ~filtered).nonzero(as_tuple=True)[0]
+    if full_rows.numel() > 0:
+        probs = F.softmax(scaled[full_rows].float(), dim=-1)
+        choice = torch.multinomial(probs, num_samples=1, generator=generator)
+        if candidate_ids is not None:
+            choice = candidate_ids[full_rows].gather(1, choice)
+        next_tokens[full_rows] = choice.squeeze(1)
+
+    filter_rows = (~greedy & filtered).nonzero(as_tuple=True)[0]
+    if filter_rows.numel() > 0:
+        values, index = top_k_top_p_candidates(
+            scaled[filter_rows],
+            params.top_k[filter_rows],
+            params.top_p[filter_rows],
+            None if candidate_ids is None else candidate_ids[filter_rows]
+        )
+        choice = torch.multinomial(F.softmax(values.float(), dim=-1), num_samples=1, generator=generator)
+        next_tokens[filter_rows] = index.gather(1, choice).squeeze(1)
+
+    return next_tokens
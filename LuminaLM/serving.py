@@ -0,0 +1,224 @@
+"""
+Request layer in front of LuminaLM.generate.
+
+Identical deterministic requests (greedy, or sampled with a fixed seed) that
+arrive while one is being decoded share that decode, and their results are
+kept in a bounded TTL/LRU cache keyed by the checkpoint, the tokenizer, the
+input ids and the sampling parameters. A model in train mode bypasses both,
+since dropout makes every request vary.
+"""
+import hashlib
+import logging
+import threading
+import time
+import torch
+import torch.nn as nn
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+from tokenizers import Tokenizer
+from constraints import TokenTrie
+
+logger = logging.getLogger(__name__)
+
+# generate() arguments that do not change the result
+_RESULT_INDEPENDENT_ARGS = {'prefix_cache'}
+
+
+def checkpoint_hash(model: nn.Module) -> str:
+    """Hash of the model configuration and every tensor in its state dict."""
+    digest = hashlib.sha256()
+    config = getattr(model, 'config', None)
+    if config is not None:
+        digest.update(repr(sorted(config.__dict__.items())).encode('utf-8'))
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode('utf-8'))
+        digest.update(str(tensor.dtype).encode('utf-8'))
+        digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+def tokenizer_hash(tokenizer: Optional[Tokenizer]) -> str:
+    """Hash of the serialized tokenizer."""
+    if tokenizer is None:
+        return 'none'
+    return hashlib.sha256(tokenizer.to_str().encode('utf-8')).hexdigest()
+
+
+def _fingerprint(value: Any) -> Any:
+    """Hashable, content-based representation of a generate() argument."""
+    if isinstance(value, torch.Tensor):
+        data = value.detach().cpu().contiguous()
+        return ('tensor', str(data.dtype), tuple(data.shape), hashlib.sha1(data.reshape(-1).view(torch.uint8).numpy().tobytes()).hexdigest())
+    if isinstance(value, TokenTrie):
+        return ('trie', _fingerprint(value.tokens), _fingerprint(value.offsets), value.eos_token_id)
+    if isinstance(value, (list, tuple)):
+        return tuple(_fingerprint(v) for v in value)
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    raise TypeError(f"Cannot build a cache key from argument of type {type(value).__name__}.")
+
+
+class GenerationService:
+    """Coalesces identical in-flight requests and caches deterministic results."""
+
+    def __init__(
+        self,
+        model: nn.Module,
+        tokenizer: Optional[Tokenizer] = None,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 60.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Args:
+            model (nn.Module): Model exposing generate(input_ids, max_length, ...).
+            tokenizer (Optional[Tokenizer]): Tokenizer used by the callers, part of the cache key.
+            max_entries (int): Maximum number of cached results.
+            max_bytes (int): Maximum total size of cached result tensors.
+            ttl_seconds (float): Lifetime of a cached result.
+            clock (Callable[[], float]): Time source, in seconds.
+        """
+        self.model = model
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[Tuple, Tuple[torch.Tensor, float, int]]' = OrderedDict()
+        self._inflight: Dict[Tuple, Future] = {}
+        self.checkpoint_hash = checkpoint_hash(model)
+        self.tokenizer_hash = tokenizer_hash(tokenizer)
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def refresh_checkpoint(self) -> None:
+        """Re-hash the model after its weights changed; older entries can no longer match."""
+        with self._lock:
+            self.checkpoint_hash = checkpoint_hash(self.model)
+            self._cache.clear()
+            self.bytes_used = 0
+
+    @staticmethod
+    def is_deterministic(generate_kwargs: Dict[str, Any], seed: Optional[int]) -> bool:
+        """Whether a request always produces the same output."""
+        if seed is not None:
+            return True
+        temperature = generate_kwargs.get('temperature', 1.0)
+        if isinstance(temperature, torch.Tensor):
+            return bool((temperature == 0).all())
+        return temperature == 0
+
+    def request_key(self, input_ids: torch.Tensor, seed: Optional[int], generate_kwargs: Dict[str, Any]) -> Tuple:
+        """Cache key of a request."""
+        arguments = tuple(
+            (name, _fingerprint(value))
+            for name, value in sorted(generate_kwargs.items())
+            if name not in _RESULT_INDEPENDENT_ARGS
+        )
+        return (self.checkpoint_hash, self.tokenizer_hash, _fingerprint(input_ids), seed, arguments)
+
+    def generate(self, input_ids: torch.Tensor, *, seed: Optional[int] = None, **generate_kwargs) -> torch.Tensor:
+        """
+        Generate through the request layer.
+
+        Args:
+            input_ids (torch.Tensor): Encoder input ids.
+            seed (Optional[int]): Seed for sampling; a fixed seed makes the request cacheable
+                while the model is in eval mode (dropout varies the output in train mode).
+            **generate_kwargs: Arguments forwarded to model.generate.
+
+        Returns:
+            torch.Tensor: Generated tokens (a private copy for every caller).
+        """
+        if 'generator' in generate_kwargs:
+            raise ValueError("Pass seed instead of generator so that the request can be keyed.")
+        if self.model.training or not self.is_deterministic(generate_kwargs, seed):
+            with self._lock:
+                self.bypassed += 1
+            return self._run(input_ids, seed, generate_kwargs)
+
+        key = self.request_key(input_ids, seed, generate_kwargs)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                result, expires_at, nbytes = entry
+                if expires_at > self._clock():
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return result.clone()
+                del self._cache[key]
+                self.bytes_used -= nbytes
+
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result().clone()
+
+        try:
+            result = self._run(input_ids, seed, generate_kwargs)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._inflight[key]
+            self._store(key, result)
+        future.set_result(result)
+        return result.clone()
+
+    def _run(self, input_ids: torch.Tensor, seed: Optional[int], generate_kwargs: Dict[str, Any]) -> torch.Tensor:
+        """Run one decode."""
+        if seed is not None:
+            generator = torch.Generator(device=input_ids.device)
+            generator.manual_seed(seed)
+            generate_kwargs = dict(generate_kwargs, generator=generator)
+        return self.model.generate(input_ids, **generate_kwargs)
+
+    def _store(self, key: Tuple, result: torch.Tensor) -> None:
+        """Insert a result and evict expired, then least-recently-used, entries."""
+        nbytes = result.numel() * result.element_size()
+        if nbytes > self.max_bytes or self.max_entries <= 0:
+            return
+        self._cache[key] = (result, self._clock() + self.ttl_seconds, nbytes)
+        self.bytes_used += nbytes
+
+        now = self._clock()
+        for stale in [k for k, (_, expires_at, _) in self._cache.items() if expires_at <= now]:
+            self.bytes_used -= self._cache.pop(stale)[2]
+            self.evictions += 1
+        while len(self._cache) > self.max_entries or self.bytes_used > self.max_bytes:
+            _, (_, _, evicted_bytes) = self._cache.popitem(last=False)
+            self.bytes_used -= evicted_bytes
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Hit ratio, coalescing and memory metrics."""
+        with self._lock:
+            requests = self.hits + self.misses + self.coalesced
+            return {
+                'requests': requests + self.bypassed,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'bypassed': self.bypassed,
+                'hit_ratio': self.hits / requests if requests else 0.0,
+                'coalesced_ratio': self.coalesced / requests if requests else 0.0,
+                'entries': len(self._cache),
+                'bytes_used': self.bytes_used,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,189 @@
+"""
+ZeRO-style sharded training support for LuminaLM.
+
+The optimizer state is partitioned across data-parallel ranks with
+ZeroRedundancyOptimizer ("zero1"), or parameters, gradients and optimizer
+state are sharded by FSDP ("fsdp_grad_op", "fsdp"; see distributed.wrap_model).
+Full model and optimizer states are only gathered, onto rank 0, when a
+checkpoint is written.
+
+The CLI spawns gloo process groups on CPU at several world sizes and reports
+the parameter, gradient and optimizer-state bytes each rank holds after one
+training step.
+
+Usage:
+    python sharding.py --config_path config.yaml --world_sizes 1 2 4 --sharding none zero1 fsdp
+"""
+import os
+import json
+import logging
+import argparse
+import tempfile
+import yaml
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+from torch.distributed.optim import ZeroRedundancyOptimizer
+from torch.distributed.fsdp import (
+    FullyShardedDataParallel, StateDictType, FullStateDictConfig, FullOptimStateDictConfig
+)
+from model import LuminaLM, LuminaLMConfig
+from distributed import (
+    DistributedConfig, init_distributed, cleanup_distributed, is_distributed, is_main_process, wrap_model, unwrap_model,
+    spawn_local
+)
+from pipeline import PipelineParallel
+from benchmark_inference import peak_rss_mb
+
+logger = logging.getLogger(__name__)
+
+
+def build_optimizer(
+    model: nn.Module,
+    sharding: str = "none",
+    optimizer_class: Type[optim.Optimizer] = optim.AdamW,
+    **optimizer_kwargs
+) -> optim.Optimizer:
+    """
+    Optimizer over the model's trainable parameters, partitioning its state across ranks for "zero1".
+
+    Frozen parameters (a frozen encoder, the base weights under LoRA) get no optimizer state.
+
+    Args:
+        model (nn.Module): Possibly wrapped model.
+        sharding (str): DistributedConfig.sharding.
+        optimizer_class (Type[optim.Optimizer]): Local optimizer class.
+        **optimizer_kwargs: Arguments of optimizer_class, e.g. lr and weight_decay.
+    """
+    params = [param for param in model.parameters() if param.requires_grad]
+    if sharding == "zero1" and is_distributed():
+        return ZeroRedundancyOptimizer(params, optimizer_class=optimizer_class, **optimizer_kwargs)
+    return optimizer_class(params, **optimizer_kwargs)
+
+
+def clip_grad_norm(model: nn.Module, max_norm: float) -> torch.Tensor:
+    """Clip by the global gradient norm; FSDP and pipeline stages compute it across ranks."""
+    if isinstance(model, (FullyShardedDataParallel, PipelineParallel)):
+        return model.clip_grad_norm_(max_norm)
+    return nn.utils.clip_grad_norm_(model.parameters(), max_norm)
+
+
+def gather_full_state(
+    model: nn.Module,
+    optimizer: Optional[optim.Optimizer] = None
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Full (unsharded) model and optimizer state dicts, for checkpointing.
+
+    Collective: every rank must call it. Only rank 0 receives the states; the other ranks get None.
+
+    Returns:
+        Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]: Model and optimizer state dicts.
+    """
+    if isinstance(model, PipelineParallel):
+        # Optimizer states stay with their stages
+        return model.gather_full_state(), None
+    if isinstance(model, FullyShardedDataParallel):
+        with FullyShardedDataParallel.state_dict_type(
+            model,
+            StateDictType.FULL_STATE_DICT,
+            FullStateDictConfig(offload_to_cpu=True, rank0_only=True),
+            FullOptimStateDictConfig(offload_to_cpu=True, rank0_only=True),
+        ):
+            model_state = model.state_dict()
+            optimizer_state = FullyShardedDataParallel.optim_state_dict(model, optimizer) if optimizer is not None else None
+    else:
+        model_state = unwrap_model(model).state_dict()
+        optimizer_state = None
+        if isinstance(optimizer, ZeroRedundancyOptimizer):
+            optimizer.consolidate_state_dict(to=0)
+            optimizer_state = optimizer.state_dict() if is_main_process() else None
+        elif optimizer is not None:
+            optimizer_state = optimizer.state_dict()
+    if not is_main_process():
+        return None, None
+    return model_state, optimizer_state
+
+
+def local_state_bytes(model: nn.Module, optimizer: optim.Optimizer) -> Dict[str, int]:
+    """Bytes of parameters, gradients and optimizer state held by this rank."""
+    parameters = list(model.parameters())
+    local_optimizer = optimizer.optim if isinstance(optimizer, ZeroRedundancyOptimizer) else optimizer
+    optimizer_bytes = sum(
+        value.numel() * value.element_size()
+        for state in local_optimizer.state.values()
+        for value in state.values()
+        if isinstance(value, torch.Tensor) and value.dim() > 0
+    )
+    return {
+        'parameter_bytes': sum(p.numel() * p.element_size() for p in parameters),
+        'gradient_bytes': sum(p.grad.numel() * p.grad.element_size() for p in parameters if p.grad is not None),
+        'optimizer_state_bytes': optimizer_bytes,
+    }
+
+
+def _measure_rank(rank: int, world_size: int, config: LuminaLMConfig, sharding: str, output_dir: str) -> None:
+    device = init_distributed("gloo")
+    torch.manual_seed(0)
+    model = wrap_model(LuminaLM(config), device, DistributedConfig(sharding=sharding))
+    optimizer = build_optimizer(model, sharding, lr=1e-4)
+    input_ids = torch.randint(3, config.vocab_size, (2, config.block_size))
+    model(input_ids=input_ids, decoder_input_ids=input_ids).float().mean().backward()
+    optimizer.step()
+    report = {'rank': rank, 'world_size': world_size, 'sharding': sharding, **local_state_bytes(model, optimizer)}
+    report['peak_rss_mb'] = peak_rss_mb()
+    with open(os.path.join(output_dir, f"rank{rank}.json"), 'w') as f:
+        json.dump(report, f)
+    cleanup_distributed()
+
+
+def measure_sharded_memory(config: LuminaLMConfig, world_size: int, sharding: str) -> List[Dict[str, Any]]:
+    """Spawn world_size gloo ranks on this host, run one step and return every rank's memory report."""
+    with tempfile.TemporaryDirectory() as output_dir:
+        spawn_local(_measure_rank, world_size, config, sharding, output_dir)
+        reports = []
+        for rank in range(world_size):
+            with open(os.path.join(output_dir, f"rank{rank}.json")) as f:
+                reports.append(json.load(f))
+    return reports
+
+
+def memory_report(config: LuminaLMConfig, world_sizes: Sequence[int], shardings: Sequence[str]) -> List[Dict[str, Any]]:
+    """Maximum per-rank memory for every (sharding, world size) pair."""
+    rows = []
+    for sharding in shardings:
+        for world_size in world_sizes:
+            reports = measure_sharded_memory(config, world_size, sharding)
+            row = {'sharding': sharding, 'world_size': world_size}
+            for key in ('parameter_bytes', 'gradient_bytes', 'optimizer_state_bytes', 'peak_rss_mb'):
+                row[key] = max(report[key] for report in reports)
+            rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-rank memory of sharded LuminaLM training with gloo on CPU.")
+    parser.add_argument("--config_path", type=str, required=True, help="Path to configuration YAML file.")
+    parser.add_argument("--world_sizes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--sharding", type=str, nargs="+", default=["none", "zero1", "fsdp"])
+    parser.add_argument("--output", type=str, help="Optional JSON report path.")
+    args = parser.parse_args()
+
+    with open(args.config_path, 'r') as config_file:
+        config = LuminaLMConfig(**yaml.safe_load(config_file)['model'])
+    rows = memory_report(config, args.world_sizes, args.sharding)
+
+    print(f"{'sharding':>12} {'ranks':>5} {'params MiB':>10} {'grads MiB':>10} {'optim MiB':>10} {'peak RSS MiB':>12}")
+    for row in rows:
+        print(f"{row['sharding']:>12} {row['world_size']:>5} {row['parameter_bytes'] / 2**20:>10.1f} "
+              f"{row['gradient_bytes'] / 2**20:>10.1f} {row['optimizer_state_bytes'] / 2**20:>10.1f} "
+              f"{row['peak_rss_mb']:>12.1f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,345 @@
+"""
+Megatron-style tensor parallelism for LuminaLM.
+
+`parallelize_model` shards a LuminaLM in place across the ranks of a process
+group:
+
+* FlashAttention: q/k/v projections are column-parallel, so every rank holds
+  n_head / world_size heads (and only their KV cache), and out_proj is
+  row-parallel;
+* FeedForward: fc1 is column-parallel and fc2 row-parallel;
+* wte is split by vocabulary rows and lm_head by vocabulary columns (still
+  tied to wte when shared_embeddings is set).
+
+Each block then does one all-reduce in forward (after out_proj and after fc2)
+and one in backward (before the column-parallel projections). lm_head gathers
+full logits by default so `forward` and `generate` behave as before;
+`tensor_parallel_loss` keeps the logits sharded and uses a vocab-parallel
+cross-entropy instead. Every rank must build the model with the same seed, so
+the shards come from identical weights and replicated activations see the
+same dropout masks.
+
+The CLI runs on CPU processes with gloo and checks logits, loss, gradients and
+greedy generation against the single-process model.
+
+Usage:
+    python tensor_parallel.py --config_path config.yaml --world_size 2
+"""
+import os
+import copy
+import json
+import time
+import logging
+import argparse
+import tempfile
+import yaml
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.distributed as dist
+from typing import Any, Dict, Optional
+from model import LuminaLM, LuminaLMConfig, FlashAttention, FeedForward
+from distributed import init_distributed, cleanup_distributed, spawn_local
+
+logger = logging.getLogger(__name__)
+
+
+class _CopyToTensorParallel(torch.autograd.Function):
+    """Identity in forward; all-reduce of the gradient in backward."""
+    @staticmethod
+    def forward(ctx, x: torch.Tensor, group: Optional[dist.ProcessGroup]) -> torch.Tensor:
+        ctx.group = group
+        return x
+
+    @staticmethod
+    def backward(ctx, grad: torch.Tensor):
+        grad = grad.contiguous().clone()
+        dist.all_reduce(grad, group=ctx.group)
+        return grad, None
+
+
+class _ReduceFromTensorParallel(torch.autograd.Function):
+    """All-reduce in forward; identity for the gradient in backward."""
+    @staticmethod
+    def forward(ctx, x: torch.Tensor, group: Optional[dist.ProcessGroup]) -> torch.Tensor:
+        x = x.contiguous().clone()
+        dist.all_reduce(x, group=group)
+        return x
+
+    @staticmethod
+    def backward(ctx, grad: torch.Tensor):
+        return grad, None
+
+
+class _GatherFromTensorParallel(torch.autograd.Function):
+    """All-gather along the last dimension in forward; this rank's slice of the gradient in backward."""
+    @staticmethod
+    def forward(ctx, x: torch.Tensor, group: Optional[dist.ProcessGroup]) -> torch.Tensor:
+        ctx.group = group
+        x = x.contiguous()
+        gathered = [torch.empty_like(x) for _ in range(dist.get_world_size(group))]
+        dist.all_gather(gathered, x, group=group)
+        return torch.cat(gathered, dim=-1)
+
+    @staticmethod
+    def backward(ctx, grad: torch.Tensor):
+        world_size = dist.get_world_size(ctx.group)
+        return grad.chunk(world_size, dim=-1)[dist.get_rank(ctx.group)].contiguous(), None
+
+
+def _shard(tensor: torch.Tensor, dim: int, group: Optional[dist.ProcessGroup]) -> nn.Parameter:
+    chunk = tensor.detach().chunk(dist.get_world_size(group), dim=dim)[dist.get_rank(group)]
+    return nn.Parameter(chunk.clone())
+
+
+def _check_divisible(value: int, world_size: int, what: str) -> None:
+    if value % world_size != 0:
+        raise ValueError(f"{what} ({value}) must be divisible by the tensor-parallel world size ({world_size}).")
+
+
+class ColumnParallelLinear(nn.Module):
+    """Linear layer whose output features are split across ranks."""
+    shard_dims = {'weight': 0, 'bias': 0}
+
+    def __init__(self, linear: nn.Linear, group: Optional[dist.ProcessGroup] = None, gather_output: bool = False):
+        super().__init__()
+        _check_divisible(linear.out_features, dist.get_world_size(group), "out_features")
+        self.group = group
+        self.gather_output = gather_output
+        self.weight = _shard(linear.weight, 0, group)
+        self.bias = _shard(linear.bias, 0, group) if linear.bias is not None else None
+
+    def forward(self, x: torch.Tensor, gather_output: Optional[bool] = None) -> torch.Tensor:
+        output = F.linear(_CopyToTensorParallel.apply(x, self.group), self.weight, self.bias)
+        if self.gather_output if gather_output is None else gather_output:
+            output = _GatherFromTensorParallel.apply(output, self.group)
+        return output
+
+
+class RowParallelLinear(nn.Module):
+    """Linear layer whose input features are split across ranks; outputs are summed by all-reduce."""
+    shard_dims = {'weight': 1}
+
+    def __init__(self, linear: nn.Linear, group: Optional[dist.ProcessGroup] = None):
+        super().__init__()
+        _check_divisible(linear.in_features, dist.get_world_size(group), "in_features")
+        self.group = group
+        self.weight = _shard(linear.weight, 1, group)
+        # The bias is added once, after the reduction
+        self.bias = nn.Parameter(linear.bias.detach().clone()) if linear.bias is not None else None
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        output = _ReduceFromTensorParallel.apply(F.linear(x, self.weight), self.group)
+        return output + self.bias if self.bias is not None else output
+
+
+class VocabParallelEmbedding(nn.Module):
+    """Embedding whose vocabulary rows are split across ranks."""
+    shard_dims = {'weight': 0}
+
+    def __init__(self, embedding: nn.Embedding, group: Optional[dist.ProcessGroup] = None):
+        super().__init__()
+        world_size = dist.get_world_size(group)
+        _check_divisible(embedding.num_embeddings, world_size, "vocab_size")
+        self.group = group
+        self.weight = _shard(embedding.weight, 0, group)
+        self.vocab_start = dist.get_rank(group) * self.weight.size(0)
+
+    def forward(self, input_ids: torch.Tensor) -> torch.Tensor:
+        outside = (input_ids < self.vocab_start) | (input_ids >= self.vocab_start + self.weight.size(0))
+        local_ids = (input_ids - self.vocab_start).masked_fill(outside, 0)
+        embeddings = F.embedding(local_ids, self.weight).masked_fill(outside.unsqueeze(-1), 0.0)
+        return _ReduceFromTensorParallel.apply(embeddings, self.group)
+
+
+def parallelize_model(model: LuminaLM, group: Optional[dist.ProcessGroup] = None) -> LuminaLM:
+    """
+    Shard the attention heads, feed-forward layers and vocabulary of a LuminaLM in place.
+
+    Args:
+        model (LuminaLM): Model built with the same seed on every rank of group.
+        group (Optional[dist.ProcessGroup]): Tensor-parallel group, the default group if None.
+
+    Returns:
+        LuminaLM: The same model, now holding only this rank's shards.
+    """
+    world_size = dist.get_world_size(group)
+    config = model.config
+    _check_divisible(config.n_head, world_size, "n_head")
+    _check_divisible(config.vocab_size, world_size, "vocab_size")
+
+    for module in list(model.modules()):
+        if isinstance(module, FlashAttention):
+            module.q_proj = ColumnParallelLinear(module.q_proj, group)
+            module.k_proj = ColumnParallelLinear(module.k_proj, group)
+            module.v_proj = ColumnParallelLinear(module.v_proj, group)
+            module.out_proj = RowParallelLinear(module.out_proj, group)
+            # Heads are contiguous in the projection outputs, so each rank gets whole heads
+            module.n_head = module.n_head // world_size
+        elif isinstance(module, FeedForward):
+            module.fc1 = ColumnParallelLinear(module.fc1, group)
+            module.fc2 = RowParallelLinear(module.fc2, group)
+
+    model.wte = VocabParallelEmbedding(model.wte, group)
+    model.lm_head = ColumnParallelLinear(model.lm_head, group, gather_output=True)
+    if config.shared_embeddings:
+        model.lm_head.weight = model.wte.weight
+    return model
+
+
+def vocab_parallel_cross_entropy(
+    logits: torch.Tensor,
+    labels: torch.Tensor,
+    group: Optional[dist.ProcessGroup] = None,
+    ignore_index: int = -100
+) -> torch.Tensor:
+    """
+    Mean cross-entropy of logits sharded along the vocabulary, without gathering them.
+
+    Args:
+        logits (torch.Tensor): This rank's logits of shape (..., vocab_size / world_size).
+        labels (torch.Tensor): Full-vocabulary labels of shape (...).
+        group (Optional[dist.ProcessGroup]): Tensor-parallel group.
+        ignore_index (int): Label excluded from the mean, like nn.CrossEntropyLoss.
+    """
+    logits = logits.float()
+    vocab_start = dist.get_rank(group) * logits.size(-1)
+    # Any constant shift works for log-sum-exp, so the global max needs no gradient
+    logits_max = logits.detach().max(dim=-1, keepdim=True).values
+    dist.all_reduce(logits_max, op=dist.ReduceOp.MAX, group=group)
+    shifted = logits - logits_max
+
+    sum_exp = _ReduceFromTensorParallel.apply(shifted.exp().sum(dim=-1), group)
+    in_shard = (labels >= vocab_start) & (labels < vocab_start + logits.size(-1))
+    local_labels = (labels - vocab_start).masked_fill(~in_shard, 0)
+    target = shifted.gather(-1, local_labels.unsqueeze(-1)).squeeze(-1).masked_fill(~in_shard, 0.0)
+    target = _ReduceFromTensorParallel.apply(target, group)
+
+    valid = labels != ignore_index
+    loss = (sum_exp.log() - target).masked_fill(~valid, 0.0)
+    return loss.sum() / valid.sum().clamp(min=1)
+
+
+def tensor_parallel_loss(
+    model: LuminaLM,
+    input_ids: torch.Tensor,
+    decoder_input_ids: torch.Tensor,
+    labels: torch.Tensor,
+    ignore_index: int = -100,
+    attention_mask: Optional[torch.Tensor] = None
+) -> torch.Tensor:
+    """Training loss of a parallelized model, with sharded logits and the vocab-parallel cross-entropy."""
+    encoder_outputs = model.encode(input_ids, attention_mask)
+    hidden_states = model.decode(decoder_input_ids, encoder_outputs, None, attention_mask)
+    logits = model.lm_head(hidden_states, gather_output=False)
+    return vocab_parallel_cross_entropy(logits, labels, model.lm_head.group, ignore_index)
+
+
+def gather_tensors(model: LuminaLM, tensors: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+    """
+    Full tensors from this rank's shards, keyed like LuminaLM parameters. Collective.
+
+    Args:
+        model (LuminaLM): Parallelized model.
+        tensors (Dict[str, torch.Tensor]): Shards keyed by parameter or state dict name, e.g. the
+            state dict or the gradients.
+    """
+    shard_dims = {}
+    for module_name, module in model.named_modules():
+        for name, dim in getattr(module, 'shard_dims', {}).items():
+            shard_dims[f"{module_name}.{name}"] = (dim, module.group)
+    gathered = {}
+    for name, tensor in tensors.items():
+        if name not in shard_dims:
+            gathered[name] = tensor
+            continue
+        dim, group = shard_dims[name]
+        parts = [torch.empty_like(tensor) for _ in range(dist.get_world_size(group))]
+        dist.all_gather(parts, tensor.contiguous(), group=group)
+        gathered[name] = torch.cat(parts, dim=dim)
+    return gathered
+
+
+def full_state_dict(model: LuminaLM) -> Dict[str, torch.Tensor]:
+    """Unsharded state dict of a parallelized model, on every rank, for LuminaLM.load_state_dict. Collective."""
+    return gather_tensors(model, model.state_dict())
+
+
+def check_parity(config: LuminaLMConfig, batch_size: int = 2, seq_len: int = 16, generation_length: int = 8) -> Dict[str, Any]:
+    """
+    Compare a tensor-parallel model with the single-process one on this rank. Collective.
+
+    Returns:
+        Dict[str, Any]: Largest logits and gradient differences, loss difference, whether greedy
+        generation matches, and per-token decode latency of both models.
+    """
+    torch.manual_seed(0)
+    reference = LuminaLM(config).eval()
+    parallel = parallelize_model(copy.deepcopy(reference)).eval()
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(3, config.vocab_size, (batch_size, seq_len), generator=generator)
+    labels = torch.randint(3, config.vocab_size, (batch_size, seq_len), generator=generator)
+
+    reference_logits = reference(input_ids=input_ids, decoder_input_ids=input_ids)
+    reference_loss = F.cross_entropy(reference_logits.view(-1, config.vocab_size), labels.view(-1))
+    reference_loss.backward()
+    parallel_logits = parallel(input_ids=input_ids, decoder_input_ids=input_ids)
+    parallel_loss = tensor_parallel_loss(parallel, input_ids, input_ids, labels)
+    parallel_loss.backward()
+
+    reference_grads = {name: p.grad for name, p in reference.named_parameters()}
+    parallel_grads = gather_tensors(parallel, {name: p.grad for name, p in parallel.named_parameters()})
+    grad_diff = max((parallel_grads[name] - grad).abs().max().item() for name, grad in reference_grads.items())
+
+    def per_token_ms(model: LuminaLM):
+        start = time.perf_counter()
+        tokens = model.generate(input_ids, max_length=generation_length, temperature=0.0, early_stopping=False)
+        return tokens, (time.perf_counter() - start) * 1000 / generation_length
+
+    reference_tokens, reference_ms = per_token_ms(reference)
+    parallel_tokens, parallel_ms = per_token_ms(parallel)
+    return {
+        'world_size': dist.get_world_size(),
+        'max_logits_diff': (parallel_logits - reference_logits).abs().max().item(),
+        'loss_diff': abs(parallel_loss.item() - reference_loss.item()),
+        'max_grad_diff': grad_diff,
+        'generation_matches': torch.equal(parallel_tokens, reference_tokens),
+        'reference_per_token_ms': reference_ms,
+        'parallel_per_token_ms': parallel_ms,
+    }
+
+
+def _parity_rank(rank: int, world_size: int, config: LuminaLMConfig, output_dir: str) -> None:
+    init_distributed("gloo")
+    report = check_parity(config)
+    with open(os.path.join(output_dir, f"rank{rank}.json"), 'w') as f:
+        json.dump(report, f)
+    cleanup_distributed()
+
+
+def run_parity_check(config: LuminaLMConfig, world_size: int = 2) -> Dict[str, Any]:
+    """Spawn world_size gloo ranks and return rank 0's parity report."""
+    with tempfile.TemporaryDirectory() as output_dir:
+        spawn_local(_parity_rank, world_size, config, output_dir)
+        with open(os.path.join(output_dir, "rank0.json")) as f:
+            return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tensor-parallel LuminaLM parity check with gloo on CPU.")
+    parser.add_argument("--config_path", type=str, required=True, help="Path to configuration YAML file.")
+    parser.add_argument("--world_size", type=int, default=2)
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    with open(args.config_path, 'r') as config_file:
+        config = LuminaLMConfig(**yaml.safe_load(config_file)['model'])
+    report = run_parity_check(config, args.world_size)
+    print(json.dumps(report, indent=2))
+    if max(report['max_logits_diff'], report['loss_diff'], report['max_grad_diff']) > args.tolerance or not report['generation_matches']:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
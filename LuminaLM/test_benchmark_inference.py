@@ -0,0 +1,49 @@
+import copy
+import unittest
+import torch
+from benchmark_inference import InferenceCase, compare, peak_rss_mb, run_isolated, run_suite
+from model import LuminaLM, LuminaLMConfig
+
+
+def _allocate(megabytes: int) -> dict:
+    buffer = torch.ones(megabytes * 2**20, dtype=torch.uint8)
+    return {'peak_rss_mb': peak_rss_mb(), 'sum': int(buffer[:1].sum())}
+
+
+class TestInferenceBenchmark(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        torch.manual_seed(0)
+        config = LuminaLMConfig(
+            n_embd=16, n_head=2, n_encoder_layers=1, n_decoder_layers=1,
+            block_size=32, max_position_embeddings=32, vocab_size=32
+        )
+        cases = [InferenceCase(2, 8, 4), InferenceCase(1, 8, 4, "bfloat16")]
+        cls.report = run_suite(LuminaLM(config).eval(), cases, warmup=1, repeats=2)
+
+    def test_report_metrics(self):
+        self.assertEqual(len(self.report['results']), 2)
+        for result in self.report['results']:
+            self.assertLessEqual(result['per_token_p50_ms'], result['per_token_p99_ms'])
+            self.assertGreater(result['tokens_per_sec'], 0)
+            self.assertGreater(result['peak_rss_mb'], 0)
+
+    def test_compare_flags_regressions(self):
+        self.assertEqual(compare(self.report, self.report), [])
+        slower = copy.deepcopy(self.report)
+        slower['results'][0]['ttft_ms'] *= 2
+        slower['results'][0]['tokens_per_sec'] /= 2
+        regressions = compare(slower, self.report, threshold=0.1)
+        self.assertEqual({r['metric'] for r in regressions}, {'ttft_ms', 'tokens_per_sec'})
+        # Improvements are never regressions
+        self.assertEqual(compare(self.report, slower, threshold=0.1), [])
+
+    def test_isolated_peaks_are_per_case(self):
+        self.assertTrue(self.report['isolated_cases'])
+        large = run_isolated(_allocate, 512)['peak_rss_mb']
+        small = run_isolated(_allocate, 1)['peak_rss_mb']
+        self.assertGreater(large - small, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+import torch
+from benchmark_training import TrainingCase, run_case, run_suite, synthetic_batches, train_step_flops
+from model import LuminaLMConfig
+
+
+class TestTrainingBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.config = LuminaLMConfig(
+            n_embd=16, n_head=2, n_encoder_layers=1, n_decoder_layers=1,
+            block_size=32, max_position_embeddings=32, vocab_size=32
+        )
+
+    def test_synthetic_batches_are_reproducible(self):
+        first = next(synthetic_batches(self.config, 2, 8, 6, seed=3))
+        second = next(synthetic_batches(self.config, 2, 8, 6, seed=3))
+        self.assertEqual(first['input_ids'].shape, (2, 8))
+        self.assertEqual(first['decoder_input_ids'].shape, (2, 6))
+        self.assertTrue(torch.all(first['decoder_input_ids'][:, 0] == self.config.bos_token_id))
+        torch.testing.assert_close(first['labels'], second['labels'])
+
+    def test_checkpointing_adds_recompute_flops(self):
+        none = train_step_flops(self.config, 2, 8, 8, "none")
+        self.assertAlmostEqual(train_step_flops(self.config, 2, 8, 8, "full") / none, 4.0 / 3.0)
+
+    def test_run_case_reports_phases(self):
+        result = run_case(self.config, TrainingCase(2, 8, 6, checkpoint_policy="full"), steps=2, warmup=1, peak_flops=1e9)
+        for key in ('data_ms', 'forward_ms', 'backward_ms', 'optimizer_ms', 'tokens_per_sec', 'samples_per_sec', 'mfu'):
+            self.assertGreater(result[key], 0.0, key)
+        self.assertEqual(result['checkpoint_policy'], "full")
+
+    def test_suite_runs_each_policy_in_its_own_process(self):
+        cases = [TrainingCase(2, 8, 6, checkpoint_policy=policy) for policy in ("none", "full")]
+        report = run_suite(self.config, cases, steps=1, warmup=0)
+        self.assertTrue(report['isolated_cases'])
+        self.assertEqual([r['checkpoint_policy'] for r in report['results']], ["none", "full"])
+        self.assertTrue(all(r['peak_rss_mb'] > 0 for r in report['results']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import torch
+from checkpointing import layer_checkpoint_modes, saved_activation_bytes, select_checkpoint_policy
+from model import LuminaLM, LuminaLMConfig
+
+
+class TestCheckpointPolicies(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.config = LuminaLMConfig(
+            n_embd=16, n_head=2, n_encoder_layers=3, n_decoder_layers=3,
+            block_size=32, max_position_embeddings=32, vocab_size=32,
+            embd_pdrop=0.0, resid_pdrop=0.0, attn_pdrop=0.0
+        )
+        self.model = LuminaLM(self.config).train()
+        self.input_ids = torch.randint(3, self.config.vocab_size, (2, 12))
+        self.decoder_input_ids = torch.randint(3, self.config.vocab_size, (2, 10))
+
+    def _gradients(self, policy):
+        self.model.set_checkpoint_policy(policy)
+        self.model.zero_grad()
+        self.model(input_ids=self.input_ids, decoder_input_ids=self.decoder_input_ids).sum().backward()
+        return {name: p.grad.clone() for name, p in self.model.named_parameters() if p.grad is not None}
+
+    def test_every_k_modes(self):
+        self.assertEqual(layer_checkpoint_modes("every_k", 5, every_k=2), ["full", "none", "full", "none", "full"])
+        with self.assertRaises(ValueError):
+            layer_checkpoint_modes("sometimes", 2)
+
+    def test_policies_preserve_gradients(self):
+        expected = self._gradients("none")
+        for policy in ("full", "attention", "ffn", "every_k"):
+            gradients = self._gradients(policy)
+            self.assertEqual(gradients.keys(), expected.keys(), policy)
+            for name, grad in gradients.items():
+                torch.testing.assert_close(grad, expected[name], msg=f"{policy}: {name}")
+
+    def test_encoder_receives_gradient_through_checkpointed_decoder(self):
+        gradients = self._gradients("full")
+        self.assertGreater(gradients["encoder.0.attn.q_proj.weight"].abs().sum().item(), 0.0)
+
+    def test_checkpointing_saves_activation_memory(self):
+        self.model.set_checkpoint_policy("none")
+        baseline = saved_activation_bytes(self.model, self.input_ids, self.decoder_input_ids)
+        self.model.set_checkpoint_policy("full")
+        self.assertLess(saved_activation_bytes(self.model, self.input_ids, self.decoder_input_ids), baseline)
+
+    def test_budget_selects_fitting_policy(self):
+        policy, profiles = select_checkpoint_policy(
+            self.model, 0, self.input_ids, self.decoder_input_ids, candidates=("none", "full")
+        )
+        # Nothing fits a zero budget, so the smallest footprint wins
+        self.assertEqual(policy, "full")
+        self.assertEqual(self.model.checkpoint_policy, "full")
+        self.assertEqual(self.model.decoder[0].checkpoint_mode, "full")
+
+        budget = max(profile.activation_bytes for profile in profiles)
+        policy, _ = select_checkpoint_policy(self.model, budget, self.input_ids, self.decoder_input_ids)
+        self.assertIn(policy, ("none", "ffn", "attention", "every_k", "full"))
+
+
+if __name__ == '__main__':
+    unittest.main()
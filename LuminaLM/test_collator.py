@@ -0,0 +1,68 @@
+import unittest
+import numpy as np
+import torch
+from collator import LuminaLMCollator, TokenBudgetBatchSampler
+
+
+class TestLuminaLMCollator(unittest.TestCase):
+    def test_pads_to_batch_max_multiple_of_eight(self):
+        examples = [
+            {'input_ids': np.array([5, 6, 7], dtype=np.uint16), 'decoder_input_ids': np.array([8, 9], dtype=np.uint16)},
+            {'input_ids': np.arange(3, 13, dtype=np.uint16), 'decoder_input_ids': np.array([4], dtype=np.uint16)},
+        ]
+        batch = LuminaLMCollator(pad_token_id=0, bos_token_id=1, eos_token_id=2)(examples)
+        self.assertEqual(batch['input_ids'].shape, (2, 16))
+        self.assertEqual(batch['input_ids'].dtype, torch.int64)
+        self.assertEqual(batch['input_ids'][0, :4].tolist(), [5, 6, 7, 0])
+        self.assertEqual(batch['attention_mask'].shape, (2, 1, 1, 16))
+        self.assertEqual(batch['attention_mask'].sum(-1).flatten().tolist(), [3, 10])
+        self.assertEqual(batch['decoder_input_ids'][:, :4].tolist(), [[1, 8, 9, 0], [1, 4, 0, 0]])
+        self.assertEqual(batch['labels'][:, :4].tolist(), [[8, 9, 2, 0], [4, 2, 0, 0]])
+        self.assertEqual(batch['labels'].shape, (2, 8))
+
+
+class TestTokenBudgetBatchSampler(unittest.TestCase):
+    def setUp(self):
+        self.lengths = np.random.default_rng(0).integers(1, 60, size=200)
+
+    def test_batches_respect_budget_and_cover_dataset(self):
+        sampler = TokenBudgetBatchSampler(self.lengths, max_tokens=256, num_replicas=1, rank=0)
+        batches = list(sampler)
+        self.assertEqual(sorted(idx for batch in batches for idx in batch), list(range(200)))
+        for batch in batches:
+            padded = -(-self.lengths[batch].max() // 8) * 8
+            self.assertLessEqual(len(batch) * padded, 256)
+        sampler.set_epoch(1)
+        self.assertNotEqual(list(sampler), batches)
+
+    def test_ranks_split_one_epoch(self):
+        samplers = [TokenBudgetBatchSampler(self.lengths, max_tokens=256, num_replicas=3, rank=rank, seed=4) for rank in range(3)]
+        self.assertEqual(len({len(sampler) for sampler in samplers}), 1)
+        seen = [idx for sampler in samplers for batch in sampler for idx in batch]
+        self.assertEqual(set(seen), set(range(200)))
+        single = TokenBudgetBatchSampler(self.lengths, max_tokens=256, num_replicas=1, rank=0, seed=4)
+        self.assertLessEqual(len(single) - 3 * len(samplers[0]), 0)
+
+    def test_budget_counts_collated_encoder_and_decoder_tokens(self):
+        rng = np.random.default_rng(1)
+        examples = [
+            {
+                'input_ids': rng.integers(3, 50, size=int(rng.integers(1, 40))).astype(np.uint16),
+                'decoder_input_ids': rng.integers(3, 50, size=int(rng.integers(1, 40))).astype(np.uint16),
+            }
+            for _ in range(100)
+        ]
+        collator = LuminaLMCollator(max_length=24)
+        lengths = collator.budget_lengths(
+            [len(example['input_ids']) for example in examples], [len(example['decoder_input_ids']) for example in examples]
+        )
+        self.assertEqual(lengths.shape, (100, 2))
+        self.assertLessEqual(lengths.max(), 24)
+        for batch in TokenBudgetBatchSampler(lengths, max_tokens=256, num_replicas=1, rank=0):
+            collated = collator([examples[idx] for idx in batch])
+            tokens = collated['input_ids'].numel() + collated['decoder_input_ids'].numel()
+            self.assertLessEqual(tokens, 256)
+
+
+if __name__ == '__main__':
+    unittest.main()
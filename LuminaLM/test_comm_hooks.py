@@ -0,0 +1,32 @@
+import unittest
+from comm_hooks import CommunicationStats, compare_comm_hooks
+from model import LuminaLMConfig
+
+CONFIG = LuminaLMConfig(
+    n_embd=16, n_head=2, n_encoder_layers=1, n_decoder_layers=1,
+    block_size=16, max_position_embeddings=16, vocab_size=256
+)
+
+
+class TestCommunicationStats(unittest.TestCase):
+    def test_steps_end_at_last_bucket(self):
+        stats = CommunicationStats()
+        stats.record(100, 400, is_last_bucket=False)
+        stats.record(100, 400, is_last_bucket=True)
+        self.assertEqual(stats.steps, 1)
+        self.assertEqual(stats.bytes_per_step(), 200)
+        self.assertEqual(stats.compression_ratio(), 4.0)
+
+
+class TestCommHooks(unittest.TestCase):
+    def test_compressed_hooks_send_fewer_bytes_and_converge(self):
+        reports = {r['comm_hook']: r for r in compare_comm_hooks(CONFIG, ["none", "fp16", "topk"], world_size=2, steps=12)}
+        baseline = reports['none']['bytes_per_step']
+        self.assertAlmostEqual(reports['fp16']['bytes_per_step'], baseline / 2, delta=baseline * 0.01)
+        self.assertLess(reports['topk']['bytes_per_step'], baseline)
+        for report in reports.values():
+            self.assertLess(report['final_loss'], report['initial_loss'])
+
+
+if __name__ == '__main__':
+    unittest.main()
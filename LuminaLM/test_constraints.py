@@ -0,0 +1,82 @@
+import unittest
+import tempfile
+import os
+import torch
+from unittest.mock import Mock
+from constraints import TokenTrie, TrieConstraint
+from model import LuminaLM, LuminaLMConfig
+
+EOS = 2
+
+
+class TestTokenTrie(unittest.TestCase):
+    def setUp(self):
+        self.sequences = [[5, 6, 7], [5, 6], [5, 9], [8]]
+        self.trie = TokenTrie.from_token_sequences(self.sequences, EOS)
+
+    def test_allowed_tokens_follow_trie(self):
+        constraint = TrieConstraint(self.trie, batch_size=1)
+        candidate_ids, valid = constraint.allowed_tokens()
+        self.assertEqual(sorted(candidate_ids[valid].tolist()), [5, 8])
+
+        constraint.advance(torch.tensor([5]))
+        candidate_ids, valid = constraint.allowed_tokens()
+        self.assertEqual(sorted(candidate_ids[valid].tolist()), [6, 9])
+
+        # [5, 6] is complete, so EOS is allowed next to the continuation 7
+        constraint.advance(torch.tensor([6]))
+        candidate_ids, valid = constraint.allowed_tokens()
+        self.assertEqual(sorted(candidate_ids[valid].tolist()), [EOS, 7])
+
+        constraint.advance(torch.tensor([EOS]))
+        self.assertTrue(constraint.finished.all())
+
+    def test_rows_are_independent(self):
+        constraint = TrieConstraint(self.trie, batch_size=2)
+        constraint.advance(torch.tensor([5, 8]))
+        candidate_ids, valid = constraint.allowed_tokens()
+        self.assertEqual(candidate_ids.shape, (2, 2))
+        self.assertEqual(candidate_ids[1][valid[1]].tolist(), [EOS])
+
+    def test_rejects_disallowed_token(self):
+        constraint = TrieConstraint(self.trie, batch_size=1)
+        with self.assertRaises(ValueError):
+            constraint.advance(torch.tensor([7]))
+
+    def test_empty_set(self):
+        with self.assertRaises(ValueError):
+            TokenTrie.from_token_sequences([], EOS)
+
+    def test_disk_cache(self):
+        tokenizer = Mock()
+        tokenizer.to_str.return_value = '{"model": "test"}'
+        tokenizer.encode_batch.return_value = [Mock(ids=[5, 6]), Mock(ids=[8])]
+        with tempfile.TemporaryDirectory() as cache_dir:
+            trie = TokenTrie.from_strings(["E11.9", "I10"], tokenizer, EOS, cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            cached = TokenTrie.from_strings(["I10", "E11.9"], tokenizer, EOS, cache_dir=cache_dir)
+            self.assertEqual(tokenizer.encode_batch.call_count, 1)
+            torch.testing.assert_close(cached.tokens, trie.tokens)
+
+
+class TestConstrainedGeneration(unittest.TestCase):
+    def test_generation_stays_in_allowed_set(self):
+        torch.manual_seed(0)
+        config = LuminaLMConfig(
+            n_embd=16, n_head=2, n_encoder_layers=1, n_decoder_layers=1,
+            block_size=32, max_position_embeddings=32, vocab_size=32
+        )
+        model = LuminaLM(config).eval()
+        sequences = [[10, 11, 12], [10, 13], [14]]
+        trie = TokenTrie.from_token_sequences(sequences, config.eos_token_id)
+        prompt = torch.tensor([[3, 4, 5], [6, 7, 8]])
+        with torch.no_grad():
+            output = model.generate(prompt, max_length=8, trie=trie)
+        # Decoder output starts with the BOS prompt
+        for row in output[:, 1:].tolist():
+            continuation = row[:row.index(config.eos_token_id)]
+            self.assertIn(continuation, sequences)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+import torch
+from distributed import (
+    DistributedConfig, init_distributed, cleanup_distributed, wrap_model, reduce_mean, unwrap_model, broadcast_object,
+    spawn_local
+)
+from model import LuminaLM, LuminaLMConfig
+
+WORLD_SIZE = 2
+
+
+def _train_step(rank: int, world_size: int, output_dir: str) -> None:
+    device = init_distributed("gloo")
+    torch.manual_seed(0)
+    config = LuminaLMConfig(
+        n_embd=16, n_head=2, n_encoder_layers=1, n_decoder_layers=1,
+        block_size=32, max_position_embeddings=32, vocab_size=32, embd_pdrop=0.0, resid_pdrop=0.0, attn_pdrop=0.0
+    )
+    model = wrap_model(LuminaLM(config), device, DistributedConfig(bucket_cap_mb=1))
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    # Every rank sees different data
+    generator = torch.Generator().manual_seed(rank)
+    input_ids = torch.randint(3, config.vocab_size, (2, 8), generator=generator)
+    model(input_ids=input_ids, decoder_input_ids=input_ids).sum().backward()
+    optimizer.step()
+    loss = reduce_mean(float(rank), device)
+    policy = broadcast_object("full" if rank == 0 else None)
+    torch.save({'state': unwrap_model(model).state_dict(), 'mean': loss, 'policy': policy},
+               os.path.join(output_dir, f"rank{rank}.pt"))
+    cleanup_distributed()
+
+
+class TestDistributedDataParallel(unittest.TestCase):
+    def test_gloo_ranks_stay_in_sync(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            spawn_local(_train_step, WORLD_SIZE, output_dir)
+            results = [torch.load(os.path.join(output_dir, f"rank{rank}.pt")) for rank in range(WORLD_SIZE)]
+        self.assertEqual([r['mean'] for r in results], [0.5, 0.5])
+        self.assertEqual([r['policy'] for r in results], ["full", "full"])
+        # Gradients were all-reduced, so both replicas took the same step
+        for name, tensor in results[0]['state'].items():
+            torch.testing.assert_close(tensor, results[1]['state'][name], msg=name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import torch
+from model import LuminaLM, LuminaLMConfig
+from feature_store import (
+    EncoderFeatureDataset, FeatureCollator, encoder_fingerprint, freeze_encoder, load_or_build_feature_store
+)
+
+CONFIG = LuminaLMConfig(
+    n_embd=16, n_head=2, n_encoder_layers=2, n_decoder_layers=1,
+    block_size=32, max_position_embeddings=32, vocab_size=32
+)
+
+
+def _examples():
+    rng = np.random.default_rng(0)
+    return [
+        {
+            'input_ids': rng.integers(3, CONFIG.vocab_size, size=int(rng.integers(2, 12))).astype(np.uint16),
+            'decoder_input_ids': rng.integers(3, CONFIG.vocab_size, size=int(rng.integers(1, 4))).astype(np.uint16),
+        }
+        for _ in range(9)
+    ]
+
+
+class TestFeatureStore(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = LuminaLM(CONFIG).eval()
+        self.examples = _examples()
+
+    def test_features_match_encoder(self):
+        with tempfile.TemporaryDirectory() as feature_dir:
+            store = load_or_build_feature_store(self.model, self.examples, feature_dir, batch_size=4)
+            for idx, example in enumerate(self.examples):
+                input_ids = torch.from_numpy(example['input_ids'].astype(np.int64)).unsqueeze(0)
+                with torch.no_grad():
+                    expected = self.model.encode(input_ids)[0]
+                self.assertEqual(store[idx].shape, (len(example['input_ids']), CONFIG.n_embd))
+                torch.testing.assert_close(torch.from_numpy(np.array(store[idx])).float(), expected, atol=1e-2, rtol=1e-2)
+
+            batch = FeatureCollator(CONFIG.pad_token_id)([EncoderFeatureDataset(self.examples, store)[idx] for idx in range(4)])
+            batch.pop('labels')
+            self.assertEqual(batch['encoder_outputs'].dtype, torch.float16)
+            with torch.no_grad():
+                from_features = self.model(**batch)
+                batch.pop('encoder_outputs')
+                recomputed = self.model(**batch)
+            torch.testing.assert_close(from_features, recomputed, atol=1e-2, rtol=1e-2)
+
+    def test_rebuilt_when_encoder_changes(self):
+        with tempfile.TemporaryDirectory() as feature_dir:
+            store = load_or_build_feature_store(self.model, self.examples, feature_dir)
+            features_file = os.path.join(store.path, "features.npy")
+            built_at = os.stat(features_file).st_mtime_ns
+
+            # Decoder updates keep the store
+            with torch.no_grad():
+                self.model.decoder[0].ff.fc1.weight.add_(1.0)
+            again = load_or_build_feature_store(self.model, self.examples, feature_dir)
+            self.assertEqual(os.stat(features_file).st_mtime_ns, built_at)
+            self.assertEqual(again.meta['encoder_fingerprint'], store.meta['encoder_fingerprint'])
+
+            with torch.no_grad():
+                self.model.encoder[1].ff.fc2.bias.add_(1.0)
+            rebuilt = load_or_build_feature_store(self.model, self.examples, feature_dir)
+            self.assertEqual(rebuilt.path, store.path)
+            self.assertEqual(rebuilt.meta['encoder_fingerprint'], encoder_fingerprint(self.model))
+            self.assertNotEqual(rebuilt.meta['encoder_fingerprint'], store.meta['encoder_fingerprint'])
+
+    def test_only_decoder_trains(self):
+        freeze_encoder(self.model)
+        self.model.train()
+        with tempfile.TemporaryDirectory() as feature_dir:
+            dataset = EncoderFeatureDataset(self.examples, load_or_build_feature_store(self.model, self.examples, feature_dir))
+            batch = FeatureCollator(CONFIG.pad_token_id)([dataset[idx] for idx in range(3)])
+            labels = batch.pop('labels')
+            logits = self.model(**batch)
+            torch.nn.functional.cross_entropy(logits.view(-1, logits.size(-1)), labels.view(-1)).backward()
+        self.assertTrue(all(param.grad is None for param in self.model.encoder.parameters()))
+        self.assertIsNone(self.model.wte.weight.grad)
+        self.assertIsNotNone(self.model.decoder[0].ff.fc1.weight.grad)
+
+
+if __name__ == '__main__':
+    unittest.main()
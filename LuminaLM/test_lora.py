@@ -0,0 +1,102 @@
+import tempfile
+import unittest
+import torch
+import torch.nn as nn
+from model import LuminaLM, LuminaLMConfig
+from lora import (
+    LoRAConfig, LoRALinear, adapter_batch, add_lora, compare_finetuning, load_adapter, merge_adapter, save_adapter,
+    set_adapter, unmerge_adapter
+)
+from sharding import build_optimizer
+
+CONFIG = LuminaLMConfig(
+    n_embd=16, n_head=2, n_encoder_layers=1, n_decoder_layers=2,
+    block_size=32, max_position_embeddings=32, vocab_size=32
+)
+INPUT_IDS = torch.randint(3, CONFIG.vocab_size, (3, 6), generator=torch.Generator().manual_seed(0))
+
+
+def _randomize(model, adapter_name):
+    """Non-zero B matrices, so the adapter changes the outputs."""
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, LoRALinear):
+                module.lora_B[adapter_name].normal_(std=0.5)
+
+
+class TestLoRA(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = LuminaLM(CONFIG).eval()
+        with torch.no_grad():
+            self.base_logits = self.model(INPUT_IDS, INPUT_IDS)
+
+    def test_trains_adapter_only(self):
+        add_lora(self.model, LoRAConfig(rank=2))
+        self.assertEqual(sum(isinstance(m, LoRALinear) for m in self.model.modules()), 6 * 1 + 10 * 2)
+        with torch.no_grad():
+            torch.testing.assert_close(self.model(INPUT_IDS, INPUT_IDS), self.base_logits)
+
+        base_state = {name: tensor.clone() for name, tensor in self.model.state_dict().items() if "lora_" not in name}
+        self.model.train()
+        optimizer = build_optimizer(self.model, lr=1e-2)
+        for _ in range(2):
+            logits = self.model(INPUT_IDS, INPUT_IDS)
+            loss = nn.functional.cross_entropy(logits.view(-1, logits.size(-1)), INPUT_IDS.view(-1))
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+        for name, tensor in self.model.state_dict().items():
+            if name in base_state:
+                torch.testing.assert_close(tensor, base_state[name], msg=name)
+        trainable = {id(p) for p in self.model.parameters() if p.requires_grad}
+        self.assertTrue(all(id(p) in trainable for p in optimizer.state))
+        self.assertTrue(all("lora_" in name for name, p in self.model.named_parameters() if p.requires_grad))
+
+    def test_merge_matches_unmerged(self):
+        add_lora(self.model, LoRAConfig(rank=4))
+        _randomize(self.model, "default")
+        with torch.no_grad():
+            unmerged = self.model(INPUT_IDS, INPUT_IDS)
+            merge_adapter(self.model, "default")
+            torch.testing.assert_close(self.model(INPUT_IDS, INPUT_IDS), unmerged, atol=1e-5, rtol=1e-4)
+            unmerge_adapter(self.model)
+            set_adapter(self.model, None)
+            torch.testing.assert_close(self.model(INPUT_IDS, INPUT_IDS), self.base_logits, atol=1e-5, rtol=1e-4)
+
+    def test_mixed_adapter_batch_matches_single_adapter(self):
+        add_lora(self.model, LoRAConfig(rank=2), "a")
+        add_lora(self.model, LoRAConfig(rank=4, alpha=4), "b")
+        _randomize(self.model, "a")
+        _randomize(self.model, "b")
+        names = ["b", None, "a"]
+        with torch.no_grad(), adapter_batch(self.model, names):
+            mixed = self.model.generate(INPUT_IDS, max_length=6, temperature=0.0, early_stopping=False)
+        for row, name in enumerate(names):
+            set_adapter(self.model, name)
+            with torch.no_grad():
+                single = self.model.generate(INPUT_IDS[row:row + 1], max_length=6, temperature=0.0, early_stopping=False)
+            self.assertEqual(mixed[row].tolist(), single[0].tolist())
+
+    def test_save_and_load_adapter(self):
+        add_lora(self.model, LoRAConfig(rank=2))
+        _randomize(self.model, "default")
+        with torch.no_grad():
+            expected = self.model(INPUT_IDS, INPUT_IDS)
+        with tempfile.TemporaryDirectory() as directory:
+            save_adapter(self.model, directory)
+            torch.manual_seed(0)
+            other = LuminaLM(CONFIG).eval()
+            load_adapter(other, directory, "hospital")
+        with torch.no_grad():
+            torch.testing.assert_close(other(INPUT_IDS, INPUT_IDS), expected)
+
+    def test_compare_finetuning(self):
+        report = compare_finetuning(CONFIG, LoRAConfig(rank=2), batch_size=2, src_len=8, tgt_len=4, steps=2)
+        for key in ('trainable_parameters', 'gradient_bytes', 'optimizer_state_bytes', 'checkpoint_bytes'):
+            self.assertLess(report['lora'][key], report['full'][key], key)
+        self.assertGreater(report['lora']['seconds_per_step'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+import torch
+import torch.nn as nn
+from model import LuminaLM, LuminaLMConfig
+from multi_target import MultiTargetCollator, group_weighted_loss
+
+CONFIG = LuminaLMConfig(
+    n_embd=16, n_head=2, n_encoder_layers=2, n_decoder_layers=2,
+    block_size=32, max_position_embeddings=32, vocab_size=32
+)
+
+
+def _examples():
+    rng = np.random.default_rng(0)
+    return [
+        {
+            'input_ids': rng.integers(3, CONFIG.vocab_size, size=length).astype(np.uint16),
+            'targets': [rng.integers(3, CONFIG.vocab_size, size=int(rng.integers(1, 5))).astype(np.uint16)
+                        for _ in range(num_targets)],
+        }
+        for length, num_targets in ((7, 3), (4, 1), (10, 2))
+    ]
+
+
+class TestMultiTarget(unittest.TestCase):
+    def test_matches_one_pass_per_target(self):
+        torch.manual_seed(0)
+        model = LuminaLM(CONFIG).eval()
+        examples = _examples()
+        batch = MultiTargetCollator(CONFIG.pad_token_id, CONFIG.bos_token_id, CONFIG.eos_token_id)(examples)
+        labels, loss_weights = batch.pop('labels'), batch.pop('loss_weights')
+        self.assertEqual(batch['input_ids'].size(0), len(examples))
+        with torch.no_grad():
+            logits = model(**batch)
+            loss = group_weighted_loss(logits, labels, loss_weights)
+
+        group_losses = []
+        for row, example in enumerate(examples):
+            input_ids = torch.from_numpy(example['input_ids'].astype(np.int64)).unsqueeze(0)
+            offset, token_losses = 0, []
+            for target in example['targets']:
+                target = target.astype(np.int64).tolist()
+                decoder_input_ids = torch.tensor([[CONFIG.bos_token_id] + target])
+                with torch.no_grad():
+                    expected = model(input_ids=input_ids, decoder_input_ids=decoder_input_ids)[0]
+                torch.testing.assert_close(logits[row, offset:offset + len(target) + 1], expected)
+                token_losses.append(nn.functional.cross_entropy(
+                    expected, torch.tensor(target + [CONFIG.eos_token_id]), reduction='none'
+                ))
+                offset += len(target) + 1
+            group_losses.append(torch.cat(token_losses).mean())
+        torch.testing.assert_close(loss, torch.stack(group_losses).mean())
+
+
+if __name__ == '__main__':
+    unittest.main()
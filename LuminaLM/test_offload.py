@@ -0,0 +1,40 @@
+import unittest
+import tempfile
+import torch
+from model import LuminaLM, LuminaLMConfig
+from offload import save_layer_shards, StreamingLuminaLM
+
+
+class TestLayerStreaming(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.config = LuminaLMConfig(
+            n_embd=16, n_head=2, n_encoder_layers=3, n_decoder_layers=3,
+            block_size=32, max_position_embeddings=32, vocab_size=50
+        )
+        self.model = LuminaLM(self.config).eval()
+        shard_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(shard_dir.cleanup)
+        self.shard_dir = shard_dir.name
+        save_layer_shards(self.model, self.shard_dir)
+        self.input_ids = torch.randint(3, 50, (2, 7))
+
+    def test_streamed_generation_matches_resident_model(self):
+        expected = self.model.generate(self.input_ids, max_length=5, temperature=0.0, early_stopping=False)
+        for budget in (1, 2, 6):
+            streaming = StreamingLuminaLM(self.shard_dir, max_resident_layers=budget)
+            output = streaming.generate(self.input_ids, max_length=5, temperature=0.0, early_stopping=False)
+            streaming.close()
+            torch.testing.assert_close(output, expected)
+
+    def test_resident_budget_bounds_loads(self):
+        streaming = StreamingLuminaLM(self.shard_dir, max_resident_layers=6)
+        streaming.generate(self.input_ids, max_length=4, temperature=0.0, early_stopping=False)
+        streaming.close()
+        # Every layer fits, so each shard is read exactly once
+        self.assertEqual(streaming.streamer.stats()['loads'], 6)
+        self.assertLessEqual(len(streaming.streamer._resident), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import importlib.util
+import tempfile
+import numpy as np
+import torch
+from model import LuminaLM, LuminaLMConfig
+
+HAS_ONNX = importlib.util.find_spec("onnx") is not None and importlib.util.find_spec("onnxruntime") is not None
+
+
+@unittest.skipUnless(HAS_ONNX, "onnx and onnxruntime are required")
+class TestOnnxExport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from onnx_export import export_onnx, OnnxLuminaLM
+        torch.manual_seed(0)
+        cls.config = LuminaLMConfig(
+            n_embd=16, n_head=2, n_encoder_layers=2, n_decoder_layers=2,
+            block_size=32, max_position_embeddings=32, vocab_size=50
+        )
+        cls.model = LuminaLM(cls.config).eval()
+        export_dir = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(export_dir.cleanup)
+        cls.export_dir = export_dir.name
+        export_onnx(cls.model, cls.export_dir)
+        cls.onnx_model = OnnxLuminaLM(cls.export_dir)
+
+    def test_decoder_step_parity(self):
+        input_ids = torch.randint(3, 50, (3, 11))
+        decoder_input_ids = torch.randint(3, 50, (3, 4))
+        attention_mask = np.ones((3, 11), dtype=np.int64)
+        cross = self.onnx_model.encoder.run(None, {"input_ids": input_ids.numpy(), "attention_mask": attention_mask})
+        empty = np.zeros((3, 2, 0, 8), dtype=np.float32)
+        feeds = {"decoder_input_ids": decoder_input_ids.numpy(), "attention_mask": attention_mask}
+        feeds.update({name: empty for name in self.onnx_model.past_names})
+        feeds.update(dict(zip(self.onnx_model.cross_names, cross)))
+        logits = self.onnx_model.decoder_step.run(["logits"], feeds)[0]
+
+        with torch.no_grad():
+            expected = self.model(input_ids, decoder_input_ids)[:, -1, :]
+        np.testing.assert_allclose(logits, expected.numpy(), rtol=1e-4, atol=1e-4)
+
+    def test_greedy_generation_parity(self):
+        input_ids = torch.randint(3, 50, (2, 9))
+        expected = self.model.generate(input_ids, max_length=6, temperature=0.0, early_stopping=False)
+        output = self.onnx_model.generate(input_ids, max_length=6, temperature=0.0, early_stopping=False)
+        torch.testing.assert_close(output, expected)
+
+    def test_export_keeps_training_mode(self):
+        from onnx_export import export_onnx
+        model = LuminaLM(self.config).train()
+        with tempfile.TemporaryDirectory() as export_dir:
+            export_onnx(model, export_dir)
+        self.assertTrue(all(module.training for module in model.modules()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import copy
+import unittest
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from model import LuminaLM, LuminaLMConfig
+from optim8bit import AdamW8bit, create_dynamic_map, dequantize_blockwise, quantize_blockwise
+from sharding import local_state_bytes
+
+CONFIG = LuminaLMConfig(
+    n_embd=32, n_head=2, n_encoder_layers=1, n_decoder_layers=1,
+    block_size=32, max_position_embeddings=32, vocab_size=64, embd_pdrop=0.0, resid_pdrop=0.0, attn_pdrop=0.0
+)
+INPUT_IDS = torch.randint(3, CONFIG.vocab_size, (4, 8), generator=torch.Generator().manual_seed(0))
+
+
+def _train(model, optimizer, steps):
+    losses = []
+    for _ in range(steps):
+        logits = model(INPUT_IDS, INPUT_IDS)
+        loss = nn.functional.cross_entropy(logits.view(-1, logits.size(-1)), INPUT_IDS.view(-1))
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        losses.append(loss.item())
+    return losses
+
+
+class TestQuantization(unittest.TestCase):
+    def test_dynamic_map(self):
+        for signed in (True, False):
+            code = create_dynamic_map(signed)
+            self.assertEqual(code.numel(), 256)
+            self.assertTrue(torch.all(code[1:] >= code[:-1]))
+            self.assertEqual(code.max().item(), 1.0)
+            self.assertIn(0.0, code.tolist())
+        self.assertGreaterEqual(create_dynamic_map(False).min().item(), 0.0)
+
+    def test_blockwise_round_trip(self):
+        code = create_dynamic_map(signed=True)
+        tensor = torch.randn(5120) * torch.logspace(-4, 0, 5120)
+        indices, absmax = quantize_blockwise(tensor, code, block_size=256)
+        self.assertEqual(indices.dtype, torch.uint8)
+        self.assertEqual(absmax.numel(), 20)
+        restored = dequantize_blockwise(indices, absmax, code, block_size=256)
+        # Dynamic codes keep the error relative to each block's scale small
+        error = (restored - tensor).abs().view(-1, 256)
+        self.assertLess((error.amax(dim=1) / tensor.abs().view(-1, 256).amax(dim=1)).max().item(), 0.05)
+
+
+class TestAdamW8bit(unittest.TestCase):
+    def test_tracks_adamw_with_less_state(self):
+        reports = {}
+        for name, optimizer_class in (("adamw", optim.AdamW), ("adamw8bit", AdamW8bit)):
+            torch.manual_seed(0)
+            model = LuminaLM(CONFIG)
+            kwargs = {'block_size': 256, 'min_8bit_size': 1024} if optimizer_class is AdamW8bit else {}
+            optimizer = optimizer_class(model.parameters(), lr=3e-3, weight_decay=0.01, **kwargs)
+            reports[name] = (_train(model, optimizer, 30), local_state_bytes(model, optimizer)['optimizer_state_bytes'])
+        adamw_losses, adamw_bytes = reports["adamw"]
+        losses, state_bytes = reports["adamw8bit"]
+        self.assertLess(losses[-1], losses[0] / 2)
+        self.assertAlmostEqual(losses[-1], adamw_losses[-1], delta=0.1 * adamw_losses[-1] + 0.05)
+        self.assertLess(state_bytes, adamw_bytes / 3)
+
+    def test_resume_from_state_dict(self):
+        torch.manual_seed(0)
+        model = LuminaLM(CONFIG)
+        optimizer = AdamW8bit(model.parameters(), lr=1e-3, block_size=256, min_8bit_size=1024)
+        _train(model, optimizer, 3)
+        model_state = {name: tensor.clone() for name, tensor in model.state_dict().items()}
+        # state_dict() references the live state tensors, like every torch optimizer; snapshot it
+        optimizer_state = copy.deepcopy(optimizer.state_dict())
+        _train(model, optimizer, 3)
+
+        resumed = LuminaLM(CONFIG)
+        resumed.load_state_dict(model_state)
+        resumed_optimizer = AdamW8bit(resumed.parameters(), lr=1e-3, block_size=256, min_8bit_size=1024)
+        resumed_optimizer.load_state_dict(optimizer_state)
+        self.assertTrue(any(value.dtype == torch.uint8 for state in resumed_optimizer.state.values() for value in state.values()))
+        _train(resumed, resumed_optimizer, 3)
+        for name, tensor in resumed.state_dict().items():
+            torch.testing.assert_close(tensor, model.state_dict()[name], msg=name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import numpy as np
+import torch
+from model import LuminaLM, LuminaLMConfig
+from packing import PackedDataset, block_diagonal_mask, collate_packed, pack_examples
+
+CONFIG = LuminaLMConfig(
+    n_embd=16, n_head=2, n_encoder_layers=2, n_decoder_layers=2,
+    block_size=32, max_position_embeddings=32, vocab_size=32
+)
+
+
+def _examples():
+    rng = np.random.default_rng(0)
+    return [
+        {
+            'input_ids': rng.integers(3, CONFIG.vocab_size, size=int(rng.integers(2, 9))).astype(np.uint16),
+            'decoder_input_ids': rng.integers(3, CONFIG.vocab_size, size=int(rng.integers(1, 4))).astype(np.uint16),
+        }
+        for _ in range(10)
+    ]
+
+
+class TestPackExamples(unittest.TestCase):
+    def test_rows_fit_both_sides(self):
+        input_lengths, target_lengths = [6, 3, 5, 2, 8], [2, 4, 1, 3, 2]
+        rows = pack_examples(input_lengths, target_lengths, encoder_length=8, decoder_length=5)
+        self.assertEqual(sorted(idx for row in rows for idx in row), list(range(5)))
+        for row in rows:
+            self.assertLessEqual(sum(input_lengths[idx] for idx in row), 8)
+            self.assertLessEqual(sum(target_lengths[idx] for idx in row), 5)
+        self.assertEqual(rows, [[0, 3], [1, 2], [4]])
+
+
+class TestPackedDataset(unittest.TestCase):
+    def setUp(self):
+        self.examples = _examples()
+        self.packed = PackedDataset(self.examples, encoder_length=16, decoder_length=8)
+
+    def test_segments(self):
+        self.assertLess(len(self.packed), len(self.examples))
+        seen = []
+        for row in range(len(self.packed)):
+            item = self.packed[row]
+            for segment in range(1, item['segment_ids'].max() + 1):
+                example_id = int(self.packed.example_ids[self.packed.row_offsets[row] + segment - 1])
+                example = self.examples[example_id]
+                encoder = item['segment_ids'] == segment
+                decoder = item['decoder_segment_ids'] == segment
+                self.assertEqual(item['input_ids'][encoder].tolist(), example['input_ids'].tolist())
+                self.assertEqual(item['position_ids'][encoder].tolist(), list(range(encoder.sum())))
+                self.assertEqual(item['decoder_input_ids'][decoder].tolist(), [1] + example['decoder_input_ids'].tolist())
+                self.assertEqual(item['labels'][decoder].tolist(), example['decoder_input_ids'].tolist() + [2])
+                seen.append(example_id)
+            self.assertTrue((item['labels'][item['decoder_segment_ids'] == 0] == CONFIG.pad_token_id).all())
+        self.assertEqual(sorted(seen), list(range(len(self.examples))))
+
+    def test_masks_are_block_diagonal(self):
+        segments = torch.tensor([[1, 1, 2, 0]])
+        mask = block_diagonal_mask(segments, segments)[0, 0]
+        expected = torch.tensor([[1, 1, 0, 0], [1, 1, 0, 0], [0, 0, 1, 0], [1, 1, 1, 1]], dtype=torch.bool)
+        self.assertTrue(torch.equal(mask, expected))
+
+    def test_packed_logits_match_unpacked(self):
+        torch.manual_seed(0)
+        model = LuminaLM(CONFIG).eval()
+        batch = collate_packed([self.packed[row] for row in range(len(self.packed))])
+        labels = batch.pop('labels')
+        with torch.no_grad():
+            packed_logits = model(**batch)
+        self.assertFalse(torch.isnan(packed_logits).any())
+        for row in range(len(self.packed)):
+            segments = self.packed[row]['decoder_segment_ids']
+            example_ids = self.packed.example_ids[self.packed.row_offsets[row]:self.packed.row_offsets[row + 1]]
+            for segment, example_id in enumerate(example_ids, start=1):
+                example = self.examples[int(example_id)]
+                input_ids = torch.from_numpy(example['input_ids'].astype(np.int64)).unsqueeze(0)
+                decoder_input_ids = torch.tensor([[1] + example['decoder_input_ids'].tolist()])
+                with torch.no_grad():
+                    expected = model(input_ids=input_ids, decoder_input_ids=decoder_input_ids)[0]
+                torch.testing.assert_close(packed_logits[row][torch.from_numpy(segments == segment)], expected)
+        self.assertEqual(int((labels != CONFIG.pad_token_id).sum()), sum(len(e['decoder_input_ids']) + 1 for e in self.examples))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import dataclasses
+from model import LuminaLM, LuminaLMConfig
+from parameters import ModelCost, count_parameters, sweep
+
+
+class TestModelCost(unittest.TestCase):
+    def setUp(self):
+        self.config = LuminaLMConfig(
+            n_embd=16, n_head=2, n_encoder_layers=2, n_decoder_layers=3,
+            block_size=32, max_position_embeddings=32, vocab_size=50
+        )
+
+    def test_parameters_match_instantiated_model(self):
+        for shared in (True, False):
+            config = dataclasses.replace(self.config, shared_embeddings=shared)
+            model = LuminaLM(config)
+            cost = ModelCost(config)
+            self.assertEqual(cost.total_parameters(), count_parameters(model))
+            per_module = cost.parameters_per_module()
+            for name in ('encoder', 'decoder', 'position_embeddings'):
+                self.assertEqual(per_module[name], count_parameters(getattr(model, name)), name)
+
+    def test_checkpointing_reduces_activations(self):
+        cost = ModelCost(self.config)
+        none = cost.activation_bytes(4, 32, 32, "none")
+        for policy in ("full", "attention", "ffn", "every_k"):
+            self.assertLess(cost.activation_bytes(4, 32, 32, policy), none, policy)
+        self.assertLess(cost.activation_bytes(4, 32, 32, "full"), cost.activation_bytes(4, 32, 32, "ffn"))
+
+    def test_kv_cache_and_optimizer_state(self):
+        cost = ModelCost(self.config, dtype_bytes=2)
+        self.assertEqual(cost.kv_cache_bytes_per_token()['self_attention'], 3 * 2 * 16 * 2)
+        self.assertEqual(cost.training_state_bytes("adamw")['optimizer_states'], 8 * cost.total_parameters())
+
+    def test_sweep_skips_indivisible_heads(self):
+        configs = sweep(self.config, n_embd=[16, 24], n_head=[2, 16], n_layers=[1, 2])
+        self.assertEqual(len(configs), 6)
+        self.assertTrue(all(c.n_embd % c.n_head == 0 for c in configs))
+        self.assertTrue(all(c.n_encoder_layers == c.n_decoder_layers for c in configs))
+
+
+if __name__ == '__main__':
+    unittest.main()
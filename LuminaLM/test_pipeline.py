@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+import torch
+import torch.nn as nn
+from distributed import init_distributed, cleanup_distributed, spawn_local
+from model import LuminaLM, LuminaLMConfig
+from pipeline import PipelineParallel, partition_layers, bubble_fraction
+
+CONFIG = LuminaLMConfig(
+    n_embd=16, n_head=2, n_encoder_layers=2, n_decoder_layers=2,
+    block_size=32, max_position_embeddings=32, vocab_size=32, embd_pdrop=0.0, resid_pdrop=0.0, attn_pdrop=0.0
+)
+NUM_MICROBATCHES = 3
+
+
+def _batch():
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(3, CONFIG.vocab_size, (6, 8), generator=generator)
+    decoder_input_ids = torch.randint(3, CONFIG.vocab_size, (6, 7), generator=generator)
+    labels = torch.randint(3, CONFIG.vocab_size, (6, 7), generator=generator)
+    return input_ids, decoder_input_ids, labels
+
+
+def _pipeline_step(rank: int, world_size: int, layers_per_stage, output_dir: str) -> None:
+    init_distributed("gloo")
+    torch.manual_seed(0)
+    model = PipelineParallel(LuminaLM(CONFIG), NUM_MICROBATCHES, layers_per_stage)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    loss = model.train_step(*_batch(), nn.CrossEntropyLoss())
+    optimizer.step()
+    torch.save({'loss': loss.item(), 'state': model.gather_full_state()}, os.path.join(output_dir, f"rank{rank}.pt"))
+    cleanup_distributed()
+
+
+def _reference_step():
+    torch.manual_seed(0)
+    model = LuminaLM(CONFIG)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    criterion = nn.CrossEntropyLoss()
+    total = 0.0
+    for input_ids, decoder_input_ids, labels in zip(*(t.tensor_split(NUM_MICROBATCHES) for t in _batch())):
+        logits = model(input_ids=input_ids, decoder_input_ids=decoder_input_ids)
+        loss = criterion(logits.view(-1, logits.size(-1)), labels.reshape(-1)) / NUM_MICROBATCHES
+        loss.backward()
+        total += loss.item()
+    optimizer.step()
+    return total, model.state_dict()
+
+
+class TestPartition(unittest.TestCase):
+    def test_two_stages_split_encoder_from_decoder(self):
+        self.assertEqual(partition_layers(CONFIG, 2), [(0, 2), (2, 4)])
+        self.assertEqual(partition_layers(CONFIG, 3), [(0, 2), (2, 3), (3, 4)])
+        self.assertEqual(partition_layers(CONFIG, 2, [1, 3]), [(0, 1), (1, 4)])
+        with self.assertRaises(ValueError):
+            partition_layers(CONFIG, 2, [2, 1])
+        self.assertAlmostEqual(bubble_fraction(2, 4), 0.2)
+
+
+class TestPipelineParallel(unittest.TestCase):
+    def _run(self, world_size, layers_per_stage=None):
+        with tempfile.TemporaryDirectory() as output_dir:
+            spawn_local(_pipeline_step, world_size, layers_per_stage, output_dir)
+            results = [torch.load(os.path.join(output_dir, f"rank{rank}.pt")) for rank in range(world_size)]
+        reference_loss, reference_state = _reference_step()
+        for result in results:
+            self.assertAlmostEqual(result['loss'], reference_loss, places=5)
+        self.assertTrue(all(result['state'] is None for result in results[1:]))
+        # Same update as single-process training with gradient accumulation, tied weights included
+        self.assertEqual(set(results[0]['state']), set(reference_state))
+        for name, tensor in reference_state.items():
+            torch.testing.assert_close(results[0]['state'][name], tensor, msg=name)
+
+    def test_encoder_decoder_stages_match_single_process(self):
+        self._run(2)
+
+    def test_split_decoder_matches_single_process(self):
+        self._run(3, [1, 2, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import torch
+from model import LuminaLM, LuminaLMConfig
+from prefix_cache import PrefixCache
+
+
+def tiny_config(**overrides) -> LuminaLMConfig:
+    values = dict(
+        n_embd=16, n_head=2, n_encoder_layers=1, n_decoder_layers=2,
+        block_size=32, max_position_embeddings=32, vocab_size=50
+    )
+    values.update(overrides)
+    return LuminaLMConfig(**values)
+
+
+class TestDecoderKVCache(unittest.TestCase):
+    def test_incremental_decode_matches_full_decode(self):
+        torch.manual_seed(0)
+        model = LuminaLM(tiny_config()).eval()
+        input_ids = torch.randint(3, 50, (2, 6))
+        decoder_input_ids = torch.randint(3, 50, (2, 5))
+        with torch.no_grad():
+            encoder_outputs = model.encode(input_ids)
+            full = model.decode(decoder_input_ids, encoder_outputs)
+            hidden, past = model.decode(decoder_input_ids[:, :3], encoder_outputs, use_cache=True)
+            step, past = model.decode(decoder_input_ids[:, 3:], encoder_outputs, past_key_values=past, use_cache=True)
+        torch.testing.assert_close(torch.cat([hidden, step], dim=1), full, rtol=1e-4, atol=1e-5)
+
+
+class TestPrefixCache(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.config = tiny_config()
+        self.model = LuminaLM(self.config).eval()
+        self.input_ids = torch.randint(3, 50, (2, 6))
+        self.template = torch.randint(3, 50, (1, 8)).repeat(2, 1)
+
+    def test_cached_generation_matches_uncached(self):
+        cache = PrefixCache(self.config)
+        expected = self.model.generate(self.input_ids, max_length=5, temperature=0.0, decoder_input_ids=self.template)
+        first = self.model.generate(self.input_ids, max_length=5, temperature=0.0, decoder_input_ids=self.template, prefix_cache=cache)
+        second = self.model.generate(self.input_ids, max_length=5, temperature=0.0, decoder_input_ids=self.template, prefix_cache=cache)
+        torch.testing.assert_close(first, expected)
+        torch.testing.assert_close(second, expected)
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['lookups'], 4)
+        self.assertGreater(stats['bytes_used'], 0)
+
+    def test_longest_prefix_match(self):
+        cache = PrefixCache(self.config)
+        self.model.generate(self.input_ids, max_length=1, temperature=0.0, decoder_input_ids=self.template, prefix_cache=cache)
+        extended = torch.cat([self.template[:, :5], torch.full((2, 4), self.config.bos_token_id)], dim=1)
+        lookup = cache.lookup(self.input_ids, extended)
+        self.assertEqual(lookup.length, 5)
+        self.assertEqual(lookup.past_key_values[0][0][0].shape, (2, 2, 5, 8))
+        cache.release(lookup)
+
+    def test_keyed_by_encoder_input(self):
+        cache = PrefixCache(self.config)
+        self.model.generate(self.input_ids, max_length=1, temperature=0.0, decoder_input_ids=self.template, prefix_cache=cache)
+        other_input = torch.randint(3, 50, (2, 6))
+        self.assertEqual(cache.lookup(other_input, self.template).length, 0)
+
+    def test_shared_across_encoder_inputs_with_single_decoder_layer(self):
+        config = tiny_config(n_decoder_layers=1)
+        model = LuminaLM(config).eval()
+        cache = PrefixCache(config)
+        model.generate(self.input_ids, max_length=1, temperature=0.0, decoder_input_ids=self.template, prefix_cache=cache)
+        other_input = torch.randint(3, 50, (2, 6))
+        expected = model.generate(other_input, max_length=4, temperature=0.0, decoder_input_ids=self.template)
+        cached = model.generate(other_input, max_length=4, temperature=0.0, decoder_input_ids=self.template, prefix_cache=cache)
+        self.assertEqual(cache.stats()['hits'], 2)
+        torch.testing.assert_close(cached, expected)
+
+    def test_lru_eviction_respects_pins(self):
+        cache = PrefixCache(self.config)
+        self.model.generate(self.input_ids, max_length=1, temperature=0.0, decoder_input_ids=self.template, prefix_cache=cache)
+        template_bytes = cache.stats()['bytes_used']
+        pinned = cache.lookup(self.input_ids, self.template)
+        self.assertEqual(pinned.length, self.template.size(1) - 1)
+
+        # Over budget, the pinned (and least recently used) template must survive the newer prompt
+        cache.max_bytes = template_bytes
+        other = self.template.clone()
+        other[:, 0] = self.config.bos_token_id
+        self.model.generate(self.input_ids, max_length=1, temperature=0.0, decoder_input_ids=other, prefix_cache=cache)
+        stats = cache.stats()
+        self.assertGreater(stats['evictions'], 0)
+        self.assertEqual(stats['bytes_used'], template_bytes)
+        lookup = cache.lookup(self.input_ids, self.template)
+        self.assertEqual(lookup.length, pinned.length)
+        cache.release(lookup)
+
+        # Once unpinned it is evictable like any other entry
+        cache.max_bytes = 0
+        cache.release(pinned)
+        self.assertEqual(cache.stats()['bytes_used'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import json
+import unittest
+import tempfile
+import torch
+from model import LuminaLM, LuminaLMConfig
+from profiling import ModuleProfiler
+
+
+class TestModuleProfiler(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        config = LuminaLMConfig(
+            n_embd=16, n_head=2, n_encoder_layers=2, n_decoder_layers=2,
+            block_size=32, max_position_embeddings=32, vocab_size=32, use_checkpoint=False
+        )
+        self.model = LuminaLM(config).train()
+        self.input_ids = torch.randint(3, config.vocab_size, (2, 8))
+
+    def _step(self):
+        self.model(input_ids=self.input_ids, decoder_input_ids=self.input_ids).sum().backward()
+
+    def test_records_every_module_type(self):
+        with ModuleProfiler(self.model) as profiler:
+            self._step()
+        summary = profiler.summary()
+        self.assertEqual(set(summary), {'EncoderBlock', 'DecoderBlock', 'FlashAttention', 'FeedForward', 'lm_head'})
+        self.assertEqual(summary['EncoderBlock']['calls'], 2)
+        self.assertEqual(summary['FlashAttention']['calls'], 6)
+        self.assertGreater(summary['DecoderBlock']['backward_s'], 0.0)
+        # Block FLOPs include their attention and feed-forward children
+        children = summary['FlashAttention']['flops'] + summary['FeedForward']['flops']
+        self.assertEqual(summary['EncoderBlock']['flops'] + summary['DecoderBlock']['flops'], children)
+
+    def test_detached_model_has_no_hooks(self):
+        profiler = ModuleProfiler(self.model).attach()
+        profiler.detach()
+        for module in self.model.modules():
+            self.assertFalse(module._forward_hooks)
+            self.assertFalse(module._forward_pre_hooks)
+            self.assertFalse(module._backward_hooks)
+        self._step()
+        self.assertEqual(profiler.events, [])
+
+    def test_schedule_limits_recording(self):
+        schedule = torch.profiler.schedule(wait=1, warmup=0, active=1, repeat=1)
+        with ModuleProfiler(self.model, record_backward=False, schedule=schedule) as profiler:
+            for _ in range(3):
+                self._step()
+                profiler.step()
+        self.assertEqual({event['step'] for event in profiler.events}, {1})
+
+    def test_chrome_trace_export(self):
+        with ModuleProfiler(self.model) as profiler:
+            self._step()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.json")
+            profiler.export_chrome_trace(path)
+            with open(path) as f:
+                trace = json.load(f)
+        self.assertEqual(len(trace['traceEvents']), len(profiler.events))
+        self.assertTrue(all(event['ph'] == 'X' for event in trace['traceEvents']))
+
+
+if __name__ == '__main__':
+    unittest.main()
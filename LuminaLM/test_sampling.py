@@ -0,0 +1,111 @@
+import unittest
+import torch
+from model import LuminaLM
+from sampling import (
+    SamplingParams,
+    apply_repetition_penalty,
+    block_repeated_ngrams,
+    top_k_top_p_candidates,
+    sample_next_token
+)
+
+
+class TestSamplingParams(unittest.TestCase):
+    def test_scalar_broadcast(self):
+        params = SamplingParams.from_values(3, temperature=0.7, top_k=5)
+        self.assertEqual(params.temperature.shape, (3,))
+        self.assertTrue(torch.all(params.top_k == 5))
+        self.assertTrue(torch.all(params.top_p == 1.0))
+
+    def test_invalid_values(self):
+        with self.assertRaises(ValueError):
+            SamplingParams.from_values(2, top_p=0.0)
+        with self.assertRaises(ValueError):
+            SamplingParams.from_values(2, temperature=torch.tensor([1.0, 1.0, 1.0]))
+
+    def test_cat_and_select(self):
+        a = SamplingParams.from_values(2, temperature=0.0)
+        b = SamplingParams.from_values(1, temperature=1.0, top_k=3)
+        merged = SamplingParams.cat([a, b])
+        self.assertEqual(merged.top_k.tolist(), [0, 0, 3])
+        self.assertEqual(merged.select(torch.tensor([2])).top_k.tolist(), [3])
+
+
+class TestLogitsProcessors(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.logits = torch.randn(4, 500)
+
+    def test_candidates_match_full_sort_filters(self):
+        for top_k, top_p in [(10, 1.0), (0, 0.5), (20, 0.3)]:
+            reference = self.logits.clone()
+            if top_k:
+                reference = LuminaLM.top_k_filtering(reference, top_k)
+            if top_p < 1.0:
+                reference = LuminaLM.top_p_filtering(reference, top_p)
+            values, index = top_k_top_p_candidates(
+                self.logits,
+                torch.full((4,), top_k, dtype=torch.long),
+                torch.full((4,), top_p)
+            )
+            for row in range(4):
+                expected = set(torch.isfinite(reference[row]).nonzero().flatten().tolist())
+                kept = set(index[row][torch.isfinite(values[row])].tolist())
+                self.assertEqual(kept, expected)
+
+    def test_partial_selection_width(self):
+        values, _ = top_k_top_p_candidates(self.logits, torch.full((4,), 7), torch.ones(4))
+        self.assertEqual(values.shape, (4, 7))
+
+    def test_repetition_penalty(self):
+        logits = torch.tensor([[2.0, -2.0, 1.0]])
+        out = apply_repetition_penalty(logits, torch.tensor([[0, 1]]), torch.tensor([2.0]))
+        torch.testing.assert_close(out, torch.tensor([[1.0, -4.0, 1.0]]))
+
+    def test_ngram_blocking(self):
+        logits = torch.zeros(2, 6)
+        input_ids = torch.tensor([[1, 2, 3, 1, 2], [1, 2, 3, 1, 2]])
+        out = block_repeated_ngrams(logits, input_ids, torch.tensor([3, 0]))
+        self.assertEqual(out[0, 3].item(), float('-inf'))
+        self.assertEqual(torch.isinf(out[0]).sum().item(), 1)
+        self.assertFalse(torch.isinf(out[1]).any())
+
+
+class TestSampleNextToken(unittest.TestCase):
+    def test_greedy_rows_use_argmax(self):
+        torch.manual_seed(0)
+        logits = torch.randn(3, 100)
+        params = SamplingParams.from_values(3, temperature=0.0)
+        torch.testing.assert_close(sample_next_token(logits, params), logits.argmax(-1))
+
+    def test_mixed_batch(self):
+        torch.manual_seed(0)
+        logits = torch.randn(3, 100)
+        params = SamplingParams.from_values(
+            3,
+            temperature=torch.tensor([0.0, 1.0, 1.0]),
+            top_k=torch.tensor([0, 1, 0]),
+            top_p=torch.tensor([1.0, 1.0, 1e-6])
+        )
+        next_tokens = sample_next_token(logits, params)
+        torch.testing.assert_close(next_tokens, logits.argmax(-1))
+
+    def test_candidate_view(self):
+        logits = torch.tensor([[0.5, 3.0, float('-inf')]])
+        candidate_ids = torch.tensor([[10, 42, 0]])
+        params = SamplingParams.from_values(1, temperature=1.0, top_k=1)
+        self.assertEqual(sample_next_token(logits, params, candidate_ids=candidate_ids).item(), 42)
+
+    def test_row_without_allowed_tokens_falls_back_to_argmax(self):
+        logits = torch.tensor([[1.0, 4.0, 2.0], [0.0, 1.0, 5.0]])
+        input_ids = torch.tensor([[0, 1, 2], [2, 1, 2]])
+        # Unigram blocking bans every token of the first row
+        params = SamplingParams.from_values(2, temperature=1.0, top_k=2, no_repeat_ngram_size=torch.tensor([1, 0]))
+        self.assertEqual(sample_next_token(logits, params, input_ids=input_ids)[0].item(), 1)
+        masked = torch.full((2, 3), float('-inf'))
+        masked[1, 2] = 0.0
+        self.assertEqual(sample_next_token(masked, params).tolist(), [0, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
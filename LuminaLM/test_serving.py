@@ -0,0 +1,104 @@
+import unittest
+import threading
+import time
+import torch
+import torch.nn as nn
+from serving import GenerationService
+
+
+class _CountingModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.weight = nn.Parameter(torch.ones(2))
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def generate(self, input_ids, max_length, temperature=1.0, generator=None):
+        self.calls += 1
+        self.release.wait(timeout=5)
+        noise = torch.randint(0, 100, input_ids.shape, generator=generator)
+        return input_ids + max_length + (noise if temperature else 0)
+
+
+class TestGenerationService(unittest.TestCase):
+    def setUp(self):
+        self.model = _CountingModel().eval()
+        self.now = 0.0
+        self.service = GenerationService(self.model, ttl_seconds=10.0, clock=lambda: self.now)
+        self.input_ids = torch.tensor([[5, 6, 7]])
+
+    def test_greedy_results_are_cached(self):
+        first = self.service.generate(self.input_ids, max_length=4, temperature=0.0)
+        second = self.service.generate(self.input_ids, max_length=4, temperature=0.0)
+        torch.testing.assert_close(first, second)
+        self.assertEqual(self.model.calls, 1)
+        stats = self.service.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertAlmostEqual(stats['hit_ratio'], 0.5)
+        self.assertEqual(stats['bytes_used'], first.numel() * first.element_size())
+
+    def test_different_params_miss(self):
+        self.service.generate(self.input_ids, max_length=4, temperature=0.0)
+        self.service.generate(self.input_ids, max_length=5, temperature=0.0)
+        self.assertEqual(self.model.calls, 2)
+
+    def test_ttl_expiry(self):
+        self.service.generate(self.input_ids, max_length=4, temperature=0.0)
+        self.now = 11.0
+        self.service.generate(self.input_ids, max_length=4, temperature=0.0)
+        self.assertEqual(self.model.calls, 2)
+
+    def test_fixed_seed_is_cached_and_sampling_bypasses(self):
+        seeded = self.service.generate(self.input_ids, seed=3, max_length=4)
+        torch.testing.assert_close(self.service.generate(self.input_ids, seed=3, max_length=4), seeded)
+        self.service.generate(self.input_ids, max_length=4)
+        self.assertEqual(self.model.calls, 2)
+        self.assertEqual(self.service.stats()['bypassed'], 1)
+
+    def test_train_mode_bypasses(self):
+        self.model.train()
+        self.service.generate(self.input_ids, max_length=4, temperature=0.0)
+        self.service.generate(self.input_ids, seed=3, max_length=4)
+        self.assertEqual(self.service.stats()['bypassed'], 2)
+        self.assertEqual(self.service.stats()['bytes_used'], 0)
+
+    def test_seed_is_keyword_only(self):
+        with self.assertRaises(TypeError):
+            self.service.generate(self.input_ids, 32)
+
+    def test_lru_bound(self):
+        service = GenerationService(self.model, max_entries=1)
+        service.generate(self.input_ids, max_length=1, temperature=0.0)
+        service.generate(self.input_ids, max_length=2, temperature=0.0)
+        service.generate(self.input_ids, max_length=1, temperature=0.0)
+        self.assertEqual(self.model.calls, 3)
+        self.assertEqual(service.stats()['entries'], 1)
+
+    def test_concurrent_identical_requests_share_one_decode(self):
+        self.model.release.clear()
+        results = []
+
+        def request():
+            results.append(self.service.generate(self.input_ids, max_length=4, temperature=0.0))
+
+        threads = [threading.Thread(target=request) for _ in range(4)]
+        threads[0].start()
+        while not self.service._inflight:
+            time.sleep(0.01)
+        for thread in threads[1:]:
+            thread.start()
+        while self.service.stats()['coalesced'] < 3:
+            time.sleep(0.01)
+        self.model.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.model.calls, 1)
+        self.assertEqual(len(results), 4)
+        for result in results[1:]:
+            torch.testing.assert_close(result, results[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
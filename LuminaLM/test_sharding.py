@@ -0,0 +1,130 @@
+import os
+import tempfile
+import unittest
+import torch
+import torch.nn as nn
+from distributed import DistributedConfig, init_distributed, cleanup_distributed, wrap_model, reduce_mean, spawn_local
+from model import LuminaLM, LuminaLMConfig
+from sharding import build_optimizer, gather_full_state, local_state_bytes
+from training_state import AsyncCheckpointer
+
+WORLD_SIZE = 2
+CONFIG = LuminaLMConfig(
+    n_embd=16, n_head=2, n_encoder_layers=2, n_decoder_layers=2,
+    block_size=32, max_position_embeddings=32, vocab_size=32
+)
+FSDP_CONFIG = LuminaLMConfig(
+    n_embd=16, n_head=2, n_encoder_layers=2, n_decoder_layers=2,
+    block_size=32, max_position_embeddings=32, vocab_size=32, embd_pdrop=0.0, resid_pdrop=0.0, attn_pdrop=0.0
+)
+
+
+def _zero_step(rank: int, world_size: int, output_dir: str) -> None:
+    device = init_distributed("gloo")
+    torch.manual_seed(0)
+    model = wrap_model(LuminaLM(CONFIG), device, DistributedConfig(sharding="zero1"))
+    optimizer = build_optimizer(model, "zero1", lr=1e-3)
+    input_ids = torch.randint(3, CONFIG.vocab_size, (2, 8))
+    model(input_ids=input_ids, decoder_input_ids=input_ids).sum().backward()
+    optimizer.step()
+    model_state, optimizer_state = gather_full_state(model, optimizer)
+    torch.save({
+        'bytes': local_state_bytes(model, optimizer),
+        'model_state': model_state,
+        'optimizer_state': optimizer_state,
+    }, os.path.join(output_dir, f"rank{rank}.pt"))
+    cleanup_distributed()
+
+
+def _rank_batches(rank: int):
+    generator = torch.Generator().manual_seed(rank)
+    return [torch.randint(3, FSDP_CONFIG.vocab_size, (2, 8), generator=generator) for _ in range(2)]
+
+
+def _loss(model, input_ids):
+    logits = model(input_ids=input_ids, decoder_input_ids=input_ids)
+    return nn.functional.cross_entropy(logits.view(-1, logits.size(-1)), input_ids.view(-1))
+
+
+def _train(model, optimizer, input_ids) -> float:
+    optimizer.zero_grad()
+    loss = _loss(model, input_ids)
+    loss.backward()
+    optimizer.step()
+    return loss.item()
+
+
+def _fsdp_steps(rank: int, world_size: int, sharding: str, output_dir: str) -> None:
+    device = init_distributed("gloo")
+    torch.manual_seed(0)
+    model = wrap_model(LuminaLM(FSDP_CONFIG), device, DistributedConfig(sharding=sharding))
+    optimizer = build_optimizer(model, sharding, lr=1e-3)
+    checkpointer = AsyncCheckpointer(os.path.join(output_dir, "checkpoints"))
+    first, second = _rank_batches(rank)
+    losses = [reduce_mean(_train(model, optimizer, first), device)]
+    checkpointer.save(1, model, optimizer)
+    losses.append(reduce_mean(_train(model, optimizer, second), device))
+    model_state, _ = gather_full_state(model, optimizer)
+
+    # Redo the second step from the sharded checkpoint
+    checkpointer.wait()
+    checkpointer.load(None, model, optimizer)
+    resumed_loss = reduce_mean(_train(model, optimizer, second), device)
+    resumed_state, _ = gather_full_state(model, optimizer)
+    checkpointer.close()
+    torch.save({
+        'losses': losses,
+        'resumed_loss': resumed_loss,
+        'model_state': model_state,
+        'resumed_state': resumed_state,
+    }, os.path.join(output_dir, f"rank{rank}.pt"))
+    cleanup_distributed()
+
+
+class TestZeroRedundancy(unittest.TestCase):
+    def test_optimizer_state_is_partitioned(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            spawn_local(_zero_step, WORLD_SIZE, output_dir)
+            results = [torch.load(os.path.join(output_dir, f"rank{rank}.pt")) for rank in range(WORLD_SIZE)]
+
+        n_params = sum(p.numel() for p in LuminaLM(CONFIG).parameters())
+        full_state_bytes = 2 * 4 * n_params
+        for result in results:
+            # AdamW keeps two fp32 moments; each rank holds only its partition
+            self.assertLess(result['bytes']['optimizer_state_bytes'], full_state_bytes)
+        self.assertEqual(sum(r['bytes']['optimizer_state_bytes'] for r in results), full_state_bytes)
+
+        # The full states are gathered on rank 0 only
+        self.assertIsNone(results[1]['model_state'])
+        self.assertEqual(set(results[0]['model_state']), set(LuminaLM(CONFIG).state_dict()))
+        self.assertEqual(len(results[0]['optimizer_state']['state']), len(list(LuminaLM(CONFIG).parameters())))
+
+
+class TestFullyShardedDataParallel(unittest.TestCase):
+    def test_matches_single_process_and_resumes(self):
+        torch.manual_seed(0)
+        reference = LuminaLM(FSDP_CONFIG)
+        optimizer = torch.optim.AdamW(reference.parameters(), lr=1e-3)
+        reference_losses = []
+        for batches in zip(*(_rank_batches(rank) for rank in range(WORLD_SIZE))):
+            # Equal local batches, so the mean of the rank losses is the loss of the whole batch
+            optimizer.zero_grad()
+            loss = sum(_loss(reference, input_ids) for input_ids in batches) / WORLD_SIZE
+            loss.backward()
+            optimizer.step()
+            reference_losses.append(loss.item())
+
+        for sharding in ("fsdp", "fsdp_grad_op"):
+            with self.subTest(sharding=sharding), tempfile.TemporaryDirectory() as output_dir:
+                spawn_local(_fsdp_steps, WORLD_SIZE, sharding, output_dir)
+                result = torch.load(os.path.join(output_dir, "rank0.pt"))
+                for loss, reference_loss in zip(result['losses'], reference_losses):
+                    self.assertAlmostEqual(loss, reference_loss, places=5)
+                self.assertAlmostEqual(result['resumed_loss'], result['losses'][1], places=6)
+                for name, tensor in reference.state_dict().items():
+                    torch.testing.assert_close(result['model_state'][name], tensor, rtol=1e-4, atol=1e-5, msg=name)
+                    torch.testing.assert_close(result['resumed_state'][name], result['model_state'][name], msg=name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+from model import LuminaLMConfig
+from tensor_parallel import run_parity_check
+
+
+class TestTensorParallel(unittest.TestCase):
+    def test_matches_single_process_model(self):
+        config = LuminaLMConfig(
+            n_embd=16, n_head=2, n_encoder_layers=2, n_decoder_layers=2,
+            block_size=32, max_position_embeddings=32, vocab_size=32
+        )
+        report = run_parity_check(config, world_size=2)
+        self.assertLess(report['max_logits_diff'], 1e-5)
+        self.assertLess(report['loss_diff'], 1e-5)
+        self.assertLess(report['max_grad_diff'], 1e-5)
+        self.assertTrue(report['generation_matches'])
+
+    def test_untied_head(self):
+        config = LuminaLMConfig(
+            n_embd=16, n_head=4, n_encoder_layers=1, n_decoder_layers=1,
+            block_size=32, max_position_embeddings=32, vocab_size=32, shared_embeddings=False
+        )
+        report = run_parity_check(config, world_size=4)
+        self.assertLess(report['max_grad_diff'], 1e-5)
+        self.assertTrue(report['generation_matches'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from datasets import Dataset
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import WhitespaceSplit
+from token_cache import TokenCacheDataset, build_token_cache, load_or_build_token_cache
+
+WORDS = ["[PAD]", "[UNK]", "question:", "context:", "what", "is", "insulin", "a", "hormone", "made", "by", "pancreas"]
+
+
+def _tokenizer() -> Tokenizer:
+    tokenizer = Tokenizer(WordLevel({word: idx for idx, word in enumerate(WORDS)}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = WhitespaceSplit()
+    return tokenizer
+
+
+def _dataset() -> Dataset:
+    return Dataset.from_dict({
+        "question": ["what is insulin", "what is a pancreas", "what"],
+        "context": ["insulin is a hormone made by pancreas", "pancreas", ""],
+        "answers": [{"text": ["a hormone"]}, {"text": []}, {"text": ["insulin"]}],
+    })
+
+
+class TestTokenCache(unittest.TestCase):
+    def test_matches_per_example_encoding(self):
+        tokenizer, dataset = _tokenizer(), _dataset()
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for num_proc in (1, 2):
+                path = build_token_cache(dataset, tokenizer, os.path.join(cache_dir, str(num_proc)), block_size=6,
+                                         num_proc=num_proc, chunk_size=2)
+                cache = TokenCacheDataset(path)
+                self.assertEqual(len(cache), 3)
+                self.assertEqual(cache[0]['input_ids'].dtype, np.uint16)
+                for idx in range(3):
+                    example = dataset[idx]
+                    text = "question: " + example["question"] + " context: " + example["context"]
+                    self.assertEqual(cache[idx]['input_ids'].tolist(), tokenizer.encode(text).ids[:6])
+                self.assertEqual(cache[0]['decoder_input_ids'].tolist(), tokenizer.encode("a hormone").ids)
+                # Unanswered examples get a single pad token
+                self.assertEqual(cache[1]['decoder_input_ids'].tolist(), [0])
+                self.assertEqual(cache.lengths().tolist(), [6, 6, 3])
+
+    def test_multiple_targets(self):
+        tokenizer = _tokenizer()
+        dataset = Dataset.from_dict({
+            "question": ["what is insulin", "what"],
+            "context": ["insulin is a hormone", ""],
+            "answers": [{"text": ["a hormone", "hormone", "a hormone"]}, {"text": []}],
+        })
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = load_or_build_token_cache(dataset, tokenizer, cache_dir, block_size=8, max_targets=4)
+            self.assertEqual(cache.num_targets().tolist(), [2, 1])
+            self.assertEqual([target.tolist() for target in cache[0]['targets']], [[7, 8], [8]])
+            self.assertEqual(cache[0]['decoder_input_ids'].tolist(), [7, 8])
+            self.assertEqual(cache[1]['targets'][0].tolist(), [0])
+            self.assertEqual(cache.lengths("decoder_input_ids").tolist(), [2, 1])
+            self.assertEqual(cache.lengths("targets").tolist(), [3, 1])
+            single = load_or_build_token_cache(dataset, tokenizer, cache_dir, block_size=8)
+            self.assertNotEqual(single.path, cache.path)
+            self.assertNotIn('targets', single[0])
+            self.assertEqual(single.lengths("targets").tolist(), single.lengths("decoder_input_ids").tolist())
+
+    def test_cache_is_reused_until_inputs_change(self):
+        tokenizer, dataset = _tokenizer(), _dataset()
+        with tempfile.TemporaryDirectory() as cache_dir:
+            first = load_or_build_token_cache(dataset, tokenizer, cache_dir, block_size=8, source="qa/train")
+            again = load_or_build_token_cache(dataset, tokenizer, cache_dir, block_size=8, source="qa/train")
+            self.assertEqual(first.path, again.path)
+            other = load_or_build_token_cache(dataset, tokenizer, cache_dir, block_size=4, source="qa/train")
+            self.assertNotEqual(first.path, other.path)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
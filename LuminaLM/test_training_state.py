@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+import torch
+import torch.nn as nn
+from torch.utils.data.distributed import DistributedSampler
+from transformers import get_linear_schedule_with_warmup
+from model import LuminaLM, LuminaLMConfig
+from training_state import AsyncCheckpointer, ResumableSampler, complete_checkpoints, latest_checkpoint
+
+CONFIG = LuminaLMConfig(
+    n_embd=16, n_head=2, n_encoder_layers=1, n_decoder_layers=1,
+    block_size=32, max_position_embeddings=32, vocab_size=32
+)
+DATA = torch.randint(3, CONFIG.vocab_size, (24, 8), generator=torch.Generator().manual_seed(0))
+BATCH_SIZE = 4
+
+
+def _build():
+    torch.manual_seed(0)
+    model = LuminaLM(CONFIG)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+    scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=2, num_training_steps=12)
+    sampler = ResumableSampler(DistributedSampler(range(len(DATA)), num_replicas=1, rank=0, shuffle=True, seed=1))
+    return model, optimizer, scheduler, sampler
+
+
+def _train(model, optimizer, scheduler, sampler, epoch, start_batch=0, stop_after=None, checkpointer=None):
+    """Train one epoch; dropout keeps the RNG state relevant."""
+    sampler.set_epoch(epoch)
+    sampler.skip_samples(start_batch * BATCH_SIZE)
+    indices = list(sampler)
+    for batch_idx, offset in enumerate(range(0, len(indices), BATCH_SIZE), start=start_batch):
+        batch = DATA[indices[offset:offset + BATCH_SIZE]]
+        logits = model(input_ids=batch, decoder_input_ids=batch)
+        loss = nn.functional.cross_entropy(logits.view(-1, logits.size(-1)), batch.view(-1))
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        scheduler.step()
+        if checkpointer is not None and checkpointer.should_save(scheduler.last_epoch):
+            checkpointer.save(scheduler.last_epoch, model, optimizer, scheduler, epoch=epoch, batch_in_epoch=batch_idx + 1)
+        if stop_after is not None and scheduler.last_epoch == stop_after:
+            return
+
+
+class TestResumableSampler(unittest.TestCase):
+    def test_skips_once(self):
+        sampler = ResumableSampler(DistributedSampler(range(10), num_replicas=1, rank=0, shuffle=True, seed=0))
+        order = list(sampler)
+        sampler.skip_samples(4)
+        self.assertEqual(len(sampler), 6)
+        self.assertEqual(list(sampler), order[4:])
+        self.assertEqual(list(sampler), order)
+
+
+class TestAsyncCheckpointer(unittest.TestCase):
+    def test_resume_matches_uninterrupted_training(self):
+        model, optimizer, scheduler, sampler = _build()
+        for epoch in range(2):
+            _train(model, optimizer, scheduler, sampler, epoch)
+        expected = model.state_dict()
+
+        with tempfile.TemporaryDirectory() as directory:
+            # Preempted in the middle of the second epoch, after the step 8 checkpoint
+            checkpointer = AsyncCheckpointer(directory, interval_steps=2, keep_last=2)
+            model, optimizer, scheduler, sampler = _build()
+            _train(model, optimizer, scheduler, sampler, 0, checkpointer=checkpointer)
+            _train(model, optimizer, scheduler, sampler, 1, stop_after=9, checkpointer=checkpointer)
+            checkpointer.close()
+
+            checkpoints = complete_checkpoints(directory)
+            self.assertEqual([os.path.basename(path) for path in checkpoints], ["step_00000006", "step_00000008"])
+            self.assertFalse(any(name.endswith(".tmp") for name in os.listdir(checkpoints[-1])))
+
+            model, optimizer, scheduler, sampler = _build()
+            resumed = AsyncCheckpointer(directory).load(None, model, optimizer, scheduler)
+            self.assertEqual((resumed['step'], resumed['epoch'], resumed['batch_in_epoch']), (8, 1, 2))
+            self.assertEqual(latest_checkpoint(directory), checkpoints[-1])
+            _train(model, optimizer, scheduler, sampler, resumed['epoch'], start_batch=resumed['batch_in_epoch'])
+
+        for name, tensor in model.state_dict().items():
+            torch.testing.assert_close(tensor, expected[name], msg=name)
+
+
+if __name__ == '__main__':
+    unittest.main()
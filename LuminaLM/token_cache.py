@@ -0,0 +1,303 @@
+"""
+Pre-tokenized, memory-mapped dataset cache for LuminaLM training.
+
+`build_token_cache` tokenizes a QA dataset once with batched
+`Tokenizer.encode_batch` calls, optionally spread over worker processes.
+Inputs and targets are written as flat uint16 (or uint32 for large
+vocabularies) token arrays plus int64 offsets:
+
+    <cache_dir>/<key>/input_ids.bin, input_offsets.npy,
+                      decoder_input_ids.bin, decoder_offsets.npy, meta.json
+
+With max_targets > 1, every distinct answer of an example (up to max_targets)
+is kept as its own decoder sequence, and target_offsets.npy maps examples to
+their range of decoder sequences (see multi_target.py).
+
+The key hashes the tokenizer, block_size, pad token, max_targets and the
+source dataset's fingerprint, so a changed tokenizer or corpus gets a new
+cache. Each cache is
+written to a temporary directory and renamed into place when complete.
+
+`TokenCacheDataset` opens a cache in O(1) with np.memmap; examples are
+zero-copy slices of the mapped arrays, so startup time does not depend on the
+corpus size.
+
+Usage:
+    python token_cache.py --config_path config.yaml --tokenizer Medical_tokenizer.json --num_proc 8
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+import numpy as np
+import yaml
+from multiprocessing import Pool
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from torch.utils.data import Dataset
+from tokenizers import Tokenizer
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+FIELDS = ("input_ids", "decoder_input_ids")
+_OFFSETS = {"input_ids": "input_offsets.npy", "decoder_input_ids": "decoder_offsets.npy"}
+_TARGET_OFFSETS = "target_offsets.npy"
+
+_worker_tokenizer: Optional[Tokenizer] = None
+
+
+def format_qa_examples(examples: Dict[str, List[Any]]) -> Tuple[List[str], List[Optional[str]]]:
+    """Encoder input and target texts of a batch of QA examples; None marks an example without an answer."""
+    inputs = ["question: " + q + " context: " + c for q, c in zip(examples["question"], examples["context"])]
+    targets = [answer["text"][0] if len(answer["text"]) > 0 else None for answer in examples["answers"]]
+    return inputs, targets
+
+
+def format_qa_targets(examples: Dict[str, List[Any]], max_targets: int) -> List[List[str]]:
+    """Distinct answers of a batch of QA examples, at most max_targets per example, in their original order."""
+    return [list(dict.fromkeys(answer["text"]))[:max_targets] for answer in examples["answers"]]
+
+
+def cache_key(tokenizer: Tokenizer, block_size: int, pad_token_id: int, source_fingerprint: str, max_targets: int = 1) -> str:
+    """Hash of everything the cached token arrays depend on."""
+    digest = hashlib.sha256()
+    parts = [str(CACHE_VERSION), tokenizer.to_str(), str(block_size), str(pad_token_id), source_fingerprint]
+    if max_targets > 1:
+        parts.append(f"max_targets={max_targets}")
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:24]
+
+
+def token_dtype(vocab_size: int) -> np.dtype:
+    return np.dtype(np.uint16) if vocab_size <= np.iinfo(np.uint16).max + 1 else np.dtype(np.uint32)
+
+
+def _init_worker(tokenizer_json: str) -> None:
+    global _worker_tokenizer
+    _worker_tokenizer = Tokenizer.from_str(tokenizer_json)
+
+
+def _encode_chunk(
+    args: Tuple[Dict[str, List[Any]], int, int, int, Optional[Tokenizer]]
+) -> Tuple[List[List[int]], List[List[int]], List[int]]:
+    examples, block_size, pad_token_id, max_targets, tokenizer = args
+    tokenizer = tokenizer or _worker_tokenizer
+    inputs, _ = format_qa_examples(examples)
+    input_ids = [encoding.ids[:block_size] for encoding in tokenizer.encode_batch(inputs)]
+    targets = format_qa_targets(examples, max_targets)
+    answers = [text for texts in targets for text in texts]
+    encoded = iter(tokenizer.encode_batch(answers)) if answers else iter(())
+    target_ids, target_counts = [], []
+    for texts in targets:
+        # Unanswered examples get a single pad token as target
+        target_ids.extend([next(encoded).ids[:block_size] for _ in texts] or [[pad_token_id]])
+        target_counts.append(max(len(texts), 1))
+    return input_ids, target_ids, target_counts
+
+
+def build_token_cache(
+    dataset: Any,
+    tokenizer: Tokenizer,
+    path: str,
+    block_size: int,
+    pad_token_id: int = 0,
+    num_proc: int = 1,
+    chunk_size: int = 1000,
+    metadata: Optional[Dict[str, Any]] = None,
+    max_targets: int = 1
+) -> str:
+    """
+    Tokenize dataset into a token cache directory at path.
+
+    Args:
+        dataset (Any): Sliceable QA dataset (e.g. datasets.Dataset) with question, context and answers columns.
+        tokenizer (Tokenizer): Tokenizer used for inputs and targets.
+        path (str): Cache directory to create.
+        block_size (int): Maximum tokens kept per input and per target.
+        pad_token_id (int): Target of examples without an answer.
+        num_proc (int): Tokenizer processes; 1 tokenizes in this process.
+        chunk_size (int): Examples per encode_batch call.
+        metadata (Optional[Dict[str, Any]]): Extra fields stored in meta.json.
+        max_targets (int): Distinct answers kept per example; above 1, target_offsets.npy is written.
+
+    Returns:
+        str: path.
+    """
+    dtype = token_dtype(tokenizer.get_vocab_size())
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    def chunks() -> Iterator[Tuple[Dict[str, List[Any]], int, int, int, Optional[Tokenizer]]]:
+        for start in range(0, len(dataset), chunk_size):
+            # Workers load their own tokenizer; in-process encoding passes this one
+            yield dataset[start:start + chunk_size], block_size, pad_token_id, max_targets, None if num_proc > 1 else tokenizer
+
+    lengths = {field: [] for field in FIELDS}
+    target_counts = []
+    files = {field: open(os.path.join(tmp_path, f"{field}.bin"), 'wb') for field in FIELDS}
+    pool = Pool(num_proc, initializer=_init_worker, initargs=(tokenizer.to_str(),)) if num_proc > 1 else None
+    try:
+        results = pool.imap(_encode_chunk, chunks()) if pool is not None else map(_encode_chunk, chunks())
+        for encoded in results:
+            target_counts.extend(encoded[2])
+            for field, sequences in zip(FIELDS, encoded):
+                lengths[field].extend(len(ids) for ids in sequences)
+                flat = np.fromiter((token for ids in sequences for token in ids), dtype=dtype)
+                files[field].write(flat.tobytes())
+    finally:
+        for f in files.values():
+            f.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    for field in FIELDS:
+        offsets = np.zeros(len(lengths[field]) + 1, dtype=np.int64)
+        np.cumsum(lengths[field], out=offsets[1:])
+        np.save(os.path.join(tmp_path, _OFFSETS[field]), offsets)
+    if max_targets > 1:
+        target_offsets = np.zeros(len(target_counts) + 1, dtype=np.int64)
+        np.cumsum(target_counts, out=target_offsets[1:])
+        np.save(os.path.join(tmp_path, _TARGET_OFFSETS), target_offsets)
+    with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+        json.dump({
+            'version': CACHE_VERSION,
+            'dtype': dtype.name,
+            'num_examples': len(lengths["input_ids"]),
+            'num_targets': len(lengths["decoder_input_ids"]),
+            'max_targets': max_targets,
+            'num_tokens': {field: int(sum(lengths[field])) for field in FIELDS},
+            'block_size': block_size,
+            **(metadata or {}),
+        }, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote token cache with {len(lengths['input_ids'])} examples to {path}")
+    return path
+
+
+class TokenCacheDataset(Dataset):
+    """
+    Memory-mapped view of a token cache; examples are arrays of token ids.
+
+    decoder_input_ids holds the first target of an example; caches built with max_targets > 1
+    also return every target of the example under targets.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        dtype = np.dtype(self.meta['dtype'])
+        self.tokens = {
+            field: np.memmap(os.path.join(path, f"{field}.bin"), dtype=dtype, mode='r')
+            if self.meta['num_tokens'][field] > 0 else np.zeros(0, dtype=dtype)
+            for field in FIELDS
+        }
+        self.offsets = {field: np.load(os.path.join(path, _OFFSETS[field]), mmap_mode='r') for field in FIELDS}
+        target_offsets_path = os.path.join(path, _TARGET_OFFSETS)
+        self.target_offsets = np.load(target_offsets_path, mmap_mode='r') if os.path.exists(target_offsets_path) else None
+
+    def __len__(self) -> int:
+        return self.meta['num_examples']
+
+    def lengths(self, field: str = "input_ids") -> np.ndarray:
+        """
+        Token count of every example (of its first target), without touching the token arrays.
+
+        field "targets" counts the tokens of all targets of every example.
+        """
+        if field == "targets":
+            lengths = np.diff(self.offsets["decoder_input_ids"])
+            return lengths if self.target_offsets is None else np.add.reduceat(lengths, self.target_offsets[:-1])
+        lengths = np.diff(self.offsets[field])
+        if field == "decoder_input_ids" and self.target_offsets is not None:
+            return lengths[self.target_offsets[:-1]]
+        return lengths
+
+    def num_targets(self) -> np.ndarray:
+        """Number of targets of every example."""
+        if self.target_offsets is None:
+            return np.ones(len(self), dtype=np.int64)
+        return np.diff(self.target_offsets)
+
+    def _sequence(self, field: str, idx: int) -> np.ndarray:
+        return self.tokens[field][self.offsets[field][idx]:self.offsets[field][idx + 1]]
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        if idx < 0:
+            idx += len(self)
+        if self.target_offsets is None:
+            return {field: self._sequence(field, idx) for field in FIELDS}
+        targets = [
+            self._sequence("decoder_input_ids", target)
+            for target in range(self.target_offsets[idx], self.target_offsets[idx + 1])
+        ]
+        return {'input_ids': self._sequence("input_ids", idx), 'decoder_input_ids': targets[0], 'targets': targets}
+
+
+def load_or_build_token_cache(
+    dataset: Any,
+    tokenizer: Tokenizer,
+    cache_dir: str,
+    block_size: int,
+    pad_token_id: int = 0,
+    source: str = "",
+    num_proc: int = 1,
+    max_targets: int = 1
+) -> TokenCacheDataset:
+    """
+    Open the token cache of dataset, building it first if this tokenizer, block_size and source have none.
+
+    Args:
+        source (str): Name of the source, e.g. "squad/train"; combined with the dataset's
+            fingerprint (datasets.Dataset._fingerprint) when it has one.
+        max_targets (int): Distinct answers kept per example.
+    """
+    fingerprint = f"{source}:{getattr(dataset, '_fingerprint', len(dataset))}"
+    path = os.path.join(cache_dir, cache_key(tokenizer, block_size, pad_token_id, fingerprint, max_targets))
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        logger.info(f"Tokenizing {source or 'dataset'} into {path}")
+        build_token_cache(
+            dataset, tokenizer, path, block_size, pad_token_id, num_proc, metadata={'source': fingerprint},
+            max_targets=max_targets
+        )
+    return TokenCacheDataset(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the token caches of the LuminaLM QA training mixture.")
+    parser.add_argument("--config_path", type=str, required=True, help="Path to configuration YAML file.")
+    parser.add_argument("--tokenizer", type=str, default="Medical_tokenizer.json")
+    parser.add_argument("--num_proc", type=int, default=os.cpu_count())
+    parser.add_argument("--max_targets", type=int, default=1, help="Distinct answers kept per example.")
+    args = parser.parse_args()
+
+    from datasets import load_dataset
+    from model import LuminaLMConfig
+    with open(args.config_path, 'r') as config_file:
+        config_data = yaml.safe_load(config_file)
+    model_config = LuminaLMConfig(**config_data['model'])
+    cache_dir = config_data['training'].get('token_cache_dir', "token_cache")
+    tokenizer = Tokenizer.from_file(args.tokenizer)
+    for dataset_name, splits in {"squad": ["train", "validation"], "trivia_qa": ["train"], "nq_open": ["train"]}.items():
+        for split in splits:
+            try:
+                cache = load_or_build_token_cache(
+                    load_dataset(dataset_name, split=split), tokenizer, cache_dir, model_config.block_size,
+                    model_config.pad_token_id, source=f"{dataset_name}/{split}", num_proc=args.num_proc,
+                    max_targets=args.max_targets
+                )
+                logger.info(f"{dataset_name}/{split}: {len(cache)} examples at {cache.path}")
+            except Exception as e:
+                logger.error(f"Error caching dataset '{dataset_name}' split '{split}': {e}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
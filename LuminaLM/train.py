@@ -1,21 +1,43 @@
 import os
 import torch
 import torch.nn as nn
-import torch.optim as optim
 import logging
 import yaml
 from torch.utils.data import DataLoader, ConcatDataset, random_split
+from torch.utils.data.distributed import DistributedSampler
 from datasets import load_dataset, DatasetDict
-from transformers import DataCollatorWithPadding, get_linear_schedule_with_warmup
+from transformers import get_linear_schedule_with_warmup
 from tokenizers import Tokenizer
 from tqdm import tqdm
 from model import LuminaLM, LuminaLMConfig
+from compiled import CompiledLuminaLM, DEFAULT_LENGTH_BUCKETS
+from checkpointing import select_checkpoint_policy
+from distributed import (
+    DistributedConfig, init_distributed, cleanup_distributed, is_distributed, is_main_process,
+    get_rank, get_world_size, main_process_first, wrap_model, unwrap_model, reduce_mean, broadcast_object
+)
+from sharding import build_optimizer, clip_grad_norm, gather_full_state
+from comm_hooks import register_comm_hook
+from pipeline import PipelineParallel
+from training_state import AsyncCheckpointer, ResumableSampler
+from token_cache import load_or_build_token_cache
+from packing import PackedDataset, collate_packed, example_lengths
+from collator import LuminaLMCollator, TokenBudgetBatchSampler
+from multi_target import MultiTargetCollator, encoder_pass_savings, group_weighted_loss, target_counts
+from feature_store import EncoderFeatureDataset, FeatureCollator, freeze_encoder, load_or_build_feature_store
+from lora import LoRAConfig, add_lora, save_adapter
+from optim8bit import build_optimizer_class
 from torch.utils.tensorboard import SummaryWriter
 import argparse
 
 # Argument Parser for YAML Config File
+# Single process: python train.py --config_path config.yaml
+# Multi-process (DDP): torchrun --nproc_per_node N train.py --config_path config.yaml
+# Resume after preemption: python train.py --config_path config.yaml --resume
 parser = argparse.ArgumentParser()
 parser.add_argument("--config_path", type=str, required=True, help="Path to configuration YAML file.")
+parser.add_argument("--resume", type=str, nargs="?", const="latest",
+                    help="Resume from a checkpoint directory, or the latest complete one when no path is given.")
 args = parser.parse_args()
 
 # Load YAML Configurations
@@ -31,15 +53,18 @@ training_config = config_data['training']
 # Logging Configuration
 logging_config = config_data['logging']
 
-# Set up logging configuration
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# Distributed Configuration (optional section)
+distributed_config = DistributedConfig(**config_data.get('distributed', {}))
+
+# Device and process group; a no-op outside torchrun
+device = init_distributed(distributed_config.backend)
 
-# Device Configuration
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# Set up logging configuration, only rank 0 logs progress
+logging.basicConfig(level=logging.INFO if is_main_process() else logging.WARNING)
+logger = logging.getLogger(__name__)
 
-# TensorBoard SummaryWriter
-writer = SummaryWriter(log_dir=logging_config['tensorboard_log_dir'])
+# TensorBoard SummaryWriter on rank 0
+writer = SummaryWriter(log_dir=logging_config['tensorboard_log_dir']) if is_main_process() else None
 
 # Dataset Dictionary: Include Different Datasets and Splits
 dataset_dict = {
@@ -51,25 +76,29 @@ dataset_dict = {
 # Load Tokenizer
 tokenizer = Tokenizer.from_file("Medical_tokenizer.json")
 
-# Preprocessing Function for QA Datasets
-def preprocess_function(examples):
-    input_texts = ["question: " + q + " context: " + c for q, c in zip(examples["question"], examples["context"])]
-    inputs = [tokenizer.encode(text).ids[:model_config.block_size] for text in input_texts]
-    targets = [tokenizer.encode(answer["text"][0]).ids[:model_config.block_size] if len(answer["text"]) > 0 else [model_config.pad_token_id] for answer in examples["answers"]]
-    return {"input_ids": inputs, "decoder_input_ids": targets}
-
 # Load and Preprocess Datasets
 datasets = []
 
-for dataset_name, splits in dataset_dict.items():
-    for split in splits:
-        try:
-            dataset = load_dataset(dataset_name, split=split)
-            tokenized_dataset = dataset.map(preprocess_function, batched=True)
-            datasets.append(tokenized_dataset)
-            logger.info(f"Loaded and tokenized dataset '{dataset_name}' split '{split}'")
-        except Exception as e:
-            logger.error(f"Error loading dataset '{dataset_name}' split '{split}': {e}")
+# Shared-encoder training keeps every distinct answer of an example and encodes each input once
+multi_target = training_config.get('multi_target', False)
+max_targets = training_config.get('max_targets', 4) if multi_target else 1
+
+# Rank 0 downloads and tokenizes first; the other ranks then memory-map the token caches it wrote.
+# A cache is reused as long as the tokenizer, block_size and source dataset are unchanged.
+with main_process_first():
+    for dataset_name, splits in dataset_dict.items():
+        for split in splits:
+            try:
+                dataset = load_dataset(dataset_name, split=split)
+                tokenized_dataset = load_or_build_token_cache(
+                    dataset, tokenizer, training_config.get('token_cache_dir', "token_cache"), model_config.block_size,
+                    model_config.pad_token_id, source=f"{dataset_name}/{split}",
+                    num_proc=training_config.get('tokenize_num_proc', 1), max_targets=max_targets
+                )
+                datasets.append(tokenized_dataset)
+                logger.info(f"Loaded and tokenized dataset '{dataset_name}' split '{split}'")
+            except Exception as e:
+                logger.error(f"Error loading dataset '{dataset_name}' split '{split}': {e}")
 
 # Combine All Loaded Datasets
 combined_dataset = ConcatDataset(datasets)
@@ -77,12 +106,76 @@ combined_dataset = ConcatDataset(datasets)
 # Split Combined Dataset into Training and Validation Sets
 train_size = int(0.9 * len(combined_dataset))
 val_size = len(combined_dataset) - train_size
-train_dataset, val_dataset = random_split(combined_dataset, [train_size, val_size])
-
-# DataLoader with Padding Collator
-data_collator = DataCollatorWithPadding(tokenizer=tokenizer, pad_to_multiple_of=model_config.block_size)
-train_loader = DataLoader(train_dataset, batch_size=training_config['batch_size'], collate_fn=data_collator, shuffle=True)
-val_loader = DataLoader(val_dataset, batch_size=training_config['batch_size'], collate_fn=data_collator)
+# Seeded so that every rank gets the same split
+train_dataset, val_dataset = random_split(
+    combined_dataset, [train_size, val_size], generator=torch.Generator().manual_seed(distributed_config.seed)
+)
+
+# Optional sequence packing: several examples per fixed-length row, isolated by block-diagonal masks
+packing = training_config.get('packing', False)
+if packing and multi_target:
+    raise ValueError("Sequence packing and multi_target training cannot be combined.")
+if (packing or multi_target) and (distributed_config.pipeline_parallel or training_config.get('compile', False)):
+    raise ValueError("Sequence packing and multi_target training are not supported with pipeline_parallel or compile.")
+if multi_target:
+    logger.info(f"Multi-target training saves {encoder_pass_savings(train_dataset):.1%} of the encoder passes")
+if packing:
+    train_dataset, val_dataset = (
+        PackedDataset(
+            dataset,
+            training_config.get('packing_encoder_length', model_config.block_size),
+            training_config.get('packing_decoder_length', model_config.block_size),
+            model_config.pad_token_id, model_config.bos_token_id, model_config.eos_token_id
+        )
+        for dataset in (train_dataset, val_dataset)
+    )
+
+# Optional frozen-encoder fine-tuning: the decoder trains on encoder features computed once and stored on disk
+frozen_encoder = training_config.get('freeze_encoder', False)
+if frozen_encoder:
+    if packing or multi_target or distributed_config.pipeline_parallel or training_config.get('compile', False):
+        raise ValueError("freeze_encoder is not supported with packing, multi_target, pipeline_parallel or compile.")
+    if distributed_config.sharding.startswith("fsdp"):
+        raise ValueError("freeze_encoder needs the full encoder on every rank; use sharding 'none' or 'zero1'.")
+    train_dataset, val_dataset = EncoderFeatureDataset(train_dataset), EncoderFeatureDataset(val_dataset)
+
+# Each rank reads its own shard; batch_size is per process. Pipeline stages (and a single process) read
+# one seeded order, so every epoch's order can be reproduced when resuming.
+# With max_tokens, batches instead hold similar-length examples up to a padded token budget per process.
+max_tokens = None if packing else training_config.get('max_tokens')
+if max_tokens and distributed_config.pipeline_parallel:
+    raise ValueError("Token-budget batching is not supported with pipeline_parallel.")
+collator_class = MultiTargetCollator if multi_target else FeatureCollator if frozen_encoder else LuminaLMCollator
+data_collator = collate_packed if packing else collator_class(
+    model_config.pad_token_id, model_config.bos_token_id, model_config.eos_token_id, max_length=model_config.block_size
+)
+if max_tokens:
+    # Budgeted by the padded encoder and decoder lengths the collator produces, after its truncation
+    target_field = "targets" if multi_target else "decoder_input_ids"
+    train_lengths, val_lengths = (
+        data_collator.budget_lengths(
+            example_lengths(dataset), example_lengths(dataset, target_field), target_counts(dataset) if multi_target else None
+        )
+        for dataset in (train_dataset, val_dataset)
+    )
+    train_sampler = ResumableSampler(TokenBudgetBatchSampler(
+        train_lengths, max_tokens, max_batch_size=training_config.get('max_batch_size'), seed=distributed_config.seed
+    ))
+    val_sampler = TokenBudgetBatchSampler(val_lengths, max_tokens, shuffle=False)
+    train_loader = DataLoader(train_dataset, batch_sampler=train_sampler, collate_fn=data_collator)
+    val_loader = DataLoader(val_dataset, batch_sampler=val_sampler, collate_fn=data_collator)
+else:
+    val_sampler = None
+    if is_distributed() and not distributed_config.pipeline_parallel:
+        train_sampler = DistributedSampler(train_dataset, shuffle=True, seed=distributed_config.seed)
+        val_sampler = DistributedSampler(val_dataset, shuffle=False)
+    else:
+        train_sampler = DistributedSampler(train_dataset, num_replicas=1, rank=0, shuffle=True, seed=distributed_config.seed)
+    train_sampler = ResumableSampler(train_sampler)
+    train_loader = DataLoader(
+        train_dataset, batch_size=training_config['batch_size'], collate_fn=data_collator, sampler=train_sampler
+    )
+    val_loader = DataLoader(val_dataset, batch_size=training_config['batch_size'], collate_fn=data_collator, sampler=val_sampler)
 
 # Load Model
 model = LuminaLM(model_config).to(device)
@@ -97,19 +190,72 @@ if os.path.exists(embedding_path):
     except Exception as e:
         logger.error(f"Error loading embeddings: {e}")
 
-# Multi-GPU Support
-if torch.cuda.device_count() > 1:
-    logger.info(f"Using {torch.cuda.device_count()} GPUs for training.")
-    model = nn.DataParallel(model)
-
-# Optimizer, Scheduler, and Early Stopping
-optimizer = optim.AdamW(model.parameters(), lr=training_config['learning_rate'], weight_decay=training_config['weight_decay'])
+# Frozen before wrapping, so DDP only synchronizes the decoder gradients
+if frozen_encoder:
+    freeze_encoder(model)
+
+# Optional LoRA fine-tuning: only the adapter is trained, synchronized, given optimizer state and saved
+lora_config = LoRAConfig(**training_config['lora']) if training_config.get('lora') else None
+adapter_name = training_config.get('lora_adapter_name', "default")
+if lora_config is not None:
+    if frozen_encoder or distributed_config.pipeline_parallel or distributed_config.sharding.startswith("fsdp"):
+        raise ValueError("LoRA is not supported with freeze_encoder, pipeline_parallel or FSDP sharding.")
+    add_lora(model, lora_config, adapter_name)
+
+# Resolve the memory-budget checkpoint policy on a sample batch. Step timings differ between ranks, so
+# rank 0 profiles and every rank applies its choice: all ranks must run the same graph.
+if model_config.use_checkpoint and model_config.checkpoint_policy == "budget":
+    checkpoint_policy = None
+    if is_main_process():
+        sample_batch = next(iter(train_loader))
+        checkpoint_policy, _ = select_checkpoint_policy(
+            model, int(model_config.checkpoint_budget_mb * 2**20), sample_batch["input_ids"].to(device),
+            sample_batch["decoder_input_ids"].to(device), sample_batch["attention_mask"].to(device)
+        )
+    model.set_checkpoint_policy(broadcast_object(checkpoint_policy))
+
+# Multi-process Support: DistributedDataParallel with bucketed gradient all-reduce, FSDP sharding,
+# or one pipeline stage per process
+if distributed_config.pipeline_parallel and is_distributed():
+    model = PipelineParallel(model, distributed_config.num_microbatches, distributed_config.pipeline_layers)
+    logger.info(f"Training a {get_world_size()}-stage pipeline with {distributed_config.num_microbatches} micro-batches.")
+else:
+    model = wrap_model(model, device, distributed_config)
+    if is_distributed():
+        logger.info(f"Training on {get_world_size()} processes with sharding '{distributed_config.sharding}'.")
+# Optional gradient compression of the DDP all-reduce; comm_stats counts the bytes sent
+comm_stats = register_comm_hook(model, distributed_config)
+
+# Optimizer (state partitioned across ranks with zero1), Scheduler, and Early Stopping
+# "adamw8bit" keeps both AdamW moments block-wise quantized to 8 bits (see optim8bit.py)
+optimizer_name = training_config.get('optimizer', 'adamw')
+if optimizer_name == "adamw8bit" and distributed_config.sharding.startswith("fsdp"):
+    raise ValueError("optimizer 'adamw8bit' is not supported with FSDP sharding; use sharding 'none' or 'zero1'.")
+optimizer = build_optimizer(
+    model, distributed_config.sharding, build_optimizer_class(optimizer_name),
+    lr=training_config['learning_rate'], weight_decay=training_config['weight_decay']
+)
 num_training_steps = len(train_loader) * training_config['num_epochs']
 scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=training_config['warmup_steps'], num_training_steps=num_training_steps)
 
 # Loss Function
 criterion = nn.CrossEntropyLoss(ignore_index=model_config.pad_token_id)
 
+# Step-interval checkpoints of the full training state, written in the background
+checkpointer = AsyncCheckpointer(
+    training_config.get('checkpoint_dir', "checkpoints"),
+    interval_steps=training_config.get('checkpoint_interval_steps', 500),
+    keep_last=training_config.get('keep_last_checkpoints', 3),
+)
+
+# Optional torch.compile of the training loss over padded length buckets
+compiled_model = None
+if training_config.get('compile', False) and not isinstance(model, PipelineParallel):
+    compiled_model = CompiledLuminaLM(
+        unwrap_model(model), training_config.get('length_buckets', DEFAULT_LENGTH_BUCKETS), criterion, train_module=model
+    )
+    logger.info(f"Compiling training step with length buckets {compiled_model.length_buckets}")
+
 # Early Stopping Mechanism
 class EarlyStopping:
     def __init__(self, patience=training_config['early_stopping_patience'], min_delta=0.0):
@@ -133,36 +279,60 @@ class EarlyStopping:
 early_stopping = EarlyStopping()
 
 # Training Loop
-def train_one_epoch(model, train_loader, optimizer, scheduler, criterion, device, epoch: int, max_grad_norm: float = 1.0):
+def train_one_epoch(model, train_loader, optimizer, scheduler, criterion, device, epoch: int, max_grad_norm: float = 1.0, compiled_model=None, start_batch: int = 0):
     model.train()
     total_loss = 0
-    for batch_idx, batch in enumerate(tqdm(train_loader, desc=f"Training Epoch {epoch+1}")):
-        input_ids = torch.tensor(batch["input_ids"]).to(device)
-        labels = torch.tensor(batch["decoder_input_ids"]).to(device)
+    num_batches = 0
+    batches = tqdm(train_loader, desc=f"Training Epoch {epoch+1}", disable=not is_main_process())
+    for batch_idx, batch in enumerate(batches, start=start_batch):
+        # Model inputs and labels; packed and multi-target rows also carry their own masks and per-example
+        # positions, and multi-target rows per-token loss weights that average the loss per group
+        inputs = {key: value.to(device) for key, value in batch.items()}
+        labels = inputs.pop("labels")
+        loss_weights = inputs.pop("loss_weights", None)
 
         optimizer.zero_grad()
-        outputs = model(input_ids=input_ids, decoder_input_ids=input_ids)
-        logits = outputs.view(-1, outputs.size(-1))
-
-        loss = criterion(logits, labels.view(-1))
-        loss.backward()
+        if isinstance(model, PipelineParallel):
+            # Forward and backward of every micro-batch, through all stages
+            loss = model.train_step(
+                inputs["input_ids"], inputs["decoder_input_ids"], labels, criterion, inputs["attention_mask"]
+            )
+        else:
+            if compiled_model is not None:
+                loss = compiled_model.loss(inputs["input_ids"], inputs["decoder_input_ids"], labels, inputs["attention_mask"])
+            elif loss_weights is not None:
+                loss = group_weighted_loss(model(**inputs), labels, loss_weights)
+            else:
+                outputs = model(**inputs)
+                logits = outputs.view(-1, outputs.size(-1))
+                loss = criterion(logits, labels.view(-1))
+            loss.backward()
 
         # Gradient clipping for stability
         if max_grad_norm:
-            nn.utils.clip_grad_norm_(model.parameters(), max_grad_norm)
+            clip_grad_norm(model, max_grad_norm)
 
         optimizer.step()
         scheduler.step()
 
         total_loss += loss.item()
+        num_batches += 1
+
+        # Log the training loss; scheduler.last_epoch counts optimizer steps, across resumes too
+        global_step = scheduler.last_epoch
+        if writer is not None and batch_idx % 10 == 0:
+            writer.add_scalar('Training Loss', loss.item(), global_step)
 
-        # Log the training loss
-        if batch_idx % 10 == 0:
-            writer.add_scalar('Training Loss', loss.item(), epoch * len(train_loader) + batch_idx)
+        if checkpointer.should_save(global_step):
+            checkpointer.save(
+                global_step, model, optimizer, scheduler, epoch=epoch, batch_in_epoch=batch_idx + 1,
+                extra={'best_val_loss': best_val_loss, 'early_stopping': vars(early_stopping)}
+            )
 
-    avg_loss = total_loss / len(train_loader)
+    avg_loss = reduce_mean(total_loss / max(num_batches, 1), device)
     logger.info(f"Training Loss after Epoch {epoch+1}: {avg_loss}")
-    writer.add_scalar('Average Training Loss per Epoch', avg_loss, epoch)
+    if writer is not None:
+        writer.add_scalar('Average Training Loss per Epoch', avg_loss, epoch)
     return avg_loss
 
 # Validation Loop
@@ -170,19 +340,28 @@ def validate_one_epoch(model, val_loader, criterion, device, epoch: int):
     model.eval()
     total_loss = 0
     with torch.no_grad():
-        for batch in tqdm(val_loader, desc=f"Validating Epoch {epoch+1}"):
-            input_ids = torch.tensor(batch["input_ids"]).to(device)
-            labels = torch.tensor(batch["decoder_input_ids"]).to(device)
-
-            outputs = model(input_ids=input_ids, decoder_input_ids=input_ids)
-            logits = outputs.view(-1, outputs.size(-1))
-
-            loss = criterion(logits, labels.view(-1))
+        for batch in tqdm(val_loader, desc=f"Validating Epoch {epoch+1}", disable=not is_main_process()):
+            inputs = {key: value.to(device) for key, value in batch.items()}
+            labels = inputs.pop("labels")
+            loss_weights = inputs.pop("loss_weights", None)
+
+            if isinstance(model, PipelineParallel):
+                loss = model.eval_step(
+                    inputs["input_ids"], inputs["decoder_input_ids"], labels, criterion, inputs["attention_mask"]
+                )
+            elif loss_weights is not None:
+                loss = group_weighted_loss(model(**inputs), labels, loss_weights)
+            else:
+                outputs = model(**inputs)
+                logits = outputs.view(-1, outputs.size(-1))
+                loss = criterion(logits, labels.view(-1))
             total_loss += loss.item()
 
-    avg_loss = total_loss / len(val_loader)
+    # Every rank sees the same average, so early stopping stays in sync
+    avg_loss = reduce_mean(total_loss / len(val_loader), device)
     logger.info(f"Validation Loss after Epoch {epoch+1}: {avg_loss}")
-    writer.add_scalar('Validation Loss', avg_loss, epoch)
+    if writer is not None:
+        writer.add_scalar('Validation Loss', avg_loss, epoch)
     return avg_loss
 
 # Generate Function - Called after Each Epoch
@@ -209,11 +388,39 @@ def generate_response(model, prompt: str, max_length: int = 50):
 num_epochs = training_config['num_epochs']
 best_val_loss = float('inf')
 
-for epoch in range(num_epochs):
+# Restore model, optimizer, scheduler, RNG and data position; the sampler skips the batches already seen
+start_epoch, start_batch = 0, 0
+if args.resume:
+    resumed = checkpointer.load(None if args.resume == "latest" else args.resume, model, optimizer, scheduler, map_location=device)
+    if resumed is not None:
+        start_epoch, start_batch = resumed['epoch'], resumed['batch_in_epoch']
+        best_val_loss = resumed['extra'].get('best_val_loss', best_val_loss)
+        vars(early_stopping).update(resumed['extra'].get('early_stopping', {}))
+
+# Encoder features of the final (restored) frozen encoder; rebuilt whenever its weights differ from the stored ones
+if frozen_encoder:
+    with main_process_first():
+        for features in (train_dataset, val_dataset):
+            features.store = load_or_build_feature_store(
+                unwrap_model(model), features.dataset, training_config.get('encoder_feature_dir', "encoder_features"),
+                training_config['batch_size'], device, model_config.block_size
+            )
+
+for epoch in range(start_epoch, num_epochs):
     # Train and Validate
     try:
-        train_loss = train_one_epoch(model, train_loader, optimizer, scheduler, criterion, device, epoch, max_grad_norm=training_config['max_grad_norm'])
+        train_sampler.set_epoch(epoch)
+        epoch_start_batch = start_batch if epoch == start_epoch else 0
+        # Token-budget batch samplers yield whole batches, index samplers single examples
+        train_sampler.skip_samples(epoch_start_batch * (1 if max_tokens else training_config['batch_size']))
+        train_loss = train_one_epoch(model, train_loader, optimizer, scheduler, criterion, device, epoch, max_grad_norm=training_config['max_grad_norm'], compiled_model=compiled_model, start_batch=epoch_start_batch)
         val_loss = validate_one_epoch(model, val_loader, criterion, device, epoch)
+        if comm_stats is not None and is_main_process():
+            logger.info(
+                f"Gradient communication: {comm_stats.bytes_per_step() / 2**20:.2f} MiB/step "
+                f"({comm_stats.compression_ratio():.1f}x compression, hook '{distributed_config.comm_hook}')"
+            )
+            writer.add_scalar('Gradient MiB per Step', comm_stats.bytes_per_step() / 2**20, epoch)
 
         # Early Stopping
         early_stopping(val_loss)
@@ -224,17 +431,34 @@ for epoch in range(num_epochs):
         # Save model if validation improves
         if val_loss < best_val_loss:
             best_val_loss = val_loss
-            model.save_pretrained("best_model")
-            logger.info("Saved Best Model with Validation Loss: {:.4f}".format(best_val_loss))
-
-        # Generate Response after Epoch
-        prompt = "What are the symptoms of diabetes?"
-        generate_response(model, prompt)
+            if lora_config is not None:
+                if is_main_process():
+                    save_adapter(unwrap_model(model), "best_adapter", adapter_name)
+            else:
+                # Collective: sharded weights are gathered onto rank 0
+                model_state, _ = gather_full_state(model)
+                if is_main_process():
+                    unwrap_model(model).save_pretrained("best_model", state_dict=model_state)
+            if is_main_process():
+                logger.info("Saved Best Model with Validation Loss: {:.4f}".format(best_val_loss))
+
+        # Generate Response after Epoch; FSDP-sharded weights and pipeline stages cannot run on rank 0 alone
+        if is_main_process() and distributed_config.sharding not in ("fsdp", "fsdp_grad_op") and not isinstance(model, PipelineParallel):
+            prompt = "What are the symptoms of diabetes?"
+            generate_response(unwrap_model(model), prompt)
 
     except Exception as e:
-        logger.error(f"An error occurred during training at epoch {epoch+1}: {e}")
+        logger.error(f"An error occurred during training at epoch {epoch+1} on rank {get_rank()}: {e}")
         raise
 
 # Save Final Model
-model.save_pretrained("final_model")
-logger.info("Final model saved.")
+checkpointer.close()
+if lora_config is not None:
+    if is_main_process():
+        save_adapter(unwrap_model(model), "final_adapter", adapter_name)
+else:
+    model_state, _ = gather_full_state(model)
+    if is_main_process():
+        unwrap_model(model).save_pretrained("final_model", state_dict=model_state)
+        logger.info("Final model saved.")
+cleanup_distributed()
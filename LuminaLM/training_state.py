@@ -0,0 +1,266 @@
+"""
+Resumable training state with asynchronous background checkpointing.
+
+Every `interval_steps` optimizer steps, `AsyncCheckpointer.save` copies the
+model, optimizer, scheduler and RNG states of this rank, plus the position in
+the epoch, to CPU memory. A background thread then writes the copy to
+`<directory>/step_<N>/rank<r>-of-<w>.pt` through a temporary file and an
+atomic rename, so training only pauses for the memory copy. A checkpoint is
+complete once every rank's file exists. The `keep_last` newest complete
+checkpoints are kept and older ones are deleted.
+
+`AsyncCheckpointer.load` restores all of it. `ResumableSampler` then skips the
+samples the interrupted epoch had already consumed. It skips indices without
+loading any batches.
+
+Sharded training state is saved per rank as well: each rank keeps its ZeRO
+optimizer partition, its FSDP shards or its pipeline stage.
+"""
+import os
+import re
+import time
+import random
+import shutil
+import logging
+import threading
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+from torch.utils.data import Sampler
+from torch.distributed.optim import ZeroRedundancyOptimizer
+from torch.distributed.fsdp import FullyShardedDataParallel, StateDictType
+from distributed import get_rank, get_world_size, unwrap_model
+
+logger = logging.getLogger(__name__)
+
+_CHECKPOINT_DIR = re.compile(r"^step_(\d+)$")
+_RANK_FILE = re.compile(r"^rank(\d+)-of-(\d+)\.pt$")
+
+
+class ResumableSampler(Sampler):
+    """
+    Wraps a sampler so the next epoch can start part-way through its order.
+
+    The wrapped sampler must give the same order for the same epoch, e.g. a seeded DistributedSampler.
+    """
+    def __init__(self, sampler: Sampler):
+        self.sampler = sampler
+        self.skip = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+
+    def skip_samples(self, num_samples: int) -> None:
+        """Drop the first num_samples indices of the next iteration only."""
+        self.skip = num_samples
+
+    def __iter__(self) -> Iterator[int]:
+        indices = list(self.sampler)[self.skip:]
+        self.skip = 0
+        return iter(indices)
+
+    def __len__(self) -> int:
+        return max(len(self.sampler) - self.skip, 0)
+
+
+def _to_cpu(value: Any) -> Any:
+    """Copy of nested state with every tensor detached into CPU memory."""
+    if isinstance(value, torch.Tensor):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, dict):
+        return {key: _to_cpu(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_cpu(item) for item in value)
+    return value
+
+
+def rng_state() -> Dict[str, Any]:
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state: Dict[str, Any]) -> None:
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def capture_training_state(model: nn.Module, optimizer: optim.Optimizer) -> Dict[str, Any]:
+    """This rank's model and optimizer state, in the form load_training_state expects."""
+    if isinstance(model, FullyShardedDataParallel):
+        with FullyShardedDataParallel.state_dict_type(model, StateDictType.SHARDED_STATE_DICT):
+            return {
+                'model': model.state_dict(),
+                'optimizer': FullyShardedDataParallel.optim_state_dict(model, optimizer),
+            }
+    # ZeRO keeps the state of this rank's partition in its local optimizer
+    local_optimizer = optimizer.optim if isinstance(optimizer, ZeroRedundancyOptimizer) else optimizer
+    return {'model': unwrap_model(model).state_dict(), 'optimizer': local_optimizer.state_dict()}
+
+
+def load_training_state(state: Dict[str, Any], model: nn.Module, optimizer: optim.Optimizer) -> None:
+    """Load a capture_training_state snapshot into the same (wrapped) model and optimizer on the same rank."""
+    if isinstance(model, FullyShardedDataParallel):
+        with FullyShardedDataParallel.state_dict_type(model, StateDictType.SHARDED_STATE_DICT):
+            model.load_state_dict(state['model'])
+            optimizer.load_state_dict(FullyShardedDataParallel.optim_state_dict_to_load(model, optimizer, state['optimizer']))
+        return
+    unwrap_model(model).load_state_dict(state['model'])
+    if isinstance(optimizer, ZeroRedundancyOptimizer):
+        optimizer.optim.load_state_dict(state['optimizer'])
+        # The wrapper's param groups are copied onto the local optimizer at every step
+        for group, local_group in zip(optimizer.param_groups, optimizer.optim.param_groups):
+            group.update({key: value for key, value in local_group.items() if key != 'params'})
+    else:
+        optimizer.load_state_dict(state['optimizer'])
+
+
+def complete_checkpoints(directory: str) -> List[str]:
+    """Checkpoint directories whose files from every rank exist, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    checkpoints = []
+    for name in os.listdir(directory):
+        match = _CHECKPOINT_DIR.match(name)
+        path = os.path.join(directory, name)
+        if match is None or not os.path.isdir(path):
+            continue
+        ranks = [_RANK_FILE.match(file) for file in os.listdir(path)]
+        ranks = [(int(m.group(1)), int(m.group(2))) for m in ranks if m is not None]
+        if ranks and {rank for rank, _ in ranks} == set(range(ranks[0][1])):
+            checkpoints.append((int(match.group(1)), path))
+    return [path for _, path in sorted(checkpoints)]
+
+
+def latest_checkpoint(directory: str) -> Optional[str]:
+    checkpoints = complete_checkpoints(directory)
+    return checkpoints[-1] if checkpoints else None
+
+
+class AsyncCheckpointer:
+    """
+    Step-interval checkpoints of the full training state, written in a background thread.
+
+    Args:
+        directory (str): Checkpoint root directory.
+        interval_steps (int): Save every interval_steps optimizer steps; 0 disables step checkpoints.
+        keep_last (int): Complete checkpoints to keep; older ones are deleted.
+    """
+    def __init__(self, directory: str, interval_steps: int = 500, keep_last: int = 3):
+        if keep_last < 1:
+            raise ValueError("keep_last must be a positive integer.")
+        self.directory = directory
+        self.interval_steps = interval_steps
+        self.keep_last = keep_last
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._pending: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    def should_save(self, step: int) -> bool:
+        return self.interval_steps > 0 and step > 0 and step % self.interval_steps == 0
+
+    def save(
+        self,
+        step: int,
+        model: nn.Module,
+        optimizer: optim.Optimizer,
+        scheduler: Optional[Any] = None,
+        epoch: int = 0,
+        batch_in_epoch: int = 0,
+        extra: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """
+        Snapshot the training state to CPU memory and write it in the background.
+
+        Args:
+            step (int): Optimizer steps done so far.
+            epoch (int): Current epoch.
+            batch_in_epoch (int): Batches of this epoch already trained on.
+            extra (Optional[Dict[str, Any]]): Further picklable state, e.g. early stopping counters.
+        """
+        start = time.perf_counter()
+        state = _to_cpu({
+            **capture_training_state(model, optimizer),
+            'scheduler': scheduler.state_dict() if scheduler is not None else None,
+            'rng': rng_state(),
+            'step': step,
+            'epoch': epoch,
+            'batch_in_epoch': batch_in_epoch,
+            'extra': extra or {},
+        })
+        # At most one write in flight, so at most two snapshots are held in memory
+        self.wait()
+        path = os.path.join(self.directory, f"step_{step:08d}", f"rank{get_rank()}-of-{get_world_size()}.pt")
+        self._pending = self._executor.submit(self._write, state, path)
+        logger.info(f"Snapshot of step {step} taken in {time.perf_counter() - start:.2f}s; writing {path}")
+
+    def _write(self, state: Dict[str, Any], path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        if get_rank() == 0:
+            self._prune()
+
+    def _prune(self) -> None:
+        with self._lock:
+            for path in complete_checkpoints(self.directory)[:-self.keep_last]:
+                shutil.rmtree(path, ignore_errors=True)
+                logger.info(f"Removed old checkpoint {path}")
+
+    def wait(self) -> None:
+        """Block until the pending write has finished, re-raising its error if it failed."""
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def close(self) -> None:
+        self.wait()
+        self._executor.shutdown()
+
+    def load(
+        self,
+        path: Optional[str],
+        model: nn.Module,
+        optimizer: optim.Optimizer,
+        scheduler: Optional[Any] = None,
+        map_location: Optional[torch.device] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Restore this rank's training state from a checkpoint directory.
+
+        Args:
+            path (Optional[str]): Checkpoint directory; None picks the latest complete one.
+
+        Returns:
+            Optional[Dict[str, Any]]: step, epoch, batch_in_epoch and extra of the checkpoint, or
+            None when there is nothing to resume from.
+        """
+        path = path or latest_checkpoint(self.directory)
+        if path is None:
+            logger.info(f"No complete checkpoint in {self.directory}; starting from scratch")
+            return None
+        state = torch.load(
+            os.path.join(path, f"rank{get_rank()}-of-{get_world_size()}.pt"), map_location=map_location, weights_only=False
+        )
+        load_training_state(state, model, optimizer)
+        if scheduler is not None and state['scheduler'] is not None:
+            scheduler.load_state_dict(state['scheduler'])
+        set_rng_state(state['rng'])
+        logger.info(f"Resumed from {path}: epoch {state['epoch'] + 1}, batch {state['batch_in_epoch']}, step {state['step']}")
+        return {key: state[key] for key in ('step', 'epoch', 'batch_in_epoch', 'extra')}